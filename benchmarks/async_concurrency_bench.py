@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Hundreds of concurrent analyses in one process with the asyncio API.
+
+The model is replaced by a stub that sleeps for --latency seconds, so this
+measures how many analyses our own code keeps in flight and how many OS
+threads it needs to do so.
+
+Usage: python -m benchmarks.async_concurrency_bench [--requests 500] [--latency 2.0] [--preprocess]
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+from benchmarks.fake_model import FakeGenerativeModel, fake_model_factory, make_test_image
+from src.gemini_strategy import analyze_egyptian_art_with_gemini_async, set_model_factory
+
+
+async def run(requests, image_bytes, preprocess):
+    peak_threads = threading.active_count()
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_threads())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        analyze_egyptian_art_with_gemini_async(image_bytes, speed='fast', use_cache=False, preprocess=preprocess)
+        for _ in range(requests)
+    ))
+    wall_time = time.perf_counter() - start
+    sampler.cancel()
+    return results, wall_time, peak_threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent async analyses against a stubbed model')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=2.0)
+    parser.add_argument('--preprocess', action='store_true',
+                        help='Include the CPU-bound resize/re-encode stage (caps concurrency at CPU throughput)')
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    set_model_factory(fake_model_factory(latency=args.latency))
+    FakeGenerativeModel.reset_counters()
+    image_bytes = make_test_image(320, 240)
+
+    results, wall_time, peak_threads = asyncio.run(
+        run(args.requests, image_bytes, None if args.preprocess else False)
+    )
+    succeeded = sum(1 for result in results if result["failure_status"] == "success")
+
+    print(f"Requests: {args.requests}, model latency: {args.latency:.1f}s")
+    print(f"Succeeded: {succeeded}")
+    print(f"Wall time: {wall_time:.2f}s (serial would be {args.requests * args.latency:.0f}s)")
+    print(f"Peak concurrent model calls: {FakeGenerativeModel.max_in_flight}")
+    print(f"Peak OS threads: {peak_threads}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Latency of speed='auto' (flash-lite first, escalating unsure answers) against
+pro-only (speed='regular') over a set of images.
+
+Every image is analyzed once on each mode, one after the other, with the
+result cache off. The report lists per image the pro-only time, the cascade
+time, the tiers it went through and the confidence of the answer it kept,
+then the total latency saved and how often each tier had the last word.
+
+By default the model is a stub: per-tier latencies from --latencies, and
+per-tier skill (--skill) deciding which images a tier answers confidently
+(see benchmarks.fake_model). With --live the real API is called (needs
+GOOGLE_API_KEY) and the numbers are what the sample images actually cost.
+
+Usage: python -m benchmarks.cascade_bench [--images data/sample-egyptian-images] [--live]
+                                          [--latencies 0.4,0.8,2.0] [--skill 0.6,0.85,1.0]
+"""
+
+import argparse
+import glob
+import os
+import statistics
+from collections import Counter
+
+from src.cascade import AUTO_SPEED, CASCADE_SPEEDS
+from src.gemini_strategy import SPEED_TO_MODEL, analyze_egyptian_art_with_gemini, set_model_factory
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.webp')
+
+
+def load_images(directory, count):
+    """(name, bytes) of the images in directory, or count synthetic ones when it has none."""
+    paths = sorted(path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(directory, pattern)))
+    if paths:
+        images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                images.append((os.path.basename(path), f.read()))
+        return images
+    from benchmarks.fake_model import make_test_image
+    print(f"No images in {directory}; using {count} synthetic ones")
+    return [(f"synthetic-{seed}", make_test_image(640, 480, seed=seed)) for seed in range(count)]
+
+
+def per_tier(value, cast=float):
+    """{model name: value} from a comma-separated list in CASCADE_SPEEDS order."""
+    values = [cast(part) for part in value.split(',')]
+    if len(values) != len(CASCADE_SPEEDS):
+        raise argparse.ArgumentTypeError(f"expected {len(CASCADE_SPEEDS)} comma-separated values")
+    return {SPEED_TO_MODEL[speed]: part for speed, part in zip(CASCADE_SPEEDS, values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speed='auto' against pro-only")
+    parser.add_argument('--images', default='data/sample-egyptian-images')
+    parser.add_argument('--count', type=int, default=20, help='Synthetic images when --images has none')
+    parser.add_argument('--live', action='store_true', help='Call the real Gemini API')
+    parser.add_argument('--latencies', type=per_tier, default='0.4,0.8,2.0',
+                        help='Stub latency of flash-lite, flash and pro in seconds')
+    parser.add_argument('--skill', type=per_tier, default='0.6,0.85,1.0',
+                        help='Share of images flash-lite, flash and pro answer confidently (stub only)')
+    parser.add_argument('--min-confidence', type=float)
+    args = parser.parse_args()
+
+    if not args.live:
+        from benchmarks.fake_model import fake_model_factory
+        from src import quota
+        os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+        quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+        set_model_factory(fake_model_factory(model_latencies=args.latencies, model_skill=args.skill))
+    images = load_images(args.images, args.count)
+
+    pro_times, auto_times, final_tiers = [], [], Counter()
+    confident = failed = 0
+    print(f"{'image':<28} {'pro-only':>9} {'auto':>8}  tiers (confidence)")
+    for name, image_bytes in images:
+        pro = analyze_egyptian_art_with_gemini(image_bytes, 'regular', use_cache=False, hedge=False)
+        auto = analyze_egyptian_art_with_gemini(image_bytes, AUTO_SPEED, use_cache=False, hedge=False,
+                                                min_confidence=args.min_confidence)
+        if pro['failure_status'] != 'success' or auto['failure_status'] != 'success':
+            failed += 1
+            print(f"{name[:28]:<28} failed: pro {pro['failure_status']}, auto {auto['failure_status']}")
+            continue
+        pro_times.append(pro['api_call_duration'])
+        auto_times.append(auto['api_call_duration'])
+        cascade = auto['cascade']
+        confident += cascade['confident']
+        final_tiers[cascade['tiers'][-1]['speed']] += 1
+        path = ' -> '.join(f"{tier['speed']} ({tier.get('confidence', tier['failure_status'])})"
+                           for tier in cascade['tiers'])
+        print(f"{name[:28]:<28} {pro['api_call_duration']:8.2f}s {auto['api_call_duration']:7.2f}s  {path}")
+
+    if not auto_times:
+        return
+    saved = sum(pro_times) - sum(auto_times)
+    print(f"\nImages: {len(auto_times)} ({failed} failed)")
+    print(f"pro-only: total {sum(pro_times):7.2f}s  p50 {statistics.median(pro_times):5.2f}s")
+    print(f"auto:     total {sum(auto_times):7.2f}s  p50 {statistics.median(auto_times):5.2f}s")
+    print(f"Saved {saved:.2f}s ({saved / sum(pro_times):.0%}); {confident}/{len(auto_times)} auto answers confident")
+    print("Last tier: " + ", ".join(f"{speed} {final_tiers[speed]}" for speed in CASCADE_SPEEDS))
+
+
+if __name__ == "__main__":
+    main()
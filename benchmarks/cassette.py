@@ -0,0 +1,243 @@
+"""
+Record and replay Gemini responses, so load tests run offline against real answers.
+
+A cassette is a JSONL file with one model call per line: the model name,
+whether it was streamed, the response text, its latency (and time to first
+chunk when streamed), the usage metadata and, for failed calls, the error.
+
+Recording wraps the real model built by src.gemini_strategy; install it with
+set_model_factory(recording_model_factory(path)). Replaying serves the
+recorded answers from a stand-in model with either the recorded latency
+distribution or a synthetic delay, and can inject errors (503) and malformed
+JSON on top of what was recorded:
+set_model_factory(replay_model_factory(load_cassette(path), ...)).
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from google.api_core import exceptions as api_exceptions
+
+from benchmarks.fake_model import SAMPLE_ANALYSIS, FakeResponse
+
+MALFORMED_KINDS = ('fenced', 'trailing_text', 'truncated')
+
+
+def _usage_dict(response):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None or not getattr(usage, 'total_token_count', 0):
+        return None
+    return {
+        'prompt_token_count': usage.prompt_token_count,
+        'candidates_token_count': usage.candidates_token_count,
+        'total_token_count': usage.total_token_count
+    }
+
+
+def _response_text(response):
+    try:
+        return response.text
+    except (AttributeError, ValueError, IndexError):
+        return ''
+
+
+class CassetteWriter:
+    """Appends calls to a cassette file; safe to share between threads and event loops."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as cassette:
+                cassette.write(line + '\n')
+
+
+class _RecordedStream:
+    def __init__(self, response, entry, start, writer):
+        self._response = response
+        self._entry = entry
+        self._start = start
+        self._writer = writer
+
+    async def __aiter__(self):
+        text, usage = [], None
+        try:
+            async for chunk in self._response:
+                if self._entry['first_chunk_s'] is None:
+                    self._entry['first_chunk_s'] = time.perf_counter() - self._start
+                text.append(_response_text(chunk))
+                usage = _usage_dict(chunk) or usage
+                yield chunk
+        except Exception as e:
+            self._entry['error'] = {'type': type(e).__name__, 'message': str(e)}
+            raise
+        finally:
+            self._entry.update(text=''.join(text), usage=usage, latency_s=time.perf_counter() - self._start)
+            self._writer.write(self._entry)
+
+
+class RecordingModel:
+    """Passes calls through to a real model and writes each one to the cassette."""
+
+    def __init__(self, model, model_name, writer):
+        self._model = model
+        self.model_name = model_name
+        self._writer = writer
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        entry = {'model': self.model_name, 'stream': stream, 'text': None, 'latency_s': None,
+                 'first_chunk_s': None, 'usage': None, 'error': None}
+        start = time.perf_counter()
+        try:
+            response = await self._model.generate_content_async(contents, stream=stream, **kwargs)
+        except Exception as e:
+            entry.update(latency_s=time.perf_counter() - start, error={'type': type(e).__name__, 'message': str(e)})
+            self._writer.write(entry)
+            raise
+        if stream:
+            return _RecordedStream(response, entry, start, self._writer)
+        entry.update(text=_response_text(response), usage=_usage_dict(response), latency_s=time.perf_counter() - start)
+        self._writer.write(entry)
+        return response
+
+
+def recording_model_factory(path):
+    """Model factory that builds the real Gemini models and records their calls to path."""
+    from src.gemini_strategy import _default_model_factory
+
+    writer = CassetteWriter(path)
+    return lambda model_name, **options: RecordingModel(
+        _default_model_factory(model_name, **options), model_name, writer
+    )
+
+
+def load_cassette(path):
+    """The calls recorded in a cassette file, oldest first."""
+    with open(path, encoding='utf-8') as cassette:
+        return [json.loads(line) for line in cassette if line.strip()]
+
+
+def synthetic_cassette(latency=1.0):
+    """A one-entry cassette with the stand-in analysis, for replay without a recording."""
+    return [{'model': None, 'stream': False, 'text': json.dumps(SAMPLE_ANALYSIS), 'latency_s': latency,
+             'first_chunk_s': None, 'usage': None, 'error': None}]
+
+
+def malform(text, kind):
+    """A damaged copy of a JSON response: code-fenced, with trailing text, or cut off halfway."""
+    if kind == 'fenced':
+        return f"```json\n{text}\n```"
+    if kind == 'trailing_text':
+        return f"{text}\nI hope this analysis helps!"
+    return text[:len(text) // 2]
+
+
+class ReplayModel:
+    """
+    Serves recorded calls for one model name.
+
+    delay='recorded' samples latencies from the model's recorded calls (divided
+    by speedup); delay='synthetic' uses latency +/- jitter. Recorded errors are
+    raised again as the same google.api_core exception type.
+    """
+
+    in_flight = 0
+    max_in_flight = 0
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name, entries, delay='recorded', latency=1.0, jitter=0.0, speedup=1.0,
+                 error_rate=0.0, malformed_rate=0.0, stream_chunks=16, seed=None):
+        own = [entry for entry in entries if entry['model'] == model_name]
+        self.entries = own or entries
+        self.model_name = model_name
+        self.delay = delay
+        self.latency = latency
+        self.jitter = jitter
+        self.speedup = speedup
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.stream_chunks = stream_chunks
+        self._random = random.Random(seed)
+        self._answers = [entry for entry in self.entries if entry['error'] is None] or synthetic_cassette(latency)
+
+    @classmethod
+    def reset_counters(cls):
+        with cls._lock:
+            cls.in_flight = cls.max_in_flight = cls.calls = 0
+
+    @classmethod
+    def _track(cls, change):
+        with cls._lock:
+            if change > 0:
+                cls.calls += 1
+            cls.in_flight += change
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+
+    def _next(self):
+        """(entry, delay) for the next call; draws are made under the lock so seeded runs repeat."""
+        with self._lock:
+            entry = self._random.choice(self.entries)
+            if self.delay == 'recorded':
+                delay = self._random.choice(self.entries)['latency_s'] / self.speedup
+            else:
+                delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            if self.error_rate and self._random.random() < self.error_rate:
+                entry = dict(entry, error={'type': 'ServiceUnavailable', 'message': 'The model is overloaded.'})
+            elif entry['error'] is None and self.malformed_rate and self._random.random() < self.malformed_rate:
+                entry = dict(entry, text=malform(entry['text'], self._random.choice(MALFORMED_KINDS)))
+            return entry, delay
+
+    @staticmethod
+    def _error(entry):
+        error_type = getattr(api_exceptions, entry['error']['type'], None)
+        if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+            error_type = api_exceptions.Unknown
+        return error_type(entry['error']['message'])
+
+    @staticmethod
+    def _usage(entry):
+        return SimpleNamespace(**entry['usage']) if entry.get('usage') else None
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        entry, delay = self._next()
+        self._track(1)
+        if stream and entry['error'] is None:
+            return self._stream(entry, delay)
+        try:
+            if entry['error'] is not None:
+                await asyncio.sleep(delay / 2)
+                raise self._error(entry)
+            await asyncio.sleep(delay)
+            return FakeResponse(entry['text'], self._usage(entry))
+        finally:
+            self._track(-1)
+
+    async def _stream(self, entry, delay):
+        text = entry['text']
+        size = max(1, -(-len(text) // self.stream_chunks))
+        first_chunk = entry['first_chunk_s'] / self.speedup if entry.get('first_chunk_s') and self.delay == 'recorded' else None
+        try:
+            for index, start in enumerate(range(0, len(text), size)):
+                step = first_chunk if index == 0 and first_chunk is not None else delay / self.stream_chunks
+                await asyncio.sleep(step)
+                last = start + size >= len(text)
+                yield FakeResponse(text[start:start + size], self._usage(entry) if last else None)
+        finally:
+            self._track(-1)
+
+
+def replay_model_factory(entries, delay='recorded', latency=1.0, jitter=0.0, speedup=1.0,
+                         error_rate=0.0, malformed_rate=0.0, stream_chunks=16, seed=None):
+    """Model factory for set_model_factory() that replays entries (see ReplayModel)."""
+    return lambda model_name, **options: ReplayModel(
+        model_name, entries, delay=delay, latency=latency, jitter=jitter, speedup=speedup,
+        error_rate=error_rate, malformed_rate=malformed_rate, stream_chunks=stream_chunks, seed=seed
+    )
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Peak memory and time of preprocessing uploads of growing size: the full
+decode the stage used to do against the bounded path of src.preprocessing
+(header check, reduced-scale JPEG decode, downscale before the EXIF copy).
+
+Each (size, path) runs in a fresh interpreter, since peak RSS only grows.
+The image file is read before the baseline, so the numbers are what decoding
+and re-encoding add: the peak RSS growth (Pillow's pixel buffers are not
+visible to tracemalloc) and the peak of the Python heap (tracemalloc). JPEG
+test images are smooth synthetic pictures written to a temporary directory.
+
+Usage: python -m benchmarks.decode_memory_bench [--megapixels 2,12,24,50] [--max-edge 2048]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def make_jpeg(path, megapixels):
+    import numpy as np
+    import PIL.Image
+
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    x = np.linspace(0, 12 * np.pi, width, dtype=np.float32)
+    y = np.linspace(0, 8 * np.pi, height, dtype=np.float32)
+    base = (np.sin(x)[None, :] * np.cos(y)[:, None] + 1) * 127
+    pixels = np.stack([base, base[::-1], np.broadcast_to(x[None, :] * 6, base.shape)], axis=-1).astype(np.uint8)
+    PIL.Image.fromarray(pixels).save(path, format='JPEG', quality=90)
+    return width, height
+
+
+def full_decode(image_bytes, max_edge):
+    """The stage before bounded decoding: rotate at full size, then downscale."""
+    import io
+    import PIL.Image
+    import PIL.ImageOps
+
+    image = PIL.ImageOps.exif_transpose(PIL.Image.open(io.BytesIO(image_bytes)))
+    image.thumbnail((max_edge, max_edge), PIL.Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=85, optimize=True, progressive=True)
+    return len(output.getvalue())
+
+
+def bounded_decode(image_bytes, max_edge):
+    from src.preprocessing import open_image, preprocess_image
+
+    blob, _ = preprocess_image(open_image(image_bytes), len(image_bytes), max_edge)
+    return len(blob['data'])
+
+
+def child(path, mode, max_edge):
+    import PIL.Image  # noqa: F401 - loaded before the baseline
+    import src.preprocessing  # noqa: F401
+
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+    run = full_decode if mode == 'full' else bounded_decode
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        output_bytes = run(image_bytes, max_edge)
+        status = f"{output_bytes / 1024:.0f} KB out"
+    except ValueError as e:
+        status = f"refused: {e}"
+    duration = time.perf_counter() - start
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    print(f"{rss_growth / 1024:.1f}\t{heap_peak / 1024 / 1024:.1f}\t{duration * 1000:.0f}\t{status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare peak memory of full and bounded image decoding')
+    parser.add_argument('--megapixels', default='2,12,24,50')
+    parser.add_argument('--max-edge', type=int, default=2048)
+    parser.add_argument('--child', nargs=2, metavar=('PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.child[1], args.max_edge)
+        return
+
+    print(f"Target edge {args.max_edge} px; IMAGE_MEMORY_BUDGET_MB={os.environ.get('IMAGE_MEMORY_BUDGET_MB', 'default')}")
+    print(f"{'image':<22} {'path':<8} {'RSS +MB':>8} {'heap MB':>8} {'ms':>6}  result")
+    with tempfile.TemporaryDirectory() as directory:
+        for megapixels in (float(value) for value in args.megapixels.split(',')):
+            path = os.path.join(directory, f"{megapixels:g}mp.jpg")
+            width, height = make_jpeg(path, megapixels)
+            label = f"{width}x{height} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)"
+            for mode in ('full', 'bounded'):
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.decode_memory_bench', '--child', path, mode,
+                     '--max-edge', str(args.max_edge)],
+                    capture_output=True, text=True, check=True
+                ).stdout.strip()
+                rss, heap, milliseconds, status = output.split('\t')
+                print(f"{label:<22} {mode:<8} {rss:>8} {heap:>8} {milliseconds:>6}  {status}")
+
+
+if __name__ == "__main__":
+    main()
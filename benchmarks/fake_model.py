@@ -0,0 +1,269 @@
+"""
+Stand-in for genai.GenerativeModel used by the benchmarks.
+
+Install it with src.gemini_strategy.set_model_factory(fake_model_factory(...)).
+It returns a valid EgyptianArtAnalysis JSON document after a configurable
+delay (spread over the chunks when called with stream=True), and tracks how
+many calls are in flight at once. It can also be made slow or flaky: a
+fraction of calls take slow_factor times longer, and a fraction fail with a
+503 (ServiceUnavailable) after half the usual delay. Quota exhaustion is
+scripted with rate_limit_windows: {model name: [(start, end), ...]} in seconds
+since the factory was created, during which that model answers with a 429
+(ResourceExhausted).
+
+Thinking is simulated too: each 1000 tokens of thinking_budget adds
+thinking_latency seconds, budgets below quality_budget produce a vaguer answer
+(unknown date and translation), and responses carry usage metadata with the
+spent budget as thinking tokens.
+
+Built with response_schema=PackedAnalyses, it answers one entry per image in
+the contents; every image after the first adds packed_image_latency seconds
+(the longer answer), and the first invalid_packed_images entries lack their
+date so they fail validation.
+
+Easy and hard images are simulated with model_skill: {model name: share of
+images answered confidently}. Each image gets a fixed difficulty between 0
+and 1 from a checksum of its bytes, and a model whose skill is below it
+answers with an unidentified character, a hedged location and no
+translation (HARD_ANALYSIS). model_latencies overrides latency per model.
+
+Input costs time too: input_token_latency seconds per 1000 prompt tokens
+that are not served from cached_content (a LocalCachedContent from
+src.context_cache), whose tokens are reported as cached.
+"""
+
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+import zlib
+
+from src.schemas import PackedAnalyses
+
+SAMPLE_ANALYSIS = {
+    "picture_location": "Likely the burial chamber of Tutankhamun's tomb (KV62), Valley of the Kings",
+    "date": "New Kingdom",
+    "characters": [
+        {
+            "reasoning": "Shown mummiform with a green face and the atef crown, holding crook and flail.",
+            "character_name": "Osiris",
+            "description": "God of the afterlife, embraced by the king in the opening scene of the north wall.",
+            "location": "right side"
+        },
+        {
+            "reasoning": "Wears the nemes headdress and a royal cartouche is written above him.",
+            "character_name": "Tutankhamun",
+            "description": "Boy king of the 18th Dynasty whose nearly intact tomb was found in 1922.",
+            "location": "center"
+        }
+    ],
+    "ancient_text_translation": "The cartouche reads Neb-kheperu-ra, the throne name of Tutankhamun.",
+    "interesting_detail": "The king is followed by his ka, shown with the ka-arms hieroglyph on its head."
+}
+
+
+VAGUE_ANALYSIS = dict(SAMPLE_ANALYSIS, date="Unknown", ancient_text_translation="Unknown")
+
+
+HARD_ANALYSIS = dict(
+    SAMPLE_ANALYSIS,
+    picture_location="An unidentified tomb; the exact location cannot be determined from this view",
+    characters=[dict(SAMPLE_ANALYSIS["characters"][0], character_name="Unidentified")],
+    ancient_text_translation=""
+)
+
+
+# Input tokens the fake charges per image (a 2048 px image is about 6 tiles of 258 tokens)
+IMAGE_TOKENS = 1548
+
+
+class FakeUsage:
+    """Usage metadata as reported by the pinned SDK, which has no thoughts_token_count."""
+
+    def __init__(self, prompt_tokens, output_tokens, thinking_tokens, cached_tokens=0):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = cached_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens + thinking_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.candidates = [None]
+        self.usage_metadata = usage_metadata
+
+
+class FakeStreamResponse:
+    """Async iterable of response chunks, like the SDK's streamed response."""
+
+    def __init__(self, model, text, delay, chunks, usage_metadata=None):
+        self._model = model
+        self._text = text
+        self._delay = delay
+        self._chunks = chunks
+        self._usage_metadata = usage_metadata
+
+    async def __aiter__(self):
+        size = -(-len(self._text) // self._chunks)
+        try:
+            for start in range(0, len(self._text), size):
+                await asyncio.sleep(self._delay / self._chunks)
+                last = start + size >= len(self._text)
+                yield FakeResponse(self._text[start:start + size], self._usage_metadata if last else None)
+        finally:
+            self._model._exit()
+
+
+class FakeGenerativeModel:
+    """Mimics the parts of genai.GenerativeModel that the analyzer uses."""
+
+    in_flight = 0
+    max_in_flight = 0
+    calls = 0
+    rate_limited = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name, latency=1.0, jitter=0.0, seed=None, stream_chunks=16,
+                 slow_rate=0.0, slow_factor=10.0, error_rate=0.0, rate_limit_windows=(), epoch=None,
+                 thinking_budget=None, thinking_latency=0.0, quality_budget=0,
+                 response_schema=None, packed_image_latency=0.0, invalid_packed_images=0,
+                 cached_content=None, input_token_latency=0.0, skill=None):
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunks = stream_chunks
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.error_rate = error_rate
+        self.rate_limit_windows = list(rate_limit_windows)
+        self.epoch = time.monotonic() if epoch is None else epoch
+        self._random = random.Random(seed)
+        self.thinking_tokens = max(thinking_budget or 0, 0)
+        self.thinking_delay = thinking_latency * self.thinking_tokens / 1000
+        self._analysis = VAGUE_ANALYSIS if self.thinking_tokens < quality_budget else SAMPLE_ANALYSIS
+        self._text = json.dumps(self._analysis)
+        self._usage = FakeUsage(1290, len(self._text) // 4, self.thinking_tokens)
+        self.packed = response_schema is PackedAnalyses
+        self.packed_image_latency = packed_image_latency
+        self.invalid_packed_images = invalid_packed_images
+        self.cached_tokens = getattr(cached_content, 'token_count', 0)
+        self.input_token_latency = input_token_latency
+        self.skill = skill
+        self._hard_text = json.dumps(HARD_ANALYSIS)
+
+    @classmethod
+    def reset_counters(cls):
+        with cls._lock:
+            cls.in_flight = cls.max_in_flight = cls.calls = cls.rate_limited = 0
+
+    @classmethod
+    def _enter(cls):
+        with cls._lock:
+            cls.calls += 1
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+
+    @classmethod
+    def _exit(cls):
+        with cls._lock:
+            cls.in_flight -= 1
+
+    def _delay(self):
+        delay = max(0.0, self.latency + self.thinking_delay + self._random.uniform(-self.jitter, self.jitter))
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            delay *= self.slow_factor
+        return delay
+
+    def _answer(self, contents):
+        """(text, usage, extra delay) for a call with these contents."""
+        images = sum(1 for part in contents if not isinstance(part, str))
+        prompt_tokens = sum(len(part) // 4 for part in contents if isinstance(part, str)) + images * IMAGE_TOKENS
+        delay = self.input_token_latency * prompt_tokens / 1000
+        if self.packed:
+            invalid = {key: value for key, value in self._analysis.items() if key != 'date'}
+            text = json.dumps({"analyses": [
+                {"image_index": index, "analysis": invalid if index < self.invalid_packed_images else self._analysis}
+                for index in range(images)
+            ]})
+            delay += self.packed_image_latency * max(0, images - 1)
+        elif self.skill is not None and image_difficulty(contents) >= self.skill:
+            text = self._hard_text
+        else:
+            text = self._text
+        usage = FakeUsage(prompt_tokens + self.cached_tokens, len(text) // 4, self.thinking_tokens, self.cached_tokens)
+        return text, usage, delay
+
+    def _fails(self):
+        return bool(self.error_rate) and self._random.random() < self.error_rate
+
+    def _check_quota(self):
+        elapsed = time.monotonic() - self.epoch
+        if any(start <= elapsed < end for start, end in self.rate_limit_windows):
+            from google.api_core.exceptions import ResourceExhausted
+            with self._lock:
+                FakeGenerativeModel.rate_limited += 1
+            raise ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+
+    def generate_content(self, contents, **kwargs):
+        self._enter()
+        try:
+            time.sleep(self._delay())
+            return FakeResponse(self._text, self._usage)
+        finally:
+            self._exit()
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self._check_quota()
+        self._enter()
+        if stream:
+            return FakeStreamResponse(self, self._text, self._delay(), self.stream_chunks, self._usage)
+        try:
+            if self._fails():
+                await asyncio.sleep(self._delay() / 2)
+                from google.api_core.exceptions import ServiceUnavailable
+                raise ServiceUnavailable("The model is overloaded. Please try again later.")
+            text, usage, extra_delay = self._answer(contents)
+            await asyncio.sleep(self._delay() + extra_delay)
+            return FakeResponse(text, usage)
+        finally:
+            self._exit()
+
+
+def fake_model_factory(latency=1.0, jitter=0.0, seed=None, stream_chunks=16,
+                       slow_rate=0.0, slow_factor=10.0, error_rate=0.0, rate_limit_windows=None,
+                       thinking_latency=0.0, quality_budget=0, packed_image_latency=0.0, invalid_packed_images=0,
+                       input_token_latency=0.0, model_latencies=None, model_skill=None):
+    epoch = time.monotonic()
+    model_latencies = model_latencies or {}
+    model_skill = model_skill or {}
+    return lambda model_name, thinking_budget=None, response_schema=None, cached_content=None, **options: FakeGenerativeModel(
+        model_name, latency=model_latencies.get(model_name, latency), jitter=jitter, seed=seed, stream_chunks=stream_chunks,
+        slow_rate=slow_rate, slow_factor=slow_factor, error_rate=error_rate,
+        rate_limit_windows=(rate_limit_windows or {}).get(model_name, ()), epoch=epoch,
+        thinking_budget=thinking_budget, thinking_latency=thinking_latency, quality_budget=quality_budget,
+        response_schema=response_schema, packed_image_latency=packed_image_latency,
+        invalid_packed_images=invalid_packed_images, cached_content=cached_content,
+        input_token_latency=input_token_latency, skill=model_skill.get(model_name)
+    )
+
+
+def image_difficulty(contents):
+    """Difficulty between 0 and 1 of the (first) image in contents, fixed by its bytes."""
+    for part in contents:
+        if isinstance(part, dict) and 'data' in part:
+            return zlib.crc32(part['data']) / 2 ** 32
+    return 0.0
+
+
+def make_test_image(width=1024, height=768, seed=0):
+    """JPEG bytes of a random-noise test image (needs Pillow and NumPy)."""
+    import numpy as np
+    import PIL.Image
+
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    PIL.Image.fromarray(pixels).save(output, format='JPEG', quality=85)
+    return output.getvalue()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Behaviour of speed='regular' requests while gemini-2.5-pro is out of quota.
+
+The stub model answers every gemini-2.5-pro call with a 429 for the first
+--outage seconds. "retry only" is the plain retry loop; "breaker + fallback"
+adds the per-model circuit breaker and the pro -> flash -> flash-lite ladder
+from src.quota. No network calls are made.
+
+Usage: python -m benchmarks.fallback_bench [--requests 200] [--concurrency 20] [--outage 3.0]
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import time
+
+from benchmarks.fake_model import FakeGenerativeModel, fake_model_factory, make_test_image
+from src import quota
+from src.batch import percentile
+from src.gemini_strategy import analyze_egyptian_art_with_gemini_async, set_model_factory
+
+
+async def run(requests, concurrency, image_bytes, fallback):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            result = await analyze_egyptian_art_with_gemini_async(
+                image_bytes, speed='regular', use_cache=False, preprocess=False, hedge=False, fallback=fallback
+            )
+            return time.perf_counter() - start, result
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tier fallback during a quota outage')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--outage', type=float, default=3.0, help='Seconds gemini-2.5-pro answers with 429')
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    image_bytes = make_test_image(320, 240)
+
+    print(f"Requests: {args.requests}, concurrency {args.concurrency}, latency {args.latency:.2f}s, "
+          f"gemini-2.5-pro rate limited for the first {args.outage:.1f}s")
+    for label, fallback, threshold in (("retry only", False, 0), ("breaker + fallback", True, 5)):
+        quota.configure(failure_threshold=threshold, reset_seconds=args.outage / 2)
+        set_model_factory(fake_model_factory(
+            latency=args.latency, rate_limit_windows={'gemini-2.5-pro': [(0, args.outage)]}
+        ))
+        FakeGenerativeModel.reset_counters()
+        start = time.perf_counter()
+        samples = asyncio.run(run(args.requests, args.concurrency, image_bytes, fallback))
+        wall_time = time.perf_counter() - start
+        latencies = sorted(latency for latency, _ in samples)
+        statuses = collections.Counter(result["failure_status"] for _, result in samples)
+        models = collections.Counter(result.get("model") for _, result in samples if result["failure_status"] == "success")
+        print(f"\n{label}: wall {wall_time:.2f}s, p50 {percentile(latencies, 0.5):.3f}s, "
+              f"p99 {percentile(latencies, 0.99):.3f}s, 429s received {FakeGenerativeModel.rate_limited}")
+        print(f"   outcomes: {dict(statuses)}")
+        print(f"   answered by: {dict(models)}")
+
+
+if __name__ == "__main__":
+    main()
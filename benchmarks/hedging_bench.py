@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tail latency with and without hedged requests against a slow, flaky stub model.
+
+A fraction of calls (--slow-rate) take --slow-factor times the base latency
+and a fraction (--error-rate) fail with a 503. The same workload runs with
+hedging off and on; the second request is sent once the first has been
+outstanding longer than the model's recent p95 (HEDGE_PERCENTILE). Client-side
+rate limits are lifted so only hedging is measured. No network calls are made.
+
+Usage: python -m benchmarks.hedging_bench [--requests 1000] [--concurrency 50] [--latency 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.fake_model import FakeGenerativeModel, fake_model_factory, make_test_image
+from src import quota
+from src.batch import percentile
+from src.gemini_strategy import analyze_egyptian_art_with_gemini_async, set_model_factory
+
+
+async def run(requests, concurrency, image_bytes, hedge):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            result = await analyze_egyptian_art_with_gemini_async(
+                image_bytes, use_cache=False, preprocess=False, hedge=hedge
+            )
+            return time.perf_counter() - start, result["failure_status"] == "success"
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def report(label, samples, calls, requests):
+    latencies = sorted(latency for latency, _ in samples)
+    failed = sum(1 for _, ok in samples if not ok)
+    print(f"{label:<12} p50 {percentile(latencies, 0.50):6.3f}s  p95 {percentile(latencies, 0.95):6.3f}s  "
+          f"p99 {percentile(latencies, 0.99):6.3f}s  max {latencies[-1]:6.3f}s  "
+          f"failed {failed}  model calls/request {calls / requests:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark hedged requests against a slow, flaky stub model')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--slow-rate', type=float, default=0.02)
+    parser.add_argument('--slow-factor', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.005)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(
+        latency=args.latency, jitter=args.latency * 0.2, seed=1,
+        slow_rate=args.slow_rate, slow_factor=args.slow_factor, error_rate=args.error_rate
+    ))
+    image_bytes = make_test_image(320, 240)
+
+    print(f"Requests: {args.requests}, concurrency {args.concurrency}, latency {args.latency:.2f}s, "
+          f"{args.slow_rate:.1%} slow (x{args.slow_factor:g}), {args.error_rate:.1%} errors")
+    for label, hedge in (("no hedging", False), ("hedging", True)):
+        FakeGenerativeModel.reset_counters()
+        samples = asyncio.run(run(args.requests, args.concurrency, image_bytes, hedge))
+        report(label, samples, FakeGenerativeModel.calls, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Model calls, model time and latency for a photo burst analyzed frame by
+frame against keyframe selection (src.keyframes).
+
+The burst is --scenes views of a synthetic wall, --frames-per-scene frames
+each: every frame is shifted by a few pixels, and a random share of them is
+blurred as by camera shake. The stub model takes --latency seconds per call
+and the result cache is off. No network calls are made.
+
+Usage: python -m benchmarks.keyframes_bench [--scenes 2] [--frames-per-scene 5] [--keyframes 3] [--animated]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import time
+
+from benchmarks.fake_model import FakeGenerativeModel, fake_model_factory
+from src import quota
+from src.gemini_strategy import (analyze_egyptian_art_keyframes_async, analyze_egyptian_art_with_gemini_async,
+                                 set_model_factory)
+
+
+def make_burst(scenes, frames_per_scene, blurred_share, width=1600, height=1200, seed=0):
+    """JPEG bytes per frame: shifted (and sometimes blurred) crops of each scene."""
+    import numpy as np
+    import PIL.Image
+    import PIL.ImageFilter
+
+    rng = np.random.default_rng(seed)
+    frames = []
+    for scene in range(scenes):
+        # Smooth bands plus sharp-edged blocks, different per scene
+        x = np.linspace(0, (4 + 3 * scene) * np.pi, width + 32, dtype=np.float32)
+        y = np.linspace(0, (3 + 2 * scene) * np.pi, height + 32, dtype=np.float32)
+        base = (np.sin(x + scene)[None, :] * np.cos(y)[:, None] + 1) * 100
+        for _ in range(40):
+            left, top = rng.integers(0, width - 80), rng.integers(0, height - 80)
+            base[top:top + rng.integers(10, 80), left:left + rng.integers(10, 80)] = rng.integers(0, 256)
+        wall = PIL.Image.fromarray(np.stack([base, base * 0.8, base * 0.6], axis=-1).astype(np.uint8))
+        for _ in range(frames_per_scene):
+            dx, dy = rng.integers(0, 32, size=2)
+            frame = wall.crop((int(dx), int(dy), int(dx) + width, int(dy) + height))
+            if rng.random() < blurred_share:
+                frame = frame.filter(PIL.ImageFilter.GaussianBlur(rng.uniform(3, 8)))
+            output = io.BytesIO()
+            frame.save(output, format='JPEG', quality=90)
+            frames.append(output.getvalue())
+    return frames
+
+
+def as_animation(frames):
+    """The burst as one animated WebP, as a clip would be uploaded."""
+    import PIL.Image
+
+    images = [PIL.Image.open(io.BytesIO(frame)) for frame in frames]
+    output = io.BytesIO()
+    images[0].save(output, format='WEBP', save_all=True, append_images=images[1:], duration=100, quality=90)
+    return output.getvalue()
+
+
+async def every_frame(frames):
+    results = await asyncio.gather(*(analyze_egyptian_art_with_gemini_async(frame, use_cache=False)
+                                     for frame in frames))
+    return sum(result["api_call_duration"] for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark keyframe selection for photo bursts')
+    parser.add_argument('--scenes', type=int, default=2)
+    parser.add_argument('--frames-per-scene', type=int, default=5)
+    parser.add_argument('--blurred', type=float, default=0.3, help='Share of frames blurred by camera shake')
+    parser.add_argument('--keyframes', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=2.0)
+    parser.add_argument('--animated', action='store_true', help='Send the burst as one animated WebP')
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(latency=args.latency))
+    frames = make_burst(args.scenes, args.frames_per_scene, args.blurred)
+    upload = as_animation(frames) if args.animated else frames
+    print(f"Burst of {len(frames)} frames ({args.scenes} views), stub latency {args.latency:.1f}s")
+
+    FakeGenerativeModel.reset_counters()
+    start = time.perf_counter()
+    model_seconds = asyncio.run(every_frame(frames))
+    wall_time = time.perf_counter() - start
+    print(f"{'every frame':<12} {FakeGenerativeModel.calls:3d} model calls  model time {model_seconds:6.1f}s  "
+          f"wall {wall_time:5.2f}s")
+
+    FakeGenerativeModel.reset_counters()
+    start = time.perf_counter()
+    result = asyncio.run(analyze_egyptian_art_keyframes_async(upload, use_cache=False, keyframes=args.keyframes))
+    wall_time = time.perf_counter() - start
+    keyframes = result["keyframes"]
+    dropped = ', '.join(f"{count} {reason}" for reason, count in keyframes["dropped"].items() if count)
+    print(f"{'keyframes':<12} {FakeGenerativeModel.calls:3d} model calls  "
+          f"saved ~{keyframes['estimated_seconds_saved']:5.1f}s model time  wall {wall_time:5.2f}s  "
+          f"selection {keyframes['selection_duration'] * 1000:.0f} ms  ({result['failure_status']})")
+    print(f"Dropped: {dropped or 'none'}")
+    for frame in keyframes["frames"]:
+        print(f"   frame {frame['index']:3d}  sharpness {frame['sharpness']:9.1f}  {frame['status']}")
+
+
+if __name__ == "__main__":
+    main()
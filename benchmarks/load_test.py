@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Offline load test of lambda_handler and analyze_egyptian_art_with_gemini.
+
+record: run real analyses (needs GOOGLE_API_KEY) through a recording model and
+append every Gemini call - answer, latency, usage, errors - to a cassette.
+
+replay: swap the model for a stand-in that serves the cassette (or, without
+one, the built-in sample answer) with the recorded latency distribution or a
+synthetic delay, plus optional injected 503s and malformed JSON. Each
+(target, concurrency) pair runs in a fresh interpreter so CPU time and peak
+RSS belong to that run alone. The result is one JSON document with
+requests/s, p50/p95/p99 latency, CPU time and peak RSS per run.
+
+compare: print the per-run differences between two replay results.
+
+Usage:
+  python -m benchmarks.load_test record --images data/sample-egyptian-images --cassette cassettes/gemini.jsonl
+  python -m benchmarks.load_test replay --cassette cassettes/gemini.jsonl --target analyze lambda \\
+      --concurrency 1 8 32 --requests 200 --output baseline.json
+  python -m benchmarks.load_test replay --delay synthetic --latency 0.5 --error-rate 0.01 --malformed-rate 0.02
+  python -m benchmarks.load_test compare baseline.json candidate.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.cassette import load_cassette, recording_model_factory, replay_model_factory, synthetic_cassette
+
+TARGETS = ('analyze', 'lambda')
+
+
+def _load_images(source, count=None):
+    """Image bytes from a directory, glob or manifest, or one generated test image."""
+    if source is None:
+        from benchmarks.fake_model import make_test_image
+        return [make_test_image(1024, 768)]
+    from src.batch import collect_batch_items
+    images = []
+    for item in collect_batch_items(source)[:count]:
+        with open(item['path'], 'rb') as image_file:
+            images.append(image_file.read())
+    if not images:
+        raise SystemExit(f"No images found in {source}")
+    return images
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _make_request(target, image_bytes, speed, image_type, stream):
+    """A callable that runs one request against target and returns its status string."""
+    if target == 'lambda':
+        import src.lambda_function as lambda_function
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'image': base64.b64encode(image_bytes).decode('ascii'), 'speed': speed,
+                                'imageType': image_type, 'bypassCache': True, 'stream': stream})
+        }
+        return lambda: str(lambda_function.lambda_handler(event, None)['statusCode'])
+
+    from src.gemini_strategy import analyze_egyptian_art_streaming, analyze_egyptian_art_with_gemini
+
+    def analyze():
+        if stream:
+            for event in analyze_egyptian_art_streaming(image_bytes, speed, image_type, use_cache=False):
+                result = event.get('result')
+        else:
+            result = analyze_egyptian_art_with_gemini(image_bytes, speed, image_type, use_cache=False)
+        return result['failure_status']
+    return analyze
+
+
+def run_one(config):
+    """One replay run in this process; returns its measurements."""
+    from benchmarks.cassette import ReplayModel
+    from src import quota
+    from src.batch import percentile
+    from src.gemini_strategy import set_model_factory
+
+    if config['cassette']:
+        entries = load_cassette(config['cassette'])
+    else:
+        entries = synthetic_cassette(config['latency'])
+    if not config['rate_limits']:
+        quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(replay_model_factory(
+        entries, delay=config['delay'], latency=config['latency'], jitter=config['jitter'],
+        speedup=config['speedup'], error_rate=config['error_rate'], malformed_rate=config['malformed_rate'],
+        seed=config['seed']
+    ))
+    images = _load_images(config['images'], config['max_images'])
+    requests = [
+        _make_request(config['target'], images[index % len(images)], config['speed'], config['image_type'],
+                      config['stream'])
+        for index in range(config['requests'])
+    ]
+
+    for request in requests[:config['warmup']]:
+        request()
+    ReplayModel.reset_counters()
+
+    def timed(request):
+        start = time.perf_counter()
+        status = request()
+        return time.perf_counter() - start, status
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config['concurrency']) as executor:
+        samples = list(executor.map(timed, requests))
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = Counter(status for _, status in samples)
+    succeeded = statuses.get('success', 0) + statuses.get('200', 0)
+    return {
+        'target': config['target'],
+        'concurrency': config['concurrency'],
+        'requests': len(samples),
+        'succeeded': succeeded,
+        'failed': len(samples) - succeeded,
+        'statuses': dict(statuses),
+        'wall_s': round(wall_time, 4),
+        'requests_per_s': round(len(samples) / wall_time, 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2)
+        },
+        'cpu_s': round(cpu_time, 4),
+        'cpu_ms_per_request': round(cpu_time / len(samples) * 1000, 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'model_calls': ReplayModel.calls,
+        'max_in_flight': ReplayModel.max_in_flight
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_run(run):
+    latency = run['latency_ms']
+    return (f"{run['target']:<8} c={run['concurrency']:<4} {run['requests_per_s']:8.1f} req/s  "
+            f"p50 {latency['p50']:8.1f} ms  p95 {latency['p95']:8.1f} ms  p99 {latency['p99']:8.1f} ms  "
+            f"cpu {run['cpu_ms_per_request']:7.2f} ms/req  rss {run['peak_rss_mb']:6.1f} MB  failed {run['failed']}")
+
+
+def replay(args):
+    base_config = {
+        'cassette': args.cassette, 'delay': args.delay, 'latency': args.latency, 'jitter': args.jitter,
+        'speedup': args.speedup, 'error_rate': args.error_rate, 'malformed_rate': args.malformed_rate,
+        'seed': args.seed, 'images': args.images, 'max_images': args.max_images, 'requests': args.requests,
+        'warmup': args.warmup, 'speed': args.speed, 'image_type': args.type, 'stream': args.stream,
+        'rate_limits': args.rate_limits
+    }
+    env = dict(os.environ, ANALYSIS_CACHE_DISABLED='1', PRIME_ON_INIT='off', METRICS_EMF='0')
+    env.setdefault('GOOGLE_API_KEY', 'load-test-placeholder')
+    runs = []
+    for target in args.target:
+        for concurrency in args.concurrency:
+            config = dict(base_config, target=target, concurrency=concurrency)
+            child = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.load_test', 'run', json.dumps(config)],
+                capture_output=True, text=True, env=env
+            )
+            if child.returncode != 0:
+                sys.stderr.write(child.stderr)
+                raise SystemExit(f"Run {target} c={concurrency} failed")
+            run = json.loads(child.stdout.strip().splitlines()[-1])
+            print(_format_run(run), file=sys.stderr)
+            runs.append(run)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': base_config,
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def record(args):
+    if not (os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')):
+        raise SystemExit("Recording calls the real API: set GOOGLE_API_KEY")
+    from src.gemini_strategy import analyze_egyptian_art_streaming, analyze_egyptian_art_with_gemini, set_model_factory
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.cassette)), exist_ok=True)
+    set_model_factory(recording_model_factory(args.cassette))
+    images = _load_images(args.images, args.max_images)
+    statuses = Counter()
+    for _ in range(args.repeat):
+        for image_bytes in images:
+            if args.stream:
+                for event in analyze_egyptian_art_streaming(image_bytes, args.speed, args.type, use_cache=False):
+                    result = event.get('result')
+            else:
+                result = analyze_egyptian_art_with_gemini(image_bytes, args.speed, args.type,
+                                                          use_cache=False, hedge=False)
+            statuses[result['failure_status']] += 1
+            print(f"[{result['failure_status']}] {result['api_call_duration']:.2f}s", file=sys.stderr)
+    print(f"Recorded {sum(statuses.values())} analyses to {args.cassette}: {dict(statuses)}", file=sys.stderr)
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as baseline_file, open(args.candidate, encoding='utf-8') as candidate_file:
+        baseline, candidate = json.load(baseline_file), json.load(candidate_file)
+    baseline_runs = {(run['target'], run['concurrency']): run for run in baseline['runs']}
+
+    def change(old, new):
+        return f"{(new - old) / old:+7.1%}" if old else "    n/a"
+
+    for run in candidate['runs']:
+        old = baseline_runs.get((run['target'], run['concurrency']))
+        if old is None:
+            continue
+        print(f"{run['target']:<8} c={run['concurrency']:<4} "
+              f"req/s {change(old['requests_per_s'], run['requests_per_s'])}  "
+              f"p50 {change(old['latency_ms']['p50'], run['latency_ms']['p50'])}  "
+              f"p99 {change(old['latency_ms']['p99'], run['latency_ms']['p99'])}  "
+              f"cpu/req {change(old['cpu_ms_per_request'], run['cpu_ms_per_request'])}  "
+              f"rss {change(old['peak_rss_mb'], run['peak_rss_mb'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test with recorded or synthetic Gemini responses')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_request_options(command):
+        command.add_argument('--images', default=None,
+                             help='Directory, glob or manifest of images (default: one generated 1024x768 JPEG)')
+        command.add_argument('--max-images', type=int, default=None)
+        command.add_argument('--speed', default='fast', choices=['fast', 'regular', 'super-fast'])
+        command.add_argument('--type', default='unknown', choices=['tomb', 'temple', 'other', 'unknown'])
+        command.add_argument('--stream', action='store_true', help='Use the streaming API')
+
+    record_command = commands.add_parser('record', help='Record real Gemini calls to a cassette')
+    record_command.add_argument('--cassette', required=True)
+    record_command.add_argument('--repeat', type=int, default=1, help='Analyze every image this many times')
+    add_request_options(record_command)
+
+    replay_command = commands.add_parser('replay', help='Load test against a replayed cassette')
+    replay_command.add_argument('--cassette', default=None, help='Cassette to serve (default: synthetic sample answer)')
+    replay_command.add_argument('--target', nargs='+', default=list(TARGETS), choices=TARGETS)
+    replay_command.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32])
+    replay_command.add_argument('--requests', type=int, default=200)
+    replay_command.add_argument('--warmup', type=int, default=2)
+    replay_command.add_argument('--delay', default=None, choices=['recorded', 'synthetic'],
+                                help='Recorded latencies or --latency +/- --jitter (default: recorded with a cassette)')
+    replay_command.add_argument('--latency', type=float, default=0.5)
+    replay_command.add_argument('--jitter', type=float, default=0.0)
+    replay_command.add_argument('--speedup', type=float, default=1.0, help='Divide recorded latencies by this')
+    replay_command.add_argument('--error-rate', type=float, default=0.0, help='Share of calls failing with a 503')
+    replay_command.add_argument('--malformed-rate', type=float, default=0.0,
+                                help='Share of answers with fenced, trailing-text or truncated JSON')
+    replay_command.add_argument('--seed', type=int, default=1)
+    replay_command.add_argument('--rate-limits', action='store_true', help='Keep the client-side quota limits')
+    replay_command.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    add_request_options(replay_command)
+
+    compare_command = commands.add_parser('compare', help='Compare two replay reports')
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('candidate')
+
+    run_command = commands.add_parser('run', help=argparse.SUPPRESS)
+    run_command.add_argument('config')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args)
+    elif args.command == 'replay':
+        if args.delay is None:
+            args.delay = 'recorded' if args.cassette else 'synthetic'
+        replay(args)
+    elif args.command == 'compare':
+        compare(args)
+    else:
+        print(json.dumps(run_one(json.loads(args.config))))
+
+
+if __name__ == "__main__":
+    main()
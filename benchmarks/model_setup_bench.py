@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Per-call setup overhead before the model request is sent.
+
+"per-call" reproduces the previous behaviour (genai.configure plus a fresh
+GenerativeModel and GenerationConfig, including the schema conversion, on every
+call); "registry" is the shared model lookup used now. No network calls are made.
+
+Usage: python -m benchmarks.model_setup_bench [--iterations 500]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import google.generativeai as genai
+
+from src.gemini_strategy import _default_model_factory, _ensure_configured, get_model
+
+
+def time_calls(function, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples), statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-call model setup overhead')
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+
+    api_key = os.environ.get('GOOGLE_API_KEY') or 'benchmark-placeholder'
+
+    def per_call_setup():
+        genai.configure(api_key=api_key)
+        _default_model_factory('gemini-2.5-flash')
+
+    async def registry_setup():
+        _ensure_configured(api_key)
+        first_start = time.perf_counter()
+        get_model('gemini-2.5-flash')
+        first = (time.perf_counter() - first_start) * 1e6
+        return first, time_calls(lambda: (_ensure_configured(api_key), get_model('gemini-2.5-flash')), args.iterations)
+
+    before = time_calls(per_call_setup, args.iterations)
+    first, after = asyncio.run(registry_setup())
+
+    print(f"Iterations: {args.iterations}")
+    print(f"per-call configure + build:  median {before[0]:8.1f}us  mean {before[1]:8.1f}us")
+    print(f"registry (first build):             {first:8.1f}us")
+    print(f"registry (warm lookup):      median {after[0]:8.1f}us  mean {after[1]:8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Archive reprocessing with one call per image versus packed multi-image calls.
+
+--images photos are analyzed with at most --concurrency model calls in
+flight, once one by one and once packed --pack-size to a call. The stub
+model answers after --latency seconds, plus --image-latency for every extra
+image in a packed answer (the answer gets longer), and charges input tokens
+for the prompt text and the images it is sent. With --invalid N the first N
+entries of every packed answer fail validation and are analyzed again on
+their own. No network calls are made.
+
+Usage: python -m benchmarks.packing_bench [--images 48] [--pack-size 8] [--concurrency 4] [--latency 1.0] [--image-latency 0.25] [--invalid 0]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.fake_model import FakeGenerativeModel, fake_model_factory, make_test_image
+from src import quota
+from src.gemini_strategy import analyze_egyptian_art_packed_async, analyze_egyptian_art_with_gemini_async, set_model_factory
+
+
+async def run_single(images, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(image_bytes):
+        async with semaphore:
+            return await analyze_egyptian_art_with_gemini_async(image_bytes, speed='fast', use_cache=False, hedge=False)
+
+    results = await asyncio.gather(*(analyze(image_bytes) for image_bytes in images))
+    input_tokens = sum(result["usage"]["input_tokens"] for result in results if result.get("usage"))
+    return results, input_tokens
+
+
+async def run_packed(images, concurrency, pack_size):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(chunk):
+        async with semaphore:
+            return await analyze_egyptian_art_packed_async([(image_bytes, 'unknown') for image_bytes in chunk],
+                                                           speed='fast', use_cache=False, max_pack_size=pack_size,
+                                                           hedge=False)
+
+    chunks = await asyncio.gather(*(analyze(images[start:start + pack_size])
+                                    for start in range(0, len(images), pack_size)))
+    results = [result for chunk in chunks for result in chunk]
+    # Every image of a pack carries the same usage; count each call once
+    packed_usage = {id(result["pack"]["usage"]): result["pack"]["usage"] for result in results
+                    if result.get("pack") and result["pack"]["usage"]}
+    input_tokens = sum(usage["input_tokens"] for usage in packed_usage.values())
+    input_tokens += sum(result["usage"]["input_tokens"] for result in results if result.get("usage"))
+    return results, input_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark packed multi-image calls against one call per image')
+    parser.add_argument('--images', type=int, default=48)
+    parser.add_argument('--pack-size', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=1.0)
+    parser.add_argument('--image-latency', type=float, default=0.25)
+    parser.add_argument('--invalid', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(latency=args.latency, packed_image_latency=args.image_latency,
+                                         invalid_packed_images=args.invalid))
+    images = [make_test_image(640, 480, seed=seed) for seed in range(args.images)]
+    print(f"Images: {args.images}, concurrency {args.concurrency}, latency {args.latency:.2f}s "
+          f"+ {args.image_latency:.2f}s per extra packed image")
+
+    for name, run in (('one per call', lambda: run_single(images, args.concurrency)),
+                      (f'packed by {args.pack_size}', lambda: run_packed(images, args.concurrency, args.pack_size))):
+        FakeGenerativeModel.reset_counters()
+        start = time.perf_counter()
+        results, input_tokens = asyncio.run(run())
+        wall_time = time.perf_counter() - start
+        succeeded = sum(1 for result in results if result["failure_status"] == "success")
+        packed = sum(1 for result in results if result.get("pack"))
+        print(f"{name:<14} {wall_time:6.2f}s  {args.images / wall_time:5.1f} images/s  "
+              f"{FakeGenerativeModel.calls:3d} calls  {input_tokens:7d} input tokens  "
+              f"{succeeded} ok ({packed} from packs)")
+
+
+if __name__ == "__main__":
+    main()
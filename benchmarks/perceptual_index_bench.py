@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Lookup latency of the perceptual near-duplicate index.
+
+Usage: python -m benchmarks.perceptual_index_bench [--entries 100000] [--queries 2000] [--threshold 8]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from src.perceptual_index import PerceptualIndex
+
+
+def flip_bits(value, count, rng):
+    for position in rng.sample(range(64), count):
+        value ^= 1 << position
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark perceptual index lookups')
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--threshold', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hashes = [rng.getrandbits(64) for _ in range(args.entries)]
+
+    with tempfile.TemporaryDirectory() as path:
+        # Automatic merges off: the whole index is built by the timed save()
+        index = PerceptualIndex(path, flush_threshold=0, max_pending=0)
+        for i, fingerprint in enumerate(hashes):
+            index.add(fingerprint, {"analysis": {"picture_location": f"wall {i}"}, "prompt_version": "bench"})
+        build_start = time.perf_counter()
+        index.save()
+        build_time = time.perf_counter() - build_start
+
+        load_start = time.perf_counter()
+        index = PerceptualIndex(path)
+        load_time = time.perf_counter() - load_start
+
+        latencies = []
+        found = 0
+        for _ in range(args.queries):
+            target = rng.randrange(args.entries)
+            query = flip_bits(hashes[target], rng.randint(0, args.threshold), rng)
+            start = time.perf_counter()
+            match = index.lookup(query, args.threshold)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += match is not None
+        index.close()
+
+    latencies.sort()
+    print(f"Entries: {args.entries}, queries: {args.queries}, threshold: {args.threshold}")
+    print(f"Save: {build_time:.2f}s, mmap load: {load_time * 1000:.2f}ms")
+    print(f"Recall: {found / args.queries:.3f}")
+    print(f"Lookup p50: {statistics.median(latencies):.3f}ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99) - 1]:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Prompt construction and model-side caching of the prompt prefix.
+
+"prompt build" times building the prompt by string concatenation on every
+call (the previous create_egyptian_art_prompt) against a lookup in the
+prompt registry. "requests" runs --requests analyses against a stub that
+takes --latency seconds plus --input-latency seconds per 1000 input tokens
+it has to process, once sending the prefix with every request and once with
+the prefix held by the local context cache stand-in. The real API only caches
+prefixes of at least 1024 tokens (4096 on pro); --prefix-repeat N
+re-registers the v1 prompt in this process with its prefix N times as long
+to show that regime. No network calls are made.
+
+Usage: python -m benchmarks.prompt_cache_bench [--requests 20] [--latency 0.2] [--input-latency 0.1] [--prefix-repeat 1]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from benchmarks.fake_model import fake_model_factory, make_test_image
+from src import prompts, quota
+from src.context_cache import ContextCacheManager, LocalContextCacheBackend
+from src.gemini_strategy import analyze_egyptian_art_with_gemini_async, set_context_cache, set_model_factory
+
+
+def concatenated_prompt(image_type_hint):
+    prompt = prompts.V1_PREFIX
+    if image_type_hint and image_type_hint != 'unknown':
+        prompt += f"\n\nHint: The image most likely belongs to a {image_type_hint}."
+    return prompt
+
+
+def time_calls(function, iterations=20000):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+async def run_requests(requests, image_bytes):
+    durations, usages = [], []
+    for _ in range(requests):
+        start = time.perf_counter()
+        result = await analyze_egyptian_art_with_gemini_async(image_bytes, speed='fast', image_type='tomb',
+                                                              use_cache=False, hedge=False)
+        durations.append(time.perf_counter() - start)
+        usages.append(result["usage"])
+    return durations, usages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the prompt registry and context caching')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--input-latency', type=float, default=0.1)
+    parser.add_argument('--prefix-repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'prompt build':<24} {'ns/call':>8}")
+    print(f"{'concatenation':<24} {time_calls(lambda: concatenated_prompt('tomb')):8.0f}")
+    print(f"{'registry lookup':<24} {time_calls(lambda: prompts.get_prompt('tomb')):8.0f}")
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(latency=args.latency, input_token_latency=args.input_latency))
+    if args.prefix_repeat > 1:
+        prompts.register_prompt_version(prompts.PROMPT_VERSION, prompts.V1_PREFIX * args.prefix_repeat, prompts.V1_HINT)
+    image_bytes = make_test_image(320, 240)
+    prefix_tokens = len(prompts.get_prompt('tomb').prefix) // quota.CHARS_PER_TOKEN
+    print(f"\nRequests: {args.requests}, prefix ~{prefix_tokens} tokens, latency {args.latency:.2f}s "
+          f"+ {args.input_latency:.2f}s per 1000 uncached input tokens")
+    print(f"{'requests':<24} {'p50':>8} {'input tok':>10} {'cached':>8} {'caches':>7}")
+
+    backend = LocalContextCacheBackend()
+    for name, manager in (('prefix in request', None),
+                          # Any prefix is cached here; the API needs CONTEXT_CACHE_MIN_TOKENS
+                          ('prefix cached', ContextCacheManager(backend, min_tokens={'gemini-2.5-flash': 0}))):
+        set_context_cache(manager)
+        durations, usages = asyncio.run(run_requests(args.requests, image_bytes))
+        print(f"{name:<24} {statistics.median(durations) * 1000:6.0f}ms "
+              f"{statistics.mean(usage['input_tokens'] for usage in usages):10.0f} "
+              f"{statistics.mean(usage['cached_tokens'] for usage in usages):8.0f} "
+              f"{backend.created if manager else 0:7d}")
+    set_context_cache(None)
+
+
+if __name__ == "__main__":
+    main()
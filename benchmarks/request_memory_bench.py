@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Peak Python heap used to turn an API Gateway event into decoded image bytes.
+
+Compares the original JSON path (validate-decode, discard, decode again in the
+analysis), the single-decode JSON path, and the binary (isBase64Encoded) path.
+
+Usage: python -m benchmarks.request_memory_bench [--size-mb 10]
+"""
+
+import argparse
+import base64
+import gc
+import json
+import os
+import tracemalloc
+
+from src.lambda_function import parse_analysis_request
+
+
+def legacy_path(event):
+    request_data = json.loads(event['body'])
+    image_data = request_data.get('image')
+    base64.b64decode(image_data)  # validation decode, result discarded
+    return base64.b64decode(image_data)  # second decode inside the analysis
+
+
+def measure(label, build_event, handler):
+    event = build_event()
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    image_bytes = handler(event)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} peak above event: {(peak - baseline) / 1024 / 1024:7.1f} MB "
+          f"(image {len(image_bytes) / 1024 / 1024:.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare peak memory of request decoding paths')
+    parser.add_argument('--size-mb', type=float, default=10)
+    args = parser.parse_args()
+
+    image = os.urandom(int(args.size_mb * 1024 * 1024))
+    encoded = base64.b64encode(image).decode('ascii')
+    del image
+
+    def json_event():
+        return {'httpMethod': 'POST', 'body': json.dumps({'image': encoded, 'speed': 'fast'})}
+
+    def binary_event():
+        return {
+            'httpMethod': 'POST',
+            'headers': {'Content-Type': 'application/octet-stream'},
+            'queryStringParameters': {'speed': 'fast'},
+            'isBase64Encoded': True,
+            'body': encoded
+        }
+
+    measure('legacy JSON (decode x2)', json_event, legacy_path)
+    measure('JSON single decode', json_event, lambda event: parse_analysis_request(event)[1])
+    measure('binary body', binary_event, lambda event: parse_analysis_request(event)[1])
+
+
+if __name__ == "__main__":
+    main()
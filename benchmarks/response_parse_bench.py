@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Response parsing and serialization cost on large multi-character answers.
+
+"previous" reproduces the old path: json.loads, then again after stripping
+code fences, then a greedy regex search; EgyptianArtAnalysis(**data),
+model_dump(), and a json.dumps(indent=2) body. "current" is
+_parse_analysis (one Pydantic JSON pass, extracting the object first only
+when needed) and the compact body from src.json_codec.
+
+Usage: python -m benchmarks.response_parse_bench [--characters 40] [--iterations 200]
+"""
+
+import argparse
+import gzip
+import json
+import re
+import statistics
+import time
+
+from benchmarks.fake_model import SAMPLE_ANALYSIS
+from src import json_codec
+from src.gemini_strategy import _parse_analysis
+from src.schemas import EgyptianArtAnalysis
+
+
+def previous_parse(response_text):
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        cleaned_text = response_text.strip()
+        if cleaned_text.startswith('```json'):
+            cleaned_text = cleaned_text[7:]
+        if cleaned_text.endswith('```'):
+            cleaned_text = cleaned_text[:-3]
+        cleaned_text = cleaned_text.strip()
+        try:
+            return json.loads(cleaned_text)
+        except json.JSONDecodeError:
+            return json.loads(re.search(r'\{.*\}', cleaned_text, re.DOTALL).group())
+
+
+def make_response(characters):
+    character = SAMPLE_ANALYSIS["characters"][0]
+    analysis = dict(SAMPLE_ANALYSIS, characters=[
+        dict(character, character_name=f"{character['character_name']} {index}",
+             description=character["description"] * 4)
+        for index in range(characters)
+    ])
+    return json.dumps(analysis, indent=2)
+
+
+def time_calls(function, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark response parsing and serialization')
+    parser.add_argument('--characters', type=int, default=40)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    text = make_response(args.characters)
+    variants = {
+        'clean': text,
+        'fenced': f"```json\n{text}\n```",
+        'prose': f"Here is the analysis:\n{text}\nLet me know if you need more.",
+    }
+    print(f"Response: {args.characters} characters, {len(text) / 1024:.1f} KB")
+    print(f"{'parse + validate':<18} {'previous':>12} {'current':>12}")
+    for name, response_text in variants.items():
+        previous = time_calls(lambda: EgyptianArtAnalysis(**previous_parse(response_text)).model_dump(), args.iterations)
+        current = time_calls(lambda: _parse_analysis(response_text).model_dump(), args.iterations)
+        print(f"{name:<18} {previous:10.0f}us {current:10.0f}us")
+
+    body = {"characters": json.loads(text)["characters"], "location": SAMPLE_ANALYSIS["picture_location"]}
+    encoders = {
+        'json indent=2': lambda: json.dumps(body, indent=2).encode('utf-8'),
+        'compact': lambda: json.dumps(body, separators=(',', ':'), ensure_ascii=False).encode('utf-8'),
+    }
+    if json_codec.orjson is not None:
+        encoders['orjson'] = lambda: json_codec.orjson.dumps(body)
+    print(f"\n{'serialize':<18} {'time':>12} {'bytes':>9} {'gzip':>9} {'br':>9}")
+    for name, encode in encoders.items():
+        encoded = encode()
+        brotli_size = len(json_codec.compress(encoded, 'br')) if json_codec.brotli is not None else None
+        print(f"{name:<18} {time_calls(encode, args.iterations):10.1f}us {len(encoded):9d} "
+              f"{len(gzip.compress(encoded, compresslevel=5)):9d} {brotli_size if brotli_size else '-':>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+One process serving concurrent analyses through the ASGI app (src.server)
+versus one request at a time, as a Lambda instance handles them.
+
+--requests POSTs are sent with --concurrency clients in flight, straight
+into the app's ASGI callable (no sockets), against a stub model that takes
+--latency seconds. "lambda_handler" calls the handler one request after
+another; "server" lets the app run them concurrently with --max-in-flight
+analyses at most, refusing the rest with 429. No network calls are made.
+
+Usage: python -m benchmarks.server_bench [--requests 64] [--concurrency 16] [--max-in-flight 32] [--latency 0.5]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import time
+
+from benchmarks.fake_model import fake_model_factory, make_test_image
+from src import quota
+from src.gemini_strategy import set_model_factory
+
+
+async def asgi_post(app, body):
+    """POST body to the app; returns (status, seconds)."""
+    start = time.perf_counter()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/', 'query_string': b'',
+             'headers': [(b'content-type', b'application/json')]}
+    await app(scope, receive, send)
+    return status[0], time.perf_counter() - start
+
+
+async def run_server(app, body, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await asgi_post(app, body)
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def run_handler(body, requests):
+    import src.lambda_function as lambda_function
+    results = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler({'httpMethod': 'POST', 'body': body.decode('utf-8')}, None)
+        results.append((response['statusCode'], time.perf_counter() - start))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the self-hosted server against one request at a time')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max-in-flight', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    os.environ.setdefault('PRIME_ON_INIT', 'off')
+    from src.server import AnalyzerApp
+
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(latency=args.latency))
+    body = json.dumps({'image': base64.b64encode(make_test_image(640, 480)).decode('ascii'),
+                       'bypassCache': True}).encode('utf-8')
+    app = AnalyzerApp(max_in_flight=args.max_in_flight)
+    print(f"Requests: {args.requests}, concurrency {args.concurrency}, max in flight {args.max_in_flight}, "
+          f"latency {args.latency:.2f}s")
+
+    for name, run in (('lambda_handler', lambda: run_handler(body, args.requests)),
+                      ('server', lambda: asyncio.run(run_server(app, body, args.requests, args.concurrency)))):
+        start = time.perf_counter()
+        results = run()
+        wall_time = time.perf_counter() - start
+        ok = [seconds for status, seconds in results if status == 200]
+        rejected = sum(1 for status, _ in results if status == 429)
+        p50 = statistics.median(ok) * 1000 if ok else 0.0
+        print(f"{name:<15} {wall_time:6.2f}s  {args.requests / wall_time:5.1f} req/s  p50 {p50:5.0f}ms  "
+              f"{len(ok)} ok  {rejected} rejected (429)")
+
+
+if __name__ == "__main__":
+    main()
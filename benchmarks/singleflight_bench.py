@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Model calls and latency for a burst of identical uploads, with and without
+single-flight coalescing (src.singleflight).
+
+--requests analyses of the same image start at once, half from threads
+through analyze_egyptian_art_with_gemini and half as tasks on the caller's
+own event loop through analyze_egyptian_art_with_gemini_async, against a stub
+model that takes --latency seconds. The result cache is off, so only
+coalescing can save calls. No network calls are made.
+
+Usage: python -m benchmarks.singleflight_bench [--requests 50] [--latency 1.0]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+from benchmarks.fake_model import FakeGenerativeModel, fake_model_factory, make_test_image
+from src import quota
+from src.gemini_strategy import (analyze_egyptian_art_with_gemini, analyze_egyptian_art_with_gemini_async,
+                                 set_model_factory)
+from src.singleflight import get_single_flight
+
+
+def burst(image_bytes, requests):
+    """(seconds, result) per request, threaded and asyncio callers started together."""
+    samples = []
+    lock = threading.Lock()
+    start_event = threading.Event()
+
+    def threaded():
+        start_event.wait()
+        start = time.perf_counter()
+        result = analyze_egyptian_art_with_gemini(image_bytes)
+        with lock:
+            samples.append((time.perf_counter() - start, result))
+
+    async def tasks(count):
+        async def one():
+            start = time.perf_counter()
+            result = await analyze_egyptian_art_with_gemini_async(image_bytes)
+            return time.perf_counter() - start, result
+        start_event.wait()
+        return await asyncio.gather(*(one() for _ in range(count)))
+
+    threads = [threading.Thread(target=threaded) for _ in range(requests // 2)]
+    for thread in threads:
+        thread.start()
+    async_samples = []
+    loop_thread = threading.Thread(target=lambda: async_samples.extend(asyncio.run(tasks(requests - len(threads)))))
+    loop_thread.start()
+    start_event.set()
+    for thread in threads + [loop_thread]:
+        thread.join()
+    return samples + async_samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark single-flight coalescing of identical analyses')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=1.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(latency=args.latency))
+    image_bytes = make_test_image(640, 480)
+
+    for label, setting in (('off', '0'), ('single-flight', '1')):
+        os.environ['SINGLE_FLIGHT'] = setting
+        FakeGenerativeModel.reset_counters()
+        start = time.perf_counter()
+        samples = burst(image_bytes, args.requests)
+        wall_time = time.perf_counter() - start
+        latencies = [seconds for seconds, _ in samples]
+        coalesced = sum(1 for _, result in samples if result.get("coalesced"))
+        failed = sum(1 for _, result in samples if result["failure_status"] != "success")
+        print(f"{label:<14} {FakeGenerativeModel.calls:3d} model calls  {coalesced:3d} coalesced  "
+              f"p50 {statistics.median(latencies):5.2f}s  max {max(latencies):5.2f}s  wall {wall_time:5.2f}s  "
+              f"{failed} failed")
+    print(f"Counters: {get_single_flight().stats()}")
+
+
+if __name__ == "__main__":
+    main()
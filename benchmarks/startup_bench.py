@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Lambda handler based on ``python -X importtime``.
+
+Each scenario runs in a fresh interpreter so nothing is cached between them:
+
+  handler_import  import the handler module only (what every cold start pays)
+  preflight       import + answer an OPTIONS request
+  bad_request     import + answer a 400 (missing body)
+  analysis_path   import + load the full analysis stack and build the models
+
+Priming is disabled (PRIME_ON_INIT=off) so each number is attributable to one
+path. Run it with the interpreter and site-packages of the Lambda image to
+measure the Dockerfile's dependency set, e.g.:
+
+  docker build -t egyptian-art-analyzer .
+  docker run --rm --entrypoint python -v "$PWD/benchmarks:/var/task/benchmarks" \\
+      -w /var/task egyptian-art-analyzer -m benchmarks.startup_bench --module lambda_function
+
+Usage: python -m benchmarks.startup_bench [--repeat 5] [--module src.lambda_function]
+       [--max-handler-import-ms 50] [--json]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = {
+    "handler_import": "import {module} as handler",
+    "preflight": "import {module} as handler\nhandler.lambda_handler({{'httpMethod': 'OPTIONS'}}, None)",
+    "bad_request": "import {module} as handler\nhandler.lambda_handler({{'httpMethod': 'POST'}}, None)",
+    "analysis_path": "import {module} as handler\nhandler.prime_analysis_path()\nhandler._load_analyzer()",
+}
+
+TIMER = """
+import time as _t
+_start = _t.perf_counter()
+{code}
+import sys as _sys
+_sys.stdout.write('ELAPSED_US=%d\\n' % ((_t.perf_counter() - _start) * 1e6))
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def run_scenario(python, module, scenario):
+    env = dict(os.environ, PRIME_ON_INIT='off', GOOGLE_API_KEY=os.environ.get('GOOGLE_API_KEY', 'benchmark-placeholder'))
+    code = TIMER.format(code=SCENARIOS[scenario].format(module=module))
+    completed = subprocess.run(
+        [python, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, env=env, check=True
+    )
+    elapsed_us = int(re.search(r"ELAPSED_US=(\d+)", completed.stdout).group(1))
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return elapsed_us, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure Lambda cold-start import cost per request path')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter to measure (default: this one)')
+    parser.add_argument('--module', default='src.lambda_function', help='Handler module (lambda_function inside the image)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to list for the analysis path')
+    parser.add_argument('--max-handler-import-ms', type=float, default=None,
+                        help='Exit non-zero if the median handler import exceeds this budget')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    results = {}
+    heavy_imports = []
+    for scenario in SCENARIOS:
+        samples = []
+        for _ in range(args.repeat):
+            elapsed_us, imports = run_scenario(args.python, args.module, scenario)
+            samples.append(elapsed_us / 1000)
+            if scenario == 'analysis_path':
+                heavy_imports = imports
+        results[scenario] = {
+            "median_ms": statistics.median(samples),
+            "min_ms": min(samples),
+            "max_ms": max(samples)
+        }
+
+    top_level = sorted((imp for imp in heavy_imports if imp[3] <= 1), key=lambda imp: imp[2], reverse=True)
+    results["slowest_imports"] = [
+        {"module": name, "cumulative_ms": cumulative / 1000} for name, _, cumulative, _ in top_level[:args.top]
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"Module: {args.module} ({args.repeat} runs each, PRIME_ON_INIT=off)")
+        for scenario in SCENARIOS:
+            r = results[scenario]
+            print(f"  {scenario:<16} median {r['median_ms']:8.1f}ms  (min {r['min_ms']:.1f}, max {r['max_ms']:.1f})")
+        print("Slowest imports on the analysis path:")
+        for entry in results["slowest_imports"]:
+            print(f"  {entry['module']:<40} {entry['cumulative_ms']:8.1f}ms")
+
+    budget = args.max_handler_import_ms
+    if budget is not None and results["handler_import"]["median_ms"] > budget:
+        print(f"FAIL: handler import {results['handler_import']['median_ms']:.1f}ms exceeds budget {budget:.1f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
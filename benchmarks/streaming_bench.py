@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Time to first field versus time to the complete answer.
+
+Runs the same analyses through analyze_egyptian_art_with_gemini and
+analyze_egyptian_art_streaming against the fake model, whose latency is spread
+over the streamed chunks the way a real generation is. No network calls are made.
+
+Usage: python -m benchmarks.streaming_bench [--requests 20] [--latency 2.0] [--chunks 16]
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.fake_model import fake_model_factory, make_test_image
+from src.cache import ResultCache
+from src.gemini_strategy import analyze_egyptian_art_streaming, analyze_egyptian_art_with_gemini, set_model_factory
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark time to first field of streamed analyses')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=2.0, help='Simulated model latency in seconds')
+    parser.add_argument('--chunks', type=int, default=16, help='Number of streamed response chunks')
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    set_model_factory(fake_model_factory(latency=args.latency, stream_chunks=args.chunks))
+    image = make_test_image(640, 480)
+
+    blocking = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        analyze_egyptian_art_with_gemini(image, use_cache=False, cache=ResultCache())
+        blocking.append(time.perf_counter() - start)
+
+    first_field, complete = [], []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        first = None
+        for event in analyze_egyptian_art_streaming(image, use_cache=False, cache=ResultCache()):
+            if first is None:
+                first = time.perf_counter() - start
+        first_field.append(first)
+        complete.append(time.perf_counter() - start)
+
+    print(f"Requests: {args.requests}, model latency {args.latency:.1f}s over {args.chunks} chunks")
+    print(f"blocking, full answer:    median {statistics.median(blocking):6.3f}s")
+    print(f"streaming, first field:   median {statistics.median(first_field):6.3f}s")
+    print(f"streaming, full answer:   median {statistics.median(complete):6.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Latency, answer quality and thinking tokens for fixed thinking budgets versus
+thinking_budget='auto' with a latency target.
+
+The stub model takes --thinking-latency extra seconds per 1000 tokens of budget
+and gives a vaguer answer below --quality-budget tokens, so the best budget is
+the smallest one at or above --quality-budget that still fits the target. The
+'auto' run starts without statistics and has to find it; its first requests
+(and the policy's exploration) are part of the numbers. No network calls are made.
+
+Usage: python -m benchmarks.thinking_bench [--requests 200] [--latency-target 0.7]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.fake_model import fake_model_factory, make_test_image
+from src import quota
+from src.batch import percentile
+from src.gemini_strategy import analyze_egyptian_art_with_gemini_async, get_thinking_policy, set_model_factory
+from src.thinking import quality_score
+
+
+async def run(requests, concurrency, image_bytes, thinking_budget, latency_target):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            result = await analyze_egyptian_art_with_gemini_async(
+                image_bytes, use_cache=False, preprocess=False, hedge=False,
+                thinking_budget=thinking_budget, latency_target=latency_target
+            )
+            return time.perf_counter() - start, result
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def report(label, samples):
+    latencies = sorted(latency for latency, _ in samples)
+    results = [result for _, result in samples if result["failure_status"] == "success"]
+    quality = statistics.mean(quality_score(result["analysis"]) for result in results)
+    thinking = statistics.mean(result["usage"]["thinking_tokens"] for result in results)
+    print(f"{label:<12} p50 {percentile(latencies, 0.50):6.3f}s  p95 {percentile(latencies, 0.95):6.3f}s  "
+          f"quality {quality:5.2f}  thinking tokens {thinking:7.0f}  failed {len(samples) - len(results)}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fixed and adaptive thinking budgets against a stub model')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.2, help='Stub latency without thinking, in seconds')
+    parser.add_argument('--thinking-latency', type=float, default=0.3, help='Extra seconds per 1000 budget tokens')
+    parser.add_argument('--quality-budget', type=int, default=1000, help='Budget below which answers are vaguer')
+    parser.add_argument('--latency-target', type=float, default=0.7)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    set_model_factory(fake_model_factory(
+        latency=args.latency, jitter=args.latency * 0.1, seed=1,
+        thinking_latency=args.thinking_latency, quality_budget=args.quality_budget
+    ))
+    image_bytes = make_test_image(320, 240)
+
+    print(f"Requests: {args.requests}, concurrency {args.concurrency}, latency {args.latency:.2f}s "
+          f"+ {args.thinking_latency:.2f}s per 1000 thinking tokens, latency target {args.latency_target:.2f}s")
+    for budget in (0, 512, 1024, 2000, 4096):
+        report(f"budget {budget}", asyncio.run(run(args.requests // 4, args.concurrency, image_bytes, budget, None)))
+
+    # The fixed runs above already taught the policy; start 'auto' from scratch
+    get_thinking_policy().reset()
+    results = report("auto", asyncio.run(run(args.requests, args.concurrency, image_bytes, 'auto', args.latency_target)))
+    chosen = Counter(result["thinking_budget"] for result in results)
+    print("auto budgets:", ", ".join(f"{budget}: {count}" for budget, count in sorted(chosen.items())))
+
+
+if __name__ == "__main__":
+    main()
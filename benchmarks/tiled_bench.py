@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Wall-clock time of a tiled analysis on a fast tier versus one full-image call.
+
+A synthetic wall photo (default 7200x3000, 21.6 MP) is analyzed once as a
+single 'regular' (gemini-2.5-pro) call, downscaled to that tier's 3072 px, and
+once tiled on 'fast' (gemini-2.5-flash) at full resolution. The stub models
+answer after --pro-latency and --flash-latency seconds, so the numbers show
+our own splitting, encoding and merging cost on top of the model time. No
+network calls are made.
+
+Usage: python -m benchmarks.tiled_bench [--width 7200] [--height 3000] [--pro-latency 1.2] [--flash-latency 0.4]
+"""
+
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import PIL.Image
+
+from benchmarks.fake_model import FakeGenerativeModel
+from src import quota
+from src.gemini_strategy import analyze_egyptian_art_tiled, analyze_egyptian_art_with_gemini, set_model_factory
+
+
+def make_wall_image(width, height, seed=0):
+    """JPEG bytes of a smooth, lightly textured image (compresses like a photo, unlike pure noise)."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = 120 + 60 * np.sin(x * 25) * np.cos(y * 9)
+    pixels = np.clip(base[..., None] + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+    output = io.BytesIO()
+    PIL.Image.fromarray(pixels).save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tiled analysis against a single full-image call')
+    parser.add_argument('--width', type=int, default=7200)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--pro-latency', type=float, default=1.2)
+    parser.add_argument('--flash-latency', type=float, default=0.4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'benchmark-placeholder')
+    os.environ['ANALYSIS_CACHE_DISABLED'] = '1'
+    quota.configure(limits={name: {'rpm': None, 'tpm': None} for name in quota.DEFAULT_MODEL_LIMITS})
+    latencies = {'gemini-2.5-pro': args.pro_latency, 'gemini-2.5-flash': args.flash_latency}
+    set_model_factory(lambda model_name, **options: FakeGenerativeModel(
+        model_name, latency=latencies.get(model_name, args.flash_latency)
+    ))
+    image_bytes = make_wall_image(args.width, args.height)
+    print(f"Image: {args.width}x{args.height} ({args.width * args.height / 1e6:.1f} MP, "
+          f"{len(image_bytes) / 1e6:.1f} MB), pro {args.pro_latency:.2f}s, flash {args.flash_latency:.2f}s")
+
+    single, tiled = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        single_result = analyze_egyptian_art_with_gemini(image_bytes, speed='regular', use_cache=False, hedge=False)
+        single.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        tiled_result = analyze_egyptian_art_tiled(image_bytes, speed='fast', use_cache=False, hedge=False)
+        tiled.append(time.perf_counter() - start)
+
+    stages = tiled_result['metrics']['stages_ms']
+    print(f"single regular call: {min(single):6.3f}s  (preprocess {single_result['metrics']['stages_ms'].get('preprocess', 0):.0f} ms, "
+          f"{single_result['preprocessing']['processed_size'][0]}x{single_result['preprocessing']['processed_size'][1]} px sent)")
+    print(f"tiled on fast:       {min(tiled):6.3f}s  ({tiled_result['tiling']['tile_count']} tiles, "
+          f"tiling {stages.get('tiling', 0):.0f} ms, merge {stages.get('merge', 0):.1f} ms, "
+          f"{len(tiled_result['analysis']['characters'])} characters after dedupe)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 """
 Local prediction script for Egyptian Art Analyzer.
-Usage: python predict.py <IMAGE_PATH> [--speed fast|regular|super-fast] [--type tomb|temple|other|unknown]
+Usage: python predict.py <IMAGE_PATH> [--speed fast|regular|super-fast|auto] [--type tomb|temple|other|unknown] [--stream]
+                         [--thinking-budget N|auto] [--latency-target SECONDS] [--tiled [auto]]
+                         [--profile cprofile|tracemalloc|both] [--keyframes [K]]
+       python predict.py --batch <DIR|GLOB|MANIFEST> --output results.jsonl [--concurrency 8] [--pack 8]
 """
 
 import sys
 import os
-import base64
 import json
 import argparse
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 
-from src.gemini_strategy import analyze_egyptian_art_with_gemini
+from src import profiling
+from src.gemini_strategy import (analyze_egyptian_art_with_gemini, analyze_egyptian_art_keyframes,
+                                 analyze_egyptian_art_streaming, analyze_egyptian_art_tiled)
+from src.batch import collect_batch_items, run_batch
+from src.packing import DEFAULT_PACK_TOKEN_BUDGET
+from src.thinking import DEFAULT_THINKING_BUDGET, parse_thinking_budget
 
 
 def load_env_file():
@@ -24,11 +32,63 @@ def load_env_file():
     return False
 
 
-def load_image_as_base64(image_path):
-    """Load an image file and convert it to base64."""
+def load_image_bytes(image_path):
+    """Load an image file as raw bytes (analysis accepts them without base64 encoding)."""
     with open(image_path, 'rb') as f:
-        image_data = f.read()
-    return base64.b64encode(image_data).decode('utf-8')
+        return f.read()
+
+
+def load_frames(path):
+    """A burst as the image files of a directory (in name order), or a video / multi-frame image as one blob."""
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path)
+                       if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png', '.webp', '.heic'))
+        return [load_image_bytes(os.path.join(path, name)) for name in names]
+    return load_image_bytes(path)
+
+
+def print_stage_timings(metrics):
+    """Print where the time of one analysis went."""
+    if not metrics:
+        return
+    print(f"\n📊 STAGE TIMINGS ({metrics['total_ms']:.0f} ms total):")
+    for name, duration_ms in metrics['stages_ms'].items():
+        print(f"   {name:<15} {duration_ms:>9.1f} ms")
+    for attempt in metrics['attempts']:
+        error = f" - {attempt['error']}" if 'error' in attempt else ""
+        print(f"   attempt {attempt['attempt']} ({attempt['model']}): {attempt['outcome']} "
+              f"in {attempt['duration_ms']:.0f} ms{error}")
+
+
+def print_profile(profile):
+    """Print the hot functions and allocations of a profiled analysis."""
+    if not profile:
+        return
+    print(f"\n🔬 PROFILE ({profile['mode']}, {profile['duration_ms']:.0f} ms):")
+    for function in profile.get('functions', []):
+        print(f"   {function['tottime_ms']:>9.1f} ms own {function['cumtime_ms']:>9.1f} ms cum "
+              f"{function['calls']:>7} calls  {function['function']}")
+    memory = profile.get('memory')
+    if memory:
+        print(f"   peak traced memory {memory['peak_mb']:.1f} MB")
+        for allocation in memory['allocations']:
+            print(f"   {allocation['size_kb']:>9.1f} KB {allocation['count']:>7} blocks  {allocation['line']}")
+    if 'pstats_path' in profile:
+        print(f"   pstats: {profile['pstats_path']}")
+
+
+def print_token_usage(result):
+    """Print the thinking budget and the token counts reported by the API."""
+    usage = result.get('usage')
+    if result.get('thinking_budget') is None and not usage:
+        return
+    print(f"\n🧠 THINKING:")
+    if result.get('thinking_budget') is not None:
+        print(f"   budget {result['thinking_budget']} tokens")
+    if usage:
+        cached_note = f" ({usage['cached_tokens']} cached)" if usage.get('cached_tokens') else ""
+        print(f"   input {usage['input_tokens']}{cached_note}, output {usage['output_tokens']}, "
+              f"thinking {usage['thinking_tokens']} tokens ({usage['total_tokens']} total)")
 
 
 def print_analysis(result):
@@ -66,8 +126,45 @@ def print_analysis(result):
             print(f"   {line}")
         
         print(f"\n⏱️  PROCESSING TIME:")
-        print(f"   {result.get('api_call_duration', 0):.2f} seconds")
+        cached_note = " (served from cache)" if result.get('cache_hit') else ""
+        print(f"   {result.get('api_call_duration', 0):.2f} seconds{cached_note}")
+        if result.get('model'):
+            degraded_note = f" (fallback from {result['degraded_from']})" if result.get('degraded_from') else ""
+            print(f"   answered by {result['model']}{degraded_note}")
+        print_token_usage(result)
+        
+        cascade = result.get('cascade')
+        if cascade:
+            print(f"\n🪜 CASCADE ({cascade['escalations']} escalations):")
+            for tier in cascade['tiers']:
+                confidence = f", confidence {tier['confidence']:.2f}" if 'confidence' in tier else ""
+                reasons = f" ({', '.join(tier['low_confidence'])})" if tier.get('low_confidence') else ""
+                print(f"   {tier['model']}: {tier['failure_status']} in {tier['duration']:.2f}s{confidence}{reasons}")
+        
+        keyframes = result.get('keyframes')
+        if keyframes:
+            dropped = ', '.join(f"{count} {reason}" for reason, count in keyframes['dropped'].items() if count)
+            print(f"\n🎞️  KEYFRAMES:")
+            print(f"   analyzed {keyframes['analyzed_frames']} of {keyframes['frame_count']} {keyframes['source']} frames "
+                  f"(picked in {keyframes['selection_duration'] * 1000:.0f} ms; dropped: {dropped or 'none'})")
+            print(f"   {keyframes['model_calls_saved']} model calls saved, "
+                  f"~{keyframes['estimated_seconds_saved']:.1f}s of model time")
+        
+        tiling = result.get('tiling')
+        if tiling:
+            print(f"\n🧩 TILES:")
+            failed_note = f", {tiling['failed_tiles']} failed" if tiling['failed_tiles'] else ""
+            print(f"   {tiling['tile_count']} tiles of a {tiling['image_size'][0]}x{tiling['image_size'][1]} image{failed_note}")
+        
+        preprocessing = result.get('preprocessing')
+        if preprocessing:
+            print(f"\n🗜️  UPLOAD SIZE:")
+            print(f"   {preprocessing['original_bytes'] / 1024:.0f} KB -> {preprocessing['processed_bytes'] / 1024:.0f} KB "
+                  f"({preprocessing['processed_size'][0]}x{preprocessing['processed_size'][1]} {preprocessing['format']}, "
+                  f"{preprocessing['duration'] * 1000:.0f} ms)")
         
+        print_stage_timings(result.get('metrics'))
+        print_profile(result.get('profile'))
         print("\n" + "="*80 + "\n")
         
     else:
@@ -77,7 +174,119 @@ def print_analysis(result):
         print(f"\nError: {result.get('failure_reason', 'Unknown error')}")
         if 'traceback' in result:
             print(f"\nTraceback:\n{result['traceback']}")
+        print_stage_timings(result.get('metrics'))
+        print_profile(result.get('profile'))
+        print("\n" + "="*80 + "\n")
+
+
+STREAM_HEADINGS = {
+    'picture_location': '📍 LOCATION',
+    'date': '📅 HISTORICAL PERIOD',
+    'ancient_text_translation': '🔤 ANCIENT TEXT TRANSLATION',
+    'interesting_detail': '🔍 INTERESTING DETAIL',
+}
+
+
+def print_stream_event(event, elapsed):
+    """Print one streamed field or character as soon as it arrives."""
+    if event['type'] == 'item':
+        if event['index'] == 0:
+            print(f"\n👥 CHARACTERS IDENTIFIED:")
+        char = event['value']
+        print(f"\n   {event['index'] + 1}. {char.get('character_name', 'Unknown')}  (+{elapsed:.2f}s)")
+        print(f"      Location: {char.get('location', 'Not specified')}")
+        print(f"      Reasoning: {char.get('reasoning', 'N/A')}")
+        print(f"      Description: {char.get('description', 'N/A')}")
+    elif event['name'] in STREAM_HEADINGS:
+        print(f"\n{STREAM_HEADINGS[event['name']]}:  (+{elapsed:.2f}s)")
+        for line in str(event['value']).split('\n'):
+            print(f"   {line}")
+    sys.stdout.flush()
+
+
+def run_stream_mode(args, image_bytes, preprocess):
+    """Analyze one image, printing each part of the answer as the model produces it."""
+    start_time = time.perf_counter()
+    result = None
+    if not args.json:
+        print("="*80)
+        print("EGYPTIAN ART ANALYSIS RESULTS (streaming)")
+        print("="*80)
+    for event in analyze_egyptian_art_streaming(
+        image_data=image_bytes,
+        speed=args.speed,
+        image_type=args.type,
+        thinking_budget=args.thinking_budget,
+        use_cache=not args.no_cache,
+        preprocess=preprocess,
+        latency_target=args.latency_target
+    ):
+        if event['type'] == 'result':
+            result = event['result']
+        elif args.json:
+            print(json.dumps(dict(event, elapsed=time.perf_counter() - start_time)), flush=True)
+        else:
+            print_stream_event(event, time.perf_counter() - start_time)
+    
+    if args.json:
+        print(json.dumps({"type": "result", "result": result}))
+    elif result.get("failure_status") == "success":
+        marks = result.get('metrics', {}).get('marks_ms', {})
+        print(f"\n⏱️  PROCESSING TIME:")
+        if 'first_field' in marks:
+            print(f"   first field after {marks['first_field'] / 1000:.2f}s, complete after {time.perf_counter() - start_time:.2f}s")
+        print_token_usage(result)
+        print_stage_timings(result.get('metrics'))
         print("\n" + "="*80 + "\n")
+    else:
+        print_analysis(result)
+    sys.exit(0 if result.get("failure_status") == "success" else 1)
+
+
+def print_batch_summary(summary):
+    """Print the throughput/latency summary of a batch run."""
+    print("\n" + "="*80)
+    print("BATCH SUMMARY" + (" (INTERRUPTED - rerun to resume)" if summary['interrupted'] else ""))
+    print("="*80)
+    print(f"   Processed: {summary['processed']} ({summary['succeeded']} succeeded, {summary['failed']} failed)")
+    print(f"   Skipped (already done): {summary['skipped']}")
+    print(f"   Wall time: {summary['wall_time']:.1f}s ({summary['images_per_second']:.2f} images/s)")
+    print(f"   api_call_duration p50/p95/p99: {summary['api_call_duration_p50']:.2f}s / "
+          f"{summary['api_call_duration_p95']:.2f}s / {summary['api_call_duration_p99']:.2f}s")
+    print("="*80 + "\n")
+
+
+def run_batch_mode(args, preprocess):
+    """Analyze every image from --batch, streaming JSONL records to --output."""
+    items = collect_batch_items(args.batch, speed=args.speed, image_type=args.type)
+    if not items:
+        print(f"Error: No images found for batch source: {args.batch}")
+        sys.exit(1)
+    
+    print(f"\nBatch: {len(items)} images from {args.batch}")
+    packing = f", up to {args.pack} images per call" if args.pack > 1 else ""
+    print(f"Output: {args.output} (concurrency {args.concurrency}{packing})")
+    
+    def report(record):
+        status = "ok" if record["failure_status"] == "success" else record["failure_status"]
+        pack_note = f", pack of {record['pack_size']}" if 'pack_size' in record else ""
+        print(f"[{status}] {record['path']} ({record['api_call_duration']:.2f}s{pack_note})")
+    
+    summary = run_batch(
+        items,
+        args.output,
+        concurrency=args.concurrency,
+        resume=not args.no_resume,
+        on_record=report,
+        pack_size=args.pack,
+        pack_token_budget=args.pack_token_budget,
+        use_cache=not args.no_cache,
+        preprocess=preprocess,
+        thinking_budget=args.thinking_budget,
+        latency_target=args.latency_target
+    )
+    print_batch_summary(summary)
+    sys.exit(0 if summary['failed'] == 0 and not summary['interrupted'] else 1)
 
 
 def main():
@@ -91,22 +300,71 @@ Examples:
   python predict.py data/sample-egyptian-images/VoK.jpg
   python predict.py data/sample-egyptian-images/VoK2.jpg --speed regular --type tomb
   python predict.py ~/my-photo.jpg --speed fast
+  python predict.py ~/my-photo.jpg --thinking-budget auto --latency-target 4
+  python predict.py ~/my-photo.jpg --no-cache --profile both
+  python predict.py ~/burst-folder --keyframes 2
+  python predict.py --batch data/sample-egyptian-images --output results.jsonl --concurrency 8
+  python predict.py --batch 'archive/**/*.jpg' --output results.jsonl
         """
     )
     
-    parser.add_argument('image_path', type=str, help='Path to the Egyptian art image')
+    parser.add_argument('image_path', type=str, nargs='?', help='Path to the Egyptian art image')
     parser.add_argument('--speed', type=str, default='fast', 
-                       choices=['fast', 'regular', 'super-fast'],
-                       help='Analysis speed (default: fast)')
+                       choices=['fast', 'regular', 'super-fast', 'auto'],
+                       help='Analysis speed; auto starts on flash-lite and escalates unsure answers (default: fast)')
     parser.add_argument('--type', type=str, default='unknown',
                        choices=['tomb', 'temple', 'other', 'unknown'],
                        help='Type of Egyptian art (default: unknown)')
+    parser.add_argument('--thinking-budget', type=parse_thinking_budget, default=DEFAULT_THINKING_BUDGET,
+                       help='Thinking tokens the model may spend: 0 to turn thinking off, -1 to let the model '
+                            f'decide, or auto to adapt to --latency-target (default: {DEFAULT_THINKING_BUDGET})')
+    parser.add_argument('--latency-target', type=float, default=None,
+                       help='Seconds the answer should take; guides --thinking-budget auto')
     parser.add_argument('--json', action='store_true',
                        help='Output raw JSON instead of formatted text')
+    parser.add_argument('--stream', action='store_true',
+                       help='Print each field as soon as the model has written it')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Bypass the analysis result cache and always call Gemini')
+    parser.add_argument('--max-edge', type=int, default=None,
+                       help='Downscale so the longest edge is at most this many pixels (default: per speed tier)')
+    parser.add_argument('--format', type=str, default=None, choices=['jpeg', 'webp'],
+                       help='Re-encode format sent to Gemini (default: jpeg)')
+    parser.add_argument('--quality', type=int, default=None,
+                       help='Re-encode quality 1-100 (default: per speed tier)')
+    parser.add_argument('--no-preprocess', action='store_true',
+                       help='Send the original image without resizing or re-encoding')
+    parser.add_argument('--tiled', nargs='?', const=True, default=False, choices=['auto'],
+                       help='Analyze overlapping tiles at full resolution and merge them; '
+                            '"auto" tiles only panoramas and very large images')
+    parser.add_argument('--profile', type=str, default=None, choices=list(profiling.MODES),
+                       help='Profile the analysis with cProfile and/or tracemalloc and print the hot spots')
+    parser.add_argument('--keyframes', type=int, nargs='?', const=0, default=None,
+                       help='Treat the input as a burst (a directory of photos) or a video / animated image and '
+                            'analyze only its sharpest distinct frames, at most K (default: 3)')
+    parser.add_argument('--batch', type=str, default=None,
+                       help='Analyze a directory, glob pattern or manifest file (one path or JSON object per line)')
+    parser.add_argument('--output', type=str, default='results.jsonl',
+                       help='JSONL file for batch results, also used to resume (default: results.jsonl)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                       help='Maximum analyses in flight in batch mode (default: 4)')
+    parser.add_argument('--pack', type=int, default=1,
+                       help='Batch mode: analyze up to N images of the same speed in one model call (default: 1)')
+    parser.add_argument('--pack-token-budget', type=int, default=DEFAULT_PACK_TOKEN_BUDGET,
+                       help=f'Batch mode: estimated input + output tokens per packed call (default: {DEFAULT_PACK_TOKEN_BUDGET})')
+    parser.add_argument('--no-resume', action='store_true',
+                       help='Re-analyze images that already have a successful record in --output')
     
     args = parser.parse_args()
     
-    if not os.path.exists(args.image_path):
+    if not args.batch and not args.image_path:
+        parser.error('an image path or --batch is required')
+    if args.speed == 'auto' and args.stream:
+        parser.error('--speed auto cannot be combined with --stream')
+    if args.keyframes is not None and (args.stream or args.tiled):
+        parser.error('--keyframes cannot be combined with --stream or --tiled')
+    
+    if not args.batch and not os.path.exists(args.image_path):
         print(f"Error: Image file not found: {args.image_path}")
         sys.exit(1)
     
@@ -116,21 +374,63 @@ Examples:
         print("Please set GOOGLE_API_KEY in env.local file or as environment variable.")
         sys.exit(1)
     
+    preprocess = False if args.no_preprocess else {
+        'max_edge': args.max_edge,
+        'format': args.format,
+        'quality': args.quality
+    }
+    
+    if args.profile:
+        profiling.configure(mode=args.profile, sample_rate=1)
+    
+    if args.batch:
+        run_batch_mode(args, preprocess)
+    
     print(f"\nAnalyzing image: {args.image_path}")
-    print(f"Speed: {args.speed}, Type hint: {args.type}")
+    print(f"Speed: {args.speed}, Type hint: {args.type}, Thinking budget: {args.thinking_budget}")
     print("Please wait...\n")
     
     try:
-        image_base64 = load_image_as_base64(args.image_path)
+        image_bytes = load_frames(args.image_path) if args.keyframes is not None else load_image_bytes(args.image_path)
     except Exception as e:
         print(f"Error loading image: {e}")
         sys.exit(1)
     
-    result = analyze_egyptian_art_with_gemini(
-        image_data=image_base64,
-        speed=args.speed,
-        image_type=args.type
-    )
+    if args.stream:
+        run_stream_mode(args, image_bytes, preprocess)
+    
+    if args.keyframes is not None:
+        result = analyze_egyptian_art_keyframes(
+            image_bytes,
+            speed=args.speed,
+            image_type=args.type,
+            thinking_budget=args.thinking_budget,
+            use_cache=not args.no_cache,
+            preprocess=preprocess,
+            keyframes=args.keyframes or None,
+            latency_target=args.latency_target
+        )
+    elif args.tiled:
+        result = analyze_egyptian_art_tiled(
+            image_data=image_bytes,
+            speed=args.speed,
+            image_type=args.type,
+            thinking_budget=args.thinking_budget,
+            use_cache=not args.no_cache,
+            tile_edge=args.max_edge,
+            only_if_large=args.tiled == 'auto',
+            latency_target=args.latency_target
+        )
+    else:
+        result = analyze_egyptian_art_with_gemini(
+            image_data=image_bytes,
+            speed=args.speed,
+            image_type=args.type,
+            thinking_budget=args.thinking_budget,
+            use_cache=not args.no_cache,
+            preprocess=preprocess,
+            latency_target=args.latency_target
+        )
     
     if args.json:
         print(json.dumps(result, indent=2))
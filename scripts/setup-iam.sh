@@ -2,6 +2,7 @@
 
 # Configuration
 ROLE_NAME="lambda-execution-role"
+FUNCTION_NAME="egyptianArtAnalyzer"
 REGION="us-east-2"
 
 echo "Creating IAM role for Lambda execution..."
@@ -27,5 +28,21 @@ aws iam attach-role-policy \
     --role-name $ROLE_NAME \
     --policy-arn arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole
 
+# Job mode (JOB_DISPATCH=lambda) starts its worker by invoking the function asynchronously
+ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text)
+aws iam put-role-policy \
+    --role-name $ROLE_NAME \
+    --policy-name invoke-self-for-jobs \
+    --policy-document '{
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": "lambda:InvokeFunction",
+                "Resource": "arn:aws:lambda:'"$REGION"':'"$ACCOUNT_ID"':function:'"$FUNCTION_NAME"'"
+            }
+        ]
+    }'
+
 echo "IAM role setup complete!"
-echo "Role ARN: arn:aws:iam::$(aws sts get-caller-identity --query Account --output text):role/$ROLE_NAME"
+echo "Role ARN: arn:aws:iam::$ACCOUNT_ID:role/$ROLE_NAME"
@@ -7,6 +7,7 @@ setup(
     install_requires=[
         "google-generativeai==0.8.5",
         "Pillow==10.4.0",
+        "numpy==1.26.4",
         "pydantic==2.10.4",
         "python-dotenv==1.0.0",
     ],
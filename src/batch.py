@@ -0,0 +1,238 @@
+"""
+Batch analysis of photo archives with bounded concurrency, streaming JSONL
+output and resume support.
+
+The output file doubles as the checkpoint: every finished image is appended as
+one JSON line as soon as it completes, and a rerun with the same output file
+skips every image that already has a successful record.
+"""
+
+import glob
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.cascade import AUTO_SPEED
+from src.gemini_strategy import analyze_egyptian_art_packed, analyze_egyptian_art_with_gemini
+from src.packing import DEFAULT_PACK_TOKEN_BUDGET
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff', '.heic')
+
+
+def collect_batch_items(source, speed='fast', image_type='unknown'):
+    """
+    Expand a batch source into a list of work items.
+
+    Args:
+        source: A directory (searched recursively), a glob pattern, or a manifest
+            file. Manifests are either plain text (one path per line) or JSONL
+            with a 'path' key and optional 'speed' / 'type' overrides. Relative
+            manifest paths are resolved against the manifest's directory.
+        speed: Default speed for items without an override
+        image_type: Default image type hint for items without an override
+
+    Returns:
+        List of dicts with 'path', 'speed' and 'type'
+    """
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        return [{"path": path, "speed": speed, "type": image_type} for path in paths]
+
+    if os.path.isfile(source) and not source.lower().endswith(IMAGE_EXTENSIONS):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        items = []
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                entry = json.loads(line) if line.startswith('{') else {"path": line}
+                path = entry["path"]
+                if not os.path.isabs(path):
+                    path = os.path.join(base_dir, path)
+                items.append({
+                    "path": path,
+                    "speed": entry.get("speed", speed),
+                    "type": entry.get("type", image_type)
+                })
+        return items
+
+    paths = sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+    return [{"path": path, "speed": speed, "type": image_type} for path in paths]
+
+
+def load_completed_paths(output_path):
+    """Return the paths that already have a successful record in a previous run's output."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if record.get("failure_status") == "success":
+                completed.add(record["path"])
+    return completed
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_batch(records, wall_time, skipped=0, interrupted=False):
+    """Throughput and latency summary for a finished (or interrupted) batch run."""
+    durations = sorted(record.get("api_call_duration", 0) for record in records)
+    succeeded = sum(1 for record in records if record.get("failure_status") == "success")
+    return {
+        "processed": len(records),
+        "succeeded": succeeded,
+        "failed": len(records) - succeeded,
+        "skipped": skipped,
+        "interrupted": interrupted,
+        "wall_time": wall_time,
+        "images_per_second": len(records) / wall_time if wall_time > 0 else 0.0,
+        "api_call_duration_p50": percentile(durations, 0.50),
+        "api_call_duration_p95": percentile(durations, 0.95),
+        "api_call_duration_p99": percentile(durations, 0.99)
+    }
+
+
+def _load_failure(error):
+    return {
+        "failure_status": "load_failure",
+        "failure_reason": f"Could not read image: {error}",
+        "api_call_duration": 0
+    }
+
+
+def _analyze_item(item, analyze_kwargs):
+    with open(item["path"], 'rb') as f:
+        image_bytes = f.read()
+    return [(item, analyze_egyptian_art_with_gemini(
+        image_bytes, speed=item["speed"], image_type=item["type"], **analyze_kwargs
+    ))]
+
+
+def _analyze_packed_items(items, pack_token_budget, analyze_kwargs):
+    """Analyze items of one speed tier with packed calls (see analyze_egyptian_art_packed)."""
+    results, images, loaded = [], [], []
+    for item in items:
+        try:
+            with open(item["path"], 'rb') as f:
+                images.append((f.read(), item["type"]))
+            loaded.append(item)
+        except OSError as e:
+            results.append((item, _load_failure(e)))
+    if images:
+        results += zip(loaded, analyze_egyptian_art_packed(
+            images, speed=items[0]["speed"], token_budget=pack_token_budget, max_pack_size=len(items), **analyze_kwargs
+        ))
+    return results
+
+
+def _batch_record(item, result):
+    record = {
+        "path": item["path"],
+        "speed": item["speed"],
+        "type": item["type"],
+        "failure_status": result.get("failure_status"),
+        "api_call_duration": result.get("api_call_duration", 0),
+        "cache_hit": result.get("cache_hit", False),
+        "completed_at": time.time()
+    }
+    if "pack" in result:
+        record["pack_size"] = result["pack"]["size"]
+    if result.get("failure_status") == "success":
+        record["analysis"] = result["analysis"]
+    else:
+        record["failure_reason"] = result.get("failure_reason", "Unknown error")
+    return record
+
+
+def run_batch(items, output_path, concurrency=4, resume=True, on_record=None, pack_size=None,
+              pack_token_budget=DEFAULT_PACK_TOKEN_BUDGET, **analyze_kwargs):
+    """
+    Analyze many images concurrently, appending one JSONL record per image as results finish.
+
+    Args:
+        items: Work items from collect_batch_items
+        output_path: JSONL file to append results to (also the resume checkpoint)
+        concurrency: Maximum number of analyses in flight
+        resume: Skip items that already have a successful record in output_path
+        on_record: Optional callback invoked with each record as it is written
+        pack_size: Pack up to this many images of the same speed tier into one
+            model call (see src.packing); None or 1 analyzes them one by one
+        pack_token_budget: Upper bound on a packed call's estimated tokens
+        **analyze_kwargs: Passed through to analyze_egyptian_art_with_gemini
+            (or analyze_egyptian_art_packed)
+
+    Returns:
+        Summary dict from summarize_batch
+    """
+    skipped = 0
+    if resume:
+        completed = load_completed_paths(output_path)
+        pending = [item for item in items if item["path"] not in completed]
+        skipped = len(items) - len(pending)
+    else:
+        pending = list(items)
+
+    records = []
+    interrupted = False
+    start_time = time.time()
+    with open(output_path, 'a') as output:
+        if output.tell() > 0:
+            with open(output_path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b"\n":
+                    output.write("\n")
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        try:
+            if pack_size and pack_size > 1:
+                by_speed = {}
+                for item in pending:
+                    by_speed.setdefault(item["speed"], []).append(item)
+                # speed='auto' escalates image by image, so those images are not packed
+                futures = {executor.submit(_analyze_item, item, analyze_kwargs): [item]
+                           for item in by_speed.pop(AUTO_SPEED, [])}
+                futures.update({
+                    executor.submit(_analyze_packed_items, group[start:start + pack_size], pack_token_budget,
+                                    analyze_kwargs): group[start:start + pack_size]
+                    for group in by_speed.values()
+                    for start in range(0, len(group), pack_size)
+                })
+            else:
+                futures = {executor.submit(_analyze_item, item, analyze_kwargs): [item] for item in pending}
+            for future in as_completed(futures):
+                try:
+                    item_results = future.result()
+                except Exception as e:
+                    item_results = [(item, _load_failure(e)) for item in futures[future]]
+                for item, result in item_results:
+                    record = _batch_record(item, result)
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+                    records.append(record)
+                    if on_record is not None:
+                        on_record(record)
+        except KeyboardInterrupt:
+            # Everything written so far is checkpointed; a rerun resumes from here
+            interrupted = True
+        finally:
+            executor.shutdown(wait=not interrupted, cancel_futures=True)
+
+    return summarize_batch(records, time.time() - start_time, skipped=skipped, interrupted=interrupted)
@@ -0,0 +1,237 @@
+"""
+Content-addressed result cache for Gemini analyses.
+
+Results are keyed by a SHA-256 digest of the decoded image bytes plus every
+parameter that changes the model output (speed tier, image type hint, thinking
+budget and prompt/schema version). Lookups go through a bounded in-process LRU
+first and then through an optional SQLite file, which on Lambda lives in /tmp
+so it survives warm restarts of the same execution environment.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from src.metrics import get_logger
+
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+LAMBDA_DISK_PATH = '/tmp/egyptian-art-cache.sqlite3'
+
+logger = get_logger('cache')
+
+
+def make_cache_key(image_bytes, speed, image_type, thinking_budget, prompt_version, variant=''):
+    """
+    Build the cache key for one analysis request.
+
+    ``variant`` captures any other setting that changes what the model sees,
+    such as the preprocessing configuration.
+    """
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    params = f"{image_digest}|{speed}|{image_type}|{thinking_budget}|{prompt_version}|{variant}"
+    return hashlib.sha256(params.encode('utf-8')).hexdigest()
+
+
+class MemoryLRU:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """On-disk cache tier with TTL and total-size eviction (least recently used first)."""
+
+    def __init__(self, path, max_bytes=DEFAULT_DISK_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now + self.ttl_seconds, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM results ORDER BY accessed_at ASC"
+        ).fetchall():
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+
+
+class ResultCache:
+    """
+    Two-tier analysis cache: an in-process LRU in front of an optional disk store.
+
+    Only successful results should be stored; callers decide that.
+    """
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory if memory is not None else MemoryLRU()
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self._counters[name] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("hits", "memory_hits")
+            return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Cache disk read failed: %s", e)
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("hits", "disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error as e:
+                logger.warning("Cache disk write failed: %s", e)
+        self._count("stores")
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["memory_entries"] = len(self.memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Return the process-wide cache configured from environment variables.
+
+    ANALYSIS_CACHE_DISABLED=1 turns caching off. ANALYSIS_CACHE_PATH enables the
+    SQLite tier (defaults to /tmp on Lambda, memory-only elsewhere);
+    ANALYSIS_CACHE_MEMORY_ENTRIES, ANALYSIS_CACHE_TTL and ANALYSIS_CACHE_MAX_BYTES
+    tune the bounds.
+    """
+    global _default_cache
+    if os.environ.get('ANALYSIS_CACHE_DISABLED') == '1':
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            ttl = int(os.environ.get('ANALYSIS_CACHE_TTL', DEFAULT_TTL_SECONDS))
+            memory = MemoryLRU(
+                max_entries=int(os.environ.get('ANALYSIS_CACHE_MEMORY_ENTRIES', DEFAULT_MEMORY_ENTRIES)),
+                ttl_seconds=ttl
+            )
+            default_path = LAMBDA_DISK_PATH if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else None
+            path = os.environ.get('ANALYSIS_CACHE_PATH', default_path)
+            disk = None
+            if path:
+                try:
+                    disk = SQLiteStore(
+                        path,
+                        max_bytes=int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', DEFAULT_DISK_MAX_BYTES)),
+                        ttl_seconds=ttl
+                    )
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning("Cache disk tier unavailable at %s: %s", path, e)
+            _default_cache = ResultCache(memory=memory, disk=disk)
+        return _default_cache
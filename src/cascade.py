@@ -0,0 +1,65 @@
+"""
+Confidence scoring for the speed='auto' model cascade.
+
+Most photos are easy: a labelled scene from a well-known tomb is identified
+as well by gemini-2.5-flash-lite as by gemini-2.5-pro, at a fraction of the
+latency. With speed='auto' the analysis runs on the fastest tier first and
+only escalates (flash-lite -> flash -> pro) when the answer looks unsure.
+
+Confidence is read from the answer itself, as for the thinking budget's
+quality proxy: characters the model could not name, a location that is
+missing or hedged, and a missing translation lower it; an unknown date
+lowers it a little. An answer below the minimum confidence goes to the next
+tier. When no tier is confident, the most confident answer is returned.
+"""
+
+from src.thinking import informative
+
+AUTO_SPEED = 'auto'
+# Tried in this order; the last one answers whatever its confidence
+CASCADE_SPEEDS = ('super-fast', 'fast', 'regular')
+DEFAULT_MIN_CONFIDENCE = 0.75
+
+# Share of the confidence each check is worth. Missing one of the first
+# three drops an answer below DEFAULT_MIN_CONFIDENCE; an unknown date alone does not.
+CONFIDENCE_WEIGHTS = {
+    'unknown_characters': 0.3,
+    'hedged_location': 0.3,
+    'no_translation': 0.3,
+    'unknown_date': 0.1,
+}
+
+# The prompt asks for speculative language ("likely", "probably") unless the
+# model is very sure, so only phrases that give up on an answer count as hedging
+HEDGED_PHRASES = (
+    'unknown', 'unidentified', 'unclear', 'uncertain', 'not certain', 'cannot be determined',
+    'difficult to determine', 'hard to determine', 'impossible to determine', 'unable to',
+    'not possible to', 'could be any', 'unspecified', 'generic',
+)
+
+
+def low_confidence_reasons(analysis):
+    """Names of the CONFIDENCE_WEIGHTS checks an analysis dict fails."""
+    reasons = []
+    characters = analysis.get('characters') or []
+    if any(not informative(character.get('character_name', '')) for character in characters):
+        reasons.append('unknown_characters')
+    location = analysis.get('picture_location', '')
+    if not informative(location) or any(phrase in location.lower() for phrase in HEDGED_PHRASES):
+        reasons.append('hedged_location')
+    if not informative(analysis.get('ancient_text_translation', '')):
+        reasons.append('no_translation')
+    if not informative(analysis.get('date', '')):
+        reasons.append('unknown_date')
+    return reasons
+
+
+def confidence_score(analysis):
+    """
+    Confidence of an analysis dict, between 0 and 1.
+
+    Returns:
+        (score, reasons) - reasons lists the failed checks (see low_confidence_reasons)
+    """
+    reasons = low_confidence_reasons(analysis)
+    return round(1.0 - sum(CONFIDENCE_WEIGHTS[reason] for reason in reasons), 3), reasons
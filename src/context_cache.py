@@ -0,0 +1,222 @@
+"""
+Model-side context caching of the constant prompt prefix.
+
+Gemini can store a prefix (here: the system instruction) as cached content
+that later requests reference by name instead of re-sending it. Cached input
+tokens are billed at a reduced rate and are not processed again, which cuts
+time to first token for long prefixes. Caches expire after their TTL and cost
+storage while they live.
+
+ContextCacheManager keeps one cache per (model, prompt prefix id): it reuses a
+cache with the same display name left by another process (Lambda
+containers come and go), extends the TTL shortly before it runs out, creates
+a new one once it has expired, and backs off for a while when the API
+refuses. The API only caches prefixes of at least CONTEXT_CACHE_MIN_TOKENS;
+shorter ones are sent as part of the request as before.
+
+GeminiContextCacheBackend talks to the API; LocalContextCacheBackend is an
+in-memory stand-in for benchmarks and local runs.
+"""
+
+import datetime
+import itertools
+import threading
+import time
+
+from src.metrics import get_logger
+from src.quota import CHARS_PER_TOKEN
+
+logger = get_logger('context_cache')
+
+DEFAULT_TTL_SECONDS = 3600
+# Extend a cache's TTL once less than this is left
+REFRESH_MARGIN_SECONDS = 300
+# After a failed create, requests go uncached for this long before trying again
+RETRY_AFTER_SECONDS = 60
+# Smallest prefix the API accepts as cached content, per model
+CONTEXT_CACHE_MIN_TOKENS = {
+    'gemini-2.5-pro': 4096,
+    'gemini-2.5-flash': 1024,
+    'gemini-2.5-flash-lite': 1024,
+}
+DEFAULT_MIN_TOKENS = 1024
+
+
+class LocalCachedContent:
+    """What LocalContextCacheBackend hands out in place of a genai CachedContent."""
+
+    def __init__(self, name, model, display_name, system_instruction, expire_time):
+        self.name = name
+        self.model = model
+        self.display_name = display_name
+        self.system_instruction = system_instruction
+        self.token_count = len(system_instruction) // CHARS_PER_TOKEN
+        self.expire_time = expire_time
+
+
+class LocalContextCacheBackend:
+    """In-memory stand-in for the cachedContents API, with call counters."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.entries = {}
+        self.created = self.refreshed = self.deleted = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def find(self, model_name, display_name):
+        with self._lock:
+            now = self.clock()
+            for entry in self.entries.values():
+                if entry.model == model_name and entry.display_name == display_name and entry.expire_time > now:
+                    return entry, entry.expire_time
+        return None
+
+    def create(self, model_name, display_name, system_instruction, ttl):
+        with self._lock:
+            self.created += 1
+            entry = LocalCachedContent(f"cachedContents/local-{next(self._ids)}", model_name, display_name,
+                                       system_instruction, self.clock() + ttl)
+            self.entries[entry.name] = entry
+            return entry, entry.expire_time
+
+    def refresh(self, handle, ttl):
+        with self._lock:
+            if handle.name not in self.entries or handle.expire_time <= self.clock():
+                raise KeyError(f"{handle.name} has expired")
+            self.refreshed += 1
+            handle.expire_time = self.clock() + ttl
+            return handle.expire_time
+
+    def delete(self, handle):
+        with self._lock:
+            if self.entries.pop(handle.name, None) is not None:
+                self.deleted += 1
+
+
+class GeminiContextCacheBackend:
+    """The cachedContents API through google.generativeai.caching."""
+
+    def find(self, model_name, display_name):
+        from google.generativeai import caching
+        for cached in caching.CachedContent.list():
+            if cached.model == f"models/{model_name}" and cached.display_name == display_name:
+                expire_time = cached.expire_time.timestamp()
+                if expire_time > time.time():
+                    return cached, expire_time
+        return None
+
+    def create(self, model_name, display_name, system_instruction, ttl):
+        from google.generativeai import caching
+        cached = caching.CachedContent.create(
+            model=f"models/{model_name}", display_name=display_name,
+            system_instruction=system_instruction, ttl=datetime.timedelta(seconds=ttl)
+        )
+        return cached, cached.expire_time.timestamp()
+
+    def refresh(self, handle, ttl):
+        handle.update(ttl=datetime.timedelta(seconds=ttl))
+        return handle.expire_time.timestamp()
+
+    def delete(self, handle):
+        handle.delete()
+
+
+def is_cacheable(model_name, prefix_text, min_tokens=None):
+    """Whether prefix_text reaches the smallest prefix model_name will cache."""
+    min_tokens = CONTEXT_CACHE_MIN_TOKENS if min_tokens is None else min_tokens
+    return len(prefix_text) // CHARS_PER_TOKEN >= min_tokens.get(model_name, DEFAULT_MIN_TOKENS)
+
+
+class ContextCacheManager:
+    """
+    Thread-safe registry of cached prompt prefixes, one per (model, prefix id).
+
+    Args:
+        backend: GeminiContextCacheBackend (default) or LocalContextCacheBackend
+        ttl: Lifetime of a cache in seconds, extended while it is in use
+        refresh_margin: Extend the TTL once less than this many seconds are left
+        min_tokens: Per-model smallest prefix worth caching (CONTEXT_CACHE_MIN_TOKENS)
+        clock: Time source, seconds since the epoch
+    """
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL_SECONDS, refresh_margin=REFRESH_MARGIN_SECONDS,
+                 min_tokens=None, clock=time.time):
+        self.backend = backend if backend is not None else GeminiContextCacheBackend()
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = CONTEXT_CACHE_MIN_TOKENS if min_tokens is None else min_tokens
+        self.clock = clock
+        # (model, prefix id) -> {"handle", "expires_at"}, or {"retry_at"} after a failure
+        self._entries = {}
+        self._too_short = set()
+        self._lock = threading.Lock()
+
+    def peek(self, model_name, prefix_id):
+        """
+        (handle, stale) without calling the API: handle is the usable cache or
+        None, and stale says whether get() would create or extend one.
+        """
+        key = (model_name, prefix_id)
+        if key in self._too_short:
+            return None, False
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, True
+        now = self.clock()
+        if "retry_at" in entry:
+            return None, now >= entry["retry_at"]
+        if entry["expires_at"] - now > self.refresh_margin:
+            return entry["handle"], False
+        return None, True
+
+    def get(self, model_name, prefix_id, prefix_text):
+        """
+        The cache holding prefix_text for model_name, created or extended as needed,
+        or None when the prefix is sent with the request instead. May call the API.
+        """
+        key = (model_name, prefix_id)
+        with self._lock:
+            handle, stale = self.peek(model_name, prefix_id)
+            if not stale:
+                return handle
+            if not is_cacheable(model_name, prefix_text, self.min_tokens):
+                logger.info("Prompt prefix %s is shorter than the %d tokens %s can cache; sending it with each request",
+                            prefix_id, self.min_tokens.get(model_name, DEFAULT_MIN_TOKENS), model_name)
+                self._too_short.add(key)
+                return None
+            entry = self._entries.get(key)
+            now = self.clock()
+            if entry is not None and "handle" in entry and entry["expires_at"] > now:
+                try:
+                    entry["expires_at"] = self.backend.refresh(entry["handle"], self.ttl)
+                    return entry["handle"]
+                except Exception as e:
+                    logger.warning("Could not extend context cache for %s: %s", prefix_id, e)
+            display_name = f"egyptian-art-{prefix_id.replace(':', '-')}"
+            try:
+                found = self.backend.find(model_name, display_name)
+                if found is not None and found[1] - now > self.refresh_margin:
+                    handle, expires_at = found
+                else:
+                    handle, expires_at = self.backend.create(model_name, display_name, prefix_text, self.ttl)
+                    logger.info("Created context cache %s for %s on %s", handle.name, prefix_id, model_name)
+            except Exception as e:
+                logger.warning("Could not create context cache for %s on %s: %s", prefix_id, model_name, e)
+                self._entries[key] = {"retry_at": now + RETRY_AFTER_SECONDS}
+                return None
+            self._entries[key] = {"handle": handle, "expires_at": expires_at}
+            return handle
+
+    def clear(self, delete=False):
+        """Forget every cache; with delete=True also delete them model-side."""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+            self._too_short.clear()
+        if delete:
+            for entry in entries.values():
+                if "handle" in entry:
+                    try:
+                        self.backend.delete(entry["handle"])
+                    except Exception as e:
+                        logger.warning("Could not delete context cache %s: %s", entry["handle"].name, e)
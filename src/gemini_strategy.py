@@ -2,48 +2,786 @@ import os
 import time
 import base64
 import json
+import asyncio
+import queue
+import threading
+import weakref
 import google.generativeai as genai
-import io
-import PIL.Image
+from google.generativeai import client as genai_client
 import sys
+from pydantic import ValidationError
 
-from src.schemas import EgyptianArtAnalysis
+from src.schemas import EgyptianArtAnalysis, PackedAnalyses
+from src.cache import get_default_cache, make_cache_key
+from src.preprocessing import (ImageTooLargeError, UnsupportedMediaError, draft_image, open_image, preprocess_image,
+                               resolve_preprocess_config)
+from src.metrics import RequestMetrics, get_logger
+from src.streaming import IncrementalJSONParser, analysis_events
+from src.json_codec import extract_json_object
+from src.retry import DecorrelatedJitterBackoff, get_latency_tracker, hedge_delay, hedged_call, is_retryable_error
+from src.context_cache import DEFAULT_TTL_SECONDS as CONTEXT_CACHE_TTL_SECONDS, ContextCacheManager, is_cacheable
+from src.prompts import PROMPT_VERSION, get_prompt
+from src.packing import DEFAULT_MAX_PACK_SIZE, DEFAULT_PACK_TOKEN_BUDGET, OutputTokenEstimate, plan_packs
+from src.quota import CHARS_PER_TOKEN, QuotaExhaustedError, estimate_input_tokens, fallback_ladder, get_breaker, reserve_model, try_reserve
+from src.thinking import AUTO, DEFAULT_THINKING_BUDGET, ThinkingBudgetPolicy, clamp_thinking_budget, quality_score
+from src.cascade import AUTO_SPEED, CASCADE_SPEEDS, DEFAULT_MIN_CONFIDENCE, confidence_score
+from src.singleflight import get_single_flight
+from src import profiling
 
-DEFAULT_THINKING_BUDGET = 2000
+logger = get_logger('gemini')
+
+SPEED_TO_MODEL = {
+    'regular': 'gemini-2.5-pro',
+    'fast': 'gemini-2.5-flash',
+    'super-fast': 'gemini-2.5-flash-lite'
+}
+DEFAULT_MODEL = 'gemini-2.5-flash'
+# Image formats Gemini accepts as they are
+UPLOAD_MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+MAX_RETRIES = 2
+# Longest edge the near-duplicate hash decodes at (it looks at 9x8 pixels)
+FINGERPRINT_DECODE_EDGE = 256
+
+_thinking_policy = ThinkingBudgetPolicy(DEFAULT_THINKING_BUDGET)
+_packed_output_tokens = OutputTokenEstimate()
+
+
+def get_thinking_policy():
+    """The process-wide policy that resolves thinking_budget='auto'."""
+    return _thinking_policy
+
+
+# The pinned google-ai-generativelanguage (0.6.15) predates thinking budgets: its
+# GenerationConfig has no thinking_config, so no budget can be sent to the model.
+THINKING_CONFIG_SUPPORTED = 'thinking_config' in genai.protos.GenerationConfig.meta.fields
+_thinking_warning_logged = False
+
+
+def _default_model_factory(model_name, temperature=0, thinking_budget=None, response_schema=EgyptianArtAnalysis,
+                           cached_content=None):
+    generation_config = {
+        "response_schema": response_schema,
+        "response_mime_type": "application/json",
+        "temperature": temperature
+    }
+    if thinking_budget is not None and THINKING_CONFIG_SUPPORTED:
+        generation_config["thinking_config"] = {"thinking_budget": thinking_budget}
+    if cached_content is not None:
+        return genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+    return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+
+
+_model_factory = _default_model_factory
+
+
+def _default_context_cache():
+    if os.environ.get('CONTEXT_CACHE') != '1':
+        return None
+    prefix = get_prompt().prefix
+    if not any(is_cacheable(model_name, prefix) for model_name in SPEED_TO_MODEL.values()):
+        # Nothing could be cached, so don't pay for the lookups on every request
+        logger.warning("CONTEXT_CACHE=1 has no effect: the %s prompt prefix is about %d tokens, below the "
+                       "smallest prefix any model caches", PROMPT_VERSION, len(prefix) // CHARS_PER_TOKEN)
+        return None
+    return ContextCacheManager(ttl=int(os.environ.get('CONTEXT_CACHE_TTL', CONTEXT_CACHE_TTL_SECONDS)))
+
+
+# CONTEXT_CACHE=1 stores the prompt prefix model-side (see src.context_cache)
+_context_cache = _default_context_cache()
+
+
+def set_context_cache(manager=None):
+    """Use a ContextCacheManager for the prompt prefix, or None to send it with every request."""
+    global _context_cache
+    _context_cache = manager
+
+_registry_lock = threading.Lock()
+_configured_api_key = None
+# Event loop -> {model key: model}. grpc.aio channels are bound to the loop that
+# created them, so every loop gets its own async client and model objects.
+_model_registry = weakref.WeakKeyDictionary()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def set_model_factory(factory=None):
+    """
+    Replace how models are built, e.g. with a stub for benchmarks.
+
+    The factory takes a model name plus the temperature, thinking_budget,
+    response_schema and cached_content keywords and returns an object with generate_content_async(). Pass None to
+    restore the real Gemini model.
+    """
+    global _model_factory
+    with _registry_lock:
+        _model_factory = factory or _default_model_factory
+        _model_registry.clear()
+
+
+def _ensure_configured(api_key):
+    """Configure the SDK once per API key instead of on every call."""
+    global _configured_api_key
+    with _registry_lock:
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+            _model_registry.clear()
+            _async_clients.clear()
+
+
+def get_model(model_name, temperature=0, thinking_budget=None, response_schema=EgyptianArtAnalysis,
+              cached_content=None):
+    """
+    Return the shared model for (model, schema, temperature, thinking budget).
+
+    Models are built once - including the conversion of the response schema
+    (EgyptianArtAnalysis, or PackedAnalyses for packed calls) - and reuse one async client per event loop, so warm invocations keep
+    their connection to the API open. Must be called from the event loop that
+    will use the model. The thinking budget is clamped to the model's range.
+    With cached_content (see src.context_cache) the model sends its requests
+    with that cached prompt prefix.
+    """
+    loop = asyncio.get_running_loop()
+    thinking_budget = clamp_thinking_budget(model_name, thinking_budget)
+    key = (model_name, response_schema.__name__, temperature, thinking_budget,
+           getattr(cached_content, 'name', None))
+    with _registry_lock:
+        models = _model_registry.get(loop)
+        if models is None:
+            models = _model_registry[loop] = {}
+        model = models.get(key)
+        if model is None:
+            model = _model_factory(model_name, temperature=temperature, thinking_budget=thinking_budget,
+                                   response_schema=response_schema, cached_content=cached_content)
+            if isinstance(model, genai.GenerativeModel):
+                async_client = _async_clients.get(loop)
+                if async_client is None:
+                    async_client = _async_clients[loop] = genai_client._client_manager.make_client("generative_async")
+                model._async_client = async_client
+            models[key] = model
+        return model
+
+
+def prewarm_models(speeds=None, thinking_budget=None):
+    """
+    Configure the SDK and build the models for the given speed tiers on the
+    shared event loop (and their prompt caches, when context caching is on),
+    so the first request does not pay for it. Intended for
+    the Lambda init phase; does nothing without an API key.
+    """
+    api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return
+    _ensure_configured(api_key)
+    if _context_cache is not None:
+        prompt = get_prompt()
+        for speed in speeds or SPEED_TO_MODEL:
+            _context_cache.get(SPEED_TO_MODEL.get(speed, DEFAULT_MODEL), prompt.prefix_id, prompt.prefix)
+    asyncio.run_coroutine_threadsafe(prewarm_models_async(speeds, thinking_budget), _get_background_loop()).result()
+
+async def prewarm_models_async(speeds=None, thinking_budget=None):
+    """
+    Build the models for the given speed tiers on the running event loop, for
+    callers that await analyses on their own loop (prewarm_models covers the
+    shared one). Does nothing without an API key.
+    """
+    api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return
+    _ensure_configured(api_key)
+    if thinking_budget is None:
+        thinking_budget = DEFAULT_THINKING_BUDGET
+    for speed in speeds or SPEED_TO_MODEL:
+        get_model(SPEED_TO_MODEL.get(speed, DEFAULT_MODEL), thinking_budget=thinking_budget)
+
+def create_near_duplicate_hint(prior_analysis):
+    """Prompt addendum that seeds the model with the analysis of a near-identical photo."""
+    return (
+        "\n\nReference: a very similar photograph was previously identified as "
+        f"\"{prior_analysis.get('picture_location', '')}\" ({prior_analysis.get('date', '')}). "
+        "Use this as a starting point but verify it against what is actually visible."
+    )
 
 def create_egyptian_art_prompt(image_type_hint=None):
-    """Create the expert Egyptologist prompt for analyzing Egyptian art images."""
-    base_prompt = """You are an expert Egyptologist with deep knowledge of ancient Egyptian art, tomb paintings, temple reliefs, and ancient texts. You are analyzing a photograph taken by a tourist of ancient Egyptian wall decorations, likely from famous sites like the Valley of the Kings, Karnak Temple, or other well-documented locations.
+    """The expert Egyptologist prompt for analyzing Egyptian art images, from the prompt registry."""
+    return get_prompt(image_type_hint).text
+
+def create_packed_prompt(image_count):
+    """The expert prompt for a call that analyzes image_count labelled images at once."""
+    return get_prompt().text + (
+        f"\n\nYou are given {image_count} photographs, each preceded by its label (Image 0 to Image {image_count - 1}). "
+        "They are unrelated unless they clearly show the same scene: analyze each one on its own, and return "
+        "exactly one entry per image with its image_index."
+    )
 
-**IMPORTANT: Use your extensive knowledge of famous Egyptian tombs and their documented artwork, especially:**
-- Valley of the Kings tombs (KV1-KV64), such as Tutankhamun's tomb (KV62)
-- Valley of the Queens tombs
-- Well-documented temple reliefs from Karnak, Luxor, Abu Simbel
-- Famous Egyptian artworks
+def _decode_image_data(image_data):
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return image_data
+    return base64.b64decode(image_data)
+
+def _prepare_analysis(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                      near_duplicate_index, near_duplicate_threshold, near_duplicate_mode, preprocess, metrics):
+    """
+    Everything that happens before the model call: decoding, cache and
+    near-duplicate lookups, preprocessing and prompt construction.
 
-Your task is to analyze what is depicted in the captured image. Provide a detailed analysis in the specified JSON format.
-"""
+    Returns:
+        (early_result, context) - early_result is a complete result dict when the
+        request can be answered without calling the model, otherwise None
+    """
+    lookup_start_time = time.time()
+    with metrics.stage("base64_decode"):
+        image_bytes = _decode_image_data(image_data)
+    preprocess_config = None
+    if preprocess is not False:
+        preprocess_config = resolve_preprocess_config(speed, preprocess if isinstance(preprocess, dict) else None)
+    
+    if use_cache and cache is None:
+        cache = get_default_cache()
+    cache_key = None
+    if use_cache and cache is not None:
+        with metrics.stage("cache_lookup"):
+            cache_key = make_cache_key(image_bytes, speed, image_type, thinking_budget, PROMPT_VERSION,
+                                       variant=json.dumps(preprocess_config, sort_keys=True))
+            cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("Cache hit %s (speed=%s, image_type=%s)", cache_key[:16], speed, image_type)
+            metrics.add_counter("cache_hit", 1)
+            # No model call was made, so no tokens were spent (entries stored before usage was dropped have it)
+            result = {name: value for name, value in cached_result.items() if name != "usage"}
+            return dict(result, cache_hit=True, cached=True, api_call_duration=time.time() - lookup_start_time), None
+    
+    with metrics.stage("image_open"):
+        # Header only: oversized images are refused before anything is decoded
+        image = open_image(image_bytes)
+    
+    if near_duplicate_index is None and os.environ.get('PHASH_INDEX_PATH'):
+        # Imported lazily: NumPy is only needed when an index is configured
+        from src.perceptual_index import get_default_index
+        near_duplicate_index = get_default_index()
+    fingerprint = None
+    near_duplicate = None
+    if near_duplicate_index is not None:
+        from src.perceptual_index import DEFAULT_THRESHOLD, dhash
+        if near_duplicate_threshold is None:
+            near_duplicate_threshold = int(os.environ.get('NEAR_DUPLICATE_THRESHOLD', DEFAULT_THRESHOLD))
+        if near_duplicate_mode is None:
+            near_duplicate_mode = os.environ.get('NEAR_DUPLICATE_MODE', 'return')
+        with metrics.stage("near_duplicate"):
+            # A separate, reduced-scale decode: the hash needs a few pixels, the upload its own size
+            fingerprint_image = open_image(image_bytes)
+            draft_image(fingerprint_image, FINGERPRINT_DECODE_EDGE)
+            fingerprint = dhash(fingerprint_image)
+            if use_cache:
+                near_duplicate = near_duplicate_index.lookup(
+                    fingerprint, near_duplicate_threshold,
+                    accept=lambda record: _reusable_near_duplicate(record, speed, image_type)
+                )
+        if near_duplicate is not None and near_duplicate_mode == 'return':
+            distance, record = near_duplicate
+            logger.info("Near-duplicate hit: distance=%d (threshold=%d)", distance, near_duplicate_threshold)
+            metrics.add_counter("near_duplicate_hit", 1)
+            return {
+                "failure_status": "success",
+                "analysis": record["analysis"],
+                "api_call_duration": time.time() - lookup_start_time,
+                "cache_hit": False,
+                "near_duplicate": {"distance": distance, "mode": "return", "speed": record.get("speed")}
+            }, None
+    
+    preprocessing_stats = None
+    if image.format in UPLOAD_MIME_TYPES:
+        # Sent as uploaded; handing the SDK a PIL image would re-encode it as lossless WebP
+        image_part = {"mime_type": UPLOAD_MIME_TYPES[image.format], "data": bytes(image_bytes)}
+    else:
+        image_part = image
+    if preprocess_config is not None:
+        with metrics.stage("preprocess"):
+            image_part, preprocessing_stats = preprocess_image(image, len(image_bytes), **preprocess_config)
+        logger.info("Preprocessed %d -> %d bytes, %s -> %s px",
+                    preprocessing_stats['original_bytes'], preprocessing_stats['processed_bytes'],
+                    preprocessing_stats['original_size'], preprocessing_stats['processed_size'])
     
-    if image_type_hint and image_type_hint != 'unknown':
-        base_prompt += f"\n\nHint: The image most likely belongs to a {image_type_hint}."
+    prompt = get_prompt(image_type)
+    prompt_text = prompt.text
+    if near_duplicate is not None and near_duplicate_mode == 'seed':
+        logger.info("Near-duplicate seed: distance=%d", near_duplicate[0])
+        prompt_text += create_near_duplicate_hint(near_duplicate[1]["analysis"])
     
-    return base_prompt
+    context = {
+        "speed": speed,
+        "image_type": image_type,
+        "image_size": len(image_bytes),
+        "cache": cache,
+        "cache_key": cache_key,
+        "near_duplicate_index": near_duplicate_index,
+        "fingerprint": fingerprint,
+        "near_duplicate": near_duplicate,
+        "near_duplicate_mode": near_duplicate_mode,
+        "preprocessing_stats": preprocessing_stats,
+        "contents": [prompt_text, image_part],
+        "prompt_prefix": prompt,
+        "input_tokens": estimate_input_tokens(
+            prompt_text, preprocessing_stats['processed_size'] if preprocessing_stats else image.size
+        )
+    }
+    return None, context
 
-def analyze_egyptian_art_with_gemini(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET):
+def _extract_response_text(response):
+    # Try different ways to access the response text
+    try:
+        # Method 1: Direct text access
+        return response.text
+    except AttributeError:
+        try:
+            # Method 2: Through candidates
+            return response.candidates[0].content.parts[0].text
+        except AttributeError:
+            try:
+                # Method 3: Check if parts contain text differently
+                part = response.candidates[0].content.parts[0]
+                return getattr(part, 'text', str(part))
+            except Exception as e:
+                raise Exception(f"Cannot access response text. Response structure: {type(response)}")
+
+def _parse_analysis(response_text):
     """
-    Analyze Egyptian art image using Gemini with structured output.
+    Decode and validate the model's JSON in one pass with Pydantic's JSON parser.
+
+    Text around the outermost braces (code fences, prose) is sliced off first.
+    Only if that is still not valid JSON - trailing commas, stray braces after
+    the object - is the object cut out token by token by extract_json_object.
+    """
+    start, end = response_text.find('{'), response_text.rfind('}')
+    if 0 <= start < end:
+        try:
+            return EgyptianArtAnalysis.model_validate_json(response_text[start:end + 1])
+        except ValidationError as error:
+            if not any(detail['type'] == 'json_invalid' for detail in error.errors()):
+                raise
+    try:
+        candidate = extract_json_object(response_text)
+    except ValueError as error:
+        raise ValueError(f"{error}. Raw response: {response_text[:1000]}...") from None
+    logger.info("Parsed response after repairing its JSON object")
+    return EgyptianArtAnalysis.model_validate_json(candidate)
+
+def _parse_packed_analyses(response_text):
+    """
+    Split a PackedAnalyses answer into validated per-image analyses.
+
+    Returns:
+        {image_index: EgyptianArtAnalysis} for the entries that validate; the
+        others are left out, so only those images need another call
+
+    Raises:
+        ValueError: when the response holds no readable list of analyses
+    """
+    start, end = response_text.find('{'), response_text.rfind('}')
+    try:
+        data = json.loads(response_text[start:end + 1] if 0 <= start < end else response_text)
+    except json.JSONDecodeError:
+        try:
+            data = json.loads(extract_json_object(response_text))
+        except ValueError as error:
+            raise ValueError(f"{error}. Raw response: {response_text[:1000]}...") from None
+    entries = data.get('analyses') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError(f"Packed response has no 'analyses' list. Raw response: {response_text[:1000]}...")
+    analyses = {}
+    for entry in entries:
+        image_index = entry.get('image_index') if isinstance(entry, dict) else None
+        if not isinstance(image_index, int) or image_index in analyses:
+            continue
+        try:
+            analyses[image_index] = EgyptianArtAnalysis.model_validate(entry.get('analysis'))
+        except ValidationError as error:
+            logger.warning("Packed analysis of image %d is invalid (%d errors)", image_index, error.error_count())
+    return analyses
+
+def _chunk_text(chunk):
+    # Stream chunks that carry only a finish reason or safety ratings have no text
+    try:
+        return chunk.text
+    except (AttributeError, ValueError, IndexError):
+        return ''
+
+def _usage_counts(response):
+    """Token counts from a response's usage metadata, or None when it carries none."""
+    usage = getattr(response, 'usage_metadata', None)
+    total_tokens = getattr(usage, 'total_token_count', 0) or 0
+    if not total_tokens:
+        return None
+    input_tokens = usage.prompt_token_count or 0
+    output_tokens = usage.candidates_token_count or 0
+    # Without a thoughts_token_count field, thinking is what the total leaves over
+    thinking_tokens = getattr(usage, 'thoughts_token_count', None)
+    if thinking_tokens is None:
+        thinking_tokens = max(0, total_tokens - input_tokens - output_tokens)
+    return {
+        "input_tokens": input_tokens,
+        "cached_tokens": getattr(usage, 'cached_content_token_count', 0) or 0,
+        "output_tokens": output_tokens,
+        "thinking_tokens": thinking_tokens,
+        "total_tokens": total_tokens
+    }
+
+def _applied_thinking_budget(thinking_budget):
+    """
+    The thinking budget a request can actually use: as given when the models
+    take one, otherwise None. A budget that never reaches the model is not
+    reported, keyed on or learned from, and 'auto' does not consult the policy.
+    """
+    global _thinking_warning_logged
+    if THINKING_CONFIG_SUPPORTED or _model_factory is not _default_model_factory:
+        return thinking_budget
+    if thinking_budget is not None and not _thinking_warning_logged:
+        _thinking_warning_logged = True
+        logger.warning("Installed google-ai-generativelanguage has no GenerationConfig.thinking_config; "
+                       "thinking budgets are ignored")
+    return None
+
+def _resolve_thinking_budget(context, thinking_budget, latency_target, metrics):
+    """Fix the budget for this request; 'auto' asks the adaptive policy (see src.thinking)."""
+    if thinking_budget == AUTO:
+        thinking_budget = _thinking_policy.choose(context["speed"], context["image_type"], latency_target)
+        logger.debug("Thinking budget %d chosen for %s/%s (latency target %s)",
+                     thinking_budget, context["speed"], context["image_type"], latency_target)
+    context["thinking_budget"] = thinking_budget
+    context["usage"] = None
+    if thinking_budget is not None:
+        metrics.set(thinking_budget=thinking_budget)
+
+async def _await_with_deadline(make_awaitable, deadline, timeout):
+    if deadline is None:
+        return await make_awaitable()
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"Deadline of {timeout:.1f}s exceeded")
+    async with asyncio.timeout(remaining):
+        return await make_awaitable()
+
+async def _timed_call(model, model_name, contents, deadline, timeout, metrics, attempt, hedge):
+    """One model request, recorded as an attempt in metrics and in the model's latency window."""
+    start = time.perf_counter()
+    outcome, error = "success", None
+    if hedge:
+        metrics.add_counter("hedged_requests", 1)
+    try:
+        if deadline is None:
+            return await model.generate_content_async(contents)
+        return await _await_with_deadline(
+            lambda: model.generate_content_async(contents, request_options={"timeout": deadline - time.monotonic()}),
+            deadline, timeout
+        )
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except TimeoutError as e:
+        outcome, error = "timeout", e
+        raise
+    except Exception as e:
+        outcome, error = "error", e
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.record_attempt(attempt, model_name, duration, outcome, error, hedge=hedge)
+        _record_health(model_name, outcome, error)
+        if outcome in ("success", "cancelled"):
+            # A call that lost to its hedge took at least this long; leaving it out
+            # would drag the percentile, and with it the hedge delay, down
+            get_latency_tracker(model_name).record(duration)
+
+def _record_health(model_name, outcome, error):
+    # Only throttling and availability errors say something about the model;
+    # a bad request or our own deadline does not
+    if outcome == "success":
+        get_breaker(model_name).record_success()
+    elif outcome == "error" and is_retryable_error(error):
+        get_breaker(model_name).record_failure()
+
+async def _acquire_model(ladder, context, deadline, timeout, metrics):
+    """Reserve quota on the first available model of the ladder, waiting out its limiter if needed."""
+    model_name, wait = reserve_model(ladder, context["input_tokens"])
+    if wait > 0:
+        if deadline is not None and time.monotonic() + wait >= deadline:
+            raise TimeoutError(f"Deadline of {timeout:.1f}s passes while waiting for {model_name} quota")
+        with metrics.stage("rate_limit"):
+            await asyncio.sleep(wait)
+    if model_name != ladder[0]:
+        logger.info("Falling back from %s to %s", ladder[0], model_name)
+    return model_name
+
+def _retry_wait(backoff, deadline, timeout, attempt, error):
+    """Next backoff delay, or TimeoutError when the deadline would pass while waiting."""
+    wait_time = backoff.next_delay()
+    if deadline is not None and time.monotonic() + wait_time >= deadline:
+        raise TimeoutError(f"Deadline of {timeout:.1f}s leaves no time for retry #{attempt + 1}") from error
+    return wait_time
+
+async def _model_for(context, model_name, metrics, response_schema=EgyptianArtAnalysis):
+    """
+    The model for one attempt and the contents to send it. With a context cache,
+    the prompt prefix is served from the cache and cut from the contents.
+    """
+    contents = context["contents"]
+    cached_content = None
+    prompt = context.get("prompt_prefix")
+    if _context_cache is not None and prompt is not None:
+        cached_content, stale = _context_cache.peek(model_name, prompt.prefix_id)
+        if stale:
+            # Creating or extending the cache is an API call
+            with metrics.stage("context_cache"):
+                cached_content = await asyncio.to_thread(profiling.call_in_scope, _context_cache.get, model_name,
+                                                         prompt.prefix_id, prompt.prefix)
+        if cached_content is not None:
+            remainder = contents[0][len(prompt.prefix):]
+            contents = ([remainder] if remainder else []) + contents[1:]
+    with metrics.stage("model_build"):
+        model = get_model(model_name, thinking_budget=context["thinking_budget"], response_schema=response_schema,
+                          cached_content=cached_content)
+    return model, contents
+
+async def _generate(context, deadline, timeout, metrics, hedge, fallback, response_schema=EgyptianArtAnalysis):
+    """
+    Call the model for context["contents"]: quota, fallback ladder, hedging and
+    retries included. Records the answering model and the usage in context.
+    """
+    requested_model = SPEED_TO_MODEL.get(context["speed"], DEFAULT_MODEL)
+    ladder = fallback_ladder(requested_model, fallback)
+    backoff = DecorrelatedJitterBackoff()
+    attempt = 0
+    
+    while True:
+        attempt += 1
+        model_name = await _acquire_model(ladder, context, deadline, timeout, metrics)
+        try:
+            model, contents = await _model_for(context, model_name, metrics, response_schema)
+            
+            async def call(hedge, attempt=attempt, model=model, model_name=model_name, contents=contents):
+                if hedge and not try_reserve(model_name, context["input_tokens"]):
+                    # The primary keeps running; only the hedge is dropped
+                    raise QuotaExhaustedError(f"No {model_name} quota left for a hedged request")
+                return await _timed_call(model, model_name, contents, deadline, timeout, metrics, attempt, hedge)
+            
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            with metrics.stage("network"):
+                response = await hedged_call(call, hedge_delay(model_name) if hedge else None, remaining)
+            break
+            
+        except TimeoutError as e:
+            # The overall deadline is spent; retrying cannot help
+            raise TimeoutError(str(e) or f"Deadline of {timeout:.1f}s exceeded") from e
+        except Exception as e:
+            if not is_retryable_error(e) or attempt > MAX_RETRIES:
+                raise
+            if get_breaker(model_name).state != 'closed' and model_name != ladder[-1]:
+                # The next attempt goes to a lower tier, which has no reason to wait
+                logger.warning("Gemini API error: %s. %s circuit open, falling back", e, model_name)
+                continue
+            wait_time = _retry_wait(backoff, deadline, timeout, attempt, e)
+            logger.warning("Gemini API error: %s. Retry #%d/%d of %s in %.2fs",
+                           e, attempt + 1, MAX_RETRIES + 1, model_name, wait_time)
+            with metrics.stage("backoff"):
+                await asyncio.sleep(wait_time)
+    
+    context["model_name"] = model_name
+    context["requested_model"] = requested_model
+    context["usage"] = _usage_counts(response)
+    metrics.set(model=model_name)
+    return response
+
+def _finish_analysis(context, response_text, api_call_duration, metrics):
+    """Parse and validate the model response and record it in the cache and index."""
+    with metrics.stage("json_parse"):
+        logger.debug("Raw Gemini response (%d chars): %s", len(response_text), response_text)
+        analysis = _parse_analysis(response_text)
+    metrics.add_counter("response_chars", len(response_text))
+    return _record_analysis(context, analysis, api_call_duration, metrics)
+
+def _record_analysis(context, analysis, api_call_duration, metrics):
+    """Build the success result for a validated analysis and store it in the cache and index."""
+    if context["usage"] is not None:
+        for name, count in context["usage"].items():
+            metrics.add_counter(name, count)
+    logger.info("Analysis succeeded in %.2fs: %d characters, location=%.50s",
+                api_call_duration, len(analysis.characters), analysis.picture_location)
+    
+    result = {
+        "failure_status": "success",
+        "analysis": analysis.model_dump(),
+        "api_call_duration": api_call_duration,
+        "model": context["model_name"]
+    }
+    if context["thinking_budget"] is not None:
+        result["thinking_budget"] = context["thinking_budget"]
+    if context["usage"] is not None:
+        result["usage"] = context["usage"]
+    degraded = context["model_name"] != context["requested_model"]
+    if degraded:
+        result["degraded_from"] = context["requested_model"]
+    elif "pack" not in context and context["thinking_budget"] is not None:
+        # A packed call's latency and budget are shared by all of its images
+        _thinking_policy.record(context["speed"], context["image_type"], context["thinking_budget"],
+                                api_call_duration, quality_score(result["analysis"]))
+    # A fallback answer is returned but not stored, so the tier that was asked
+    # for gets to answer this image once it is available again
+    with metrics.stage("cache_store"):
+        if context["cache_key"] is not None and not degraded:
+            # Token usage belongs to this call, not to the requests the entry answers later
+            context["cache"].set(context["cache_key"], {name: value for name, value in result.items()
+                                                        if name != "usage"})
+        if context["fingerprint"] is not None and not degraded:
+            context["near_duplicate_index"].add(context["fingerprint"], {
+                "analysis": result["analysis"],
+                "speed": context["speed"],
+                "image_type": context["image_type"],
+                "prompt_version": PROMPT_VERSION
+            })
+    result = dict(result, cache_hit=False)
+    if context["preprocessing_stats"] is not None:
+        result["preprocessing"] = context["preprocessing_stats"]
+    if context["near_duplicate"] is not None:
+        result["near_duplicate"] = {"distance": context["near_duplicate"][0], "mode": context["near_duplicate_mode"]}
+    if "pack" in context:
+        result["pack"] = context["pack"]
+    return result
+
+def _reusable_near_duplicate(record, speed, image_type):
+    """
+    Whether a near-duplicate's stored analysis may answer this request: same
+    prompt version and image type, from the requested tier or a higher one
+    (any tier for speed='auto', which would start on the lowest).
+    """
+    if record.get('prompt_version') != PROMPT_VERSION or record.get('image_type') != image_type:
+        return False
+    stored_speed = record.get('speed')
+    if stored_speed == speed or speed == AUTO_SPEED:
+        return True
+    if stored_speed not in CASCADE_SPEEDS or speed not in CASCADE_SPEEDS:
+        return False
+    return CASCADE_SPEEDS.index(stored_speed) >= CASCADE_SPEEDS.index(speed)
+
+def _failure_status(error):
+    if isinstance(error, ImageTooLargeError):
+        return "image_too_large"
+    if isinstance(error, UnsupportedMediaError):
+        return "unsupported_media"
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(error, QuotaExhaustedError):
+        return "rate_limited"
+    return "api_failure"
+
+def _failure_result(error, api_call_duration, context=None):
+    import traceback
+    if (isinstance(error, TimeoutError) and context is not None
+            and context.get("thinking_budget") is not None):
+        # A timed-out request counts against its budget: it was slow and answered nothing
+        _thinking_policy.record(context["speed"], context["image_type"], context["thinking_budget"],
+                                api_call_duration, 0.0)
+    logger.warning("Analysis failed after %.2fs: %s", api_call_duration, error)
+    return {
+        "failure_status": _failure_status(error),
+        "failure_reason": f"Gemini API call failed: {str(error)}",
+        "api_call_duration": api_call_duration,
+        "traceback": traceback.format_exc()
+    }
+
+async def analyze_egyptian_art_with_gemini_async(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                                 use_cache=True, cache=None,
+                                                 near_duplicate_index=None, near_duplicate_threshold=None, near_duplicate_mode=None,
+                                                 preprocess=None, timeout=None, metrics=None, hedge=True, fallback=True,
+                                                 latency_target=None, min_confidence=None):
+    """
+    Analyze Egyptian art image using Gemini with structured output, without blocking the event loop.
+    
+    Takes the same arguments and returns the same result dict as
+    analyze_egyptian_art_with_gemini, plus:
     
     Args:
-        image_data: Base64-encoded image data
-        speed: 'regular' (gemini-2.5-pro), 'fast' (gemini-2.5-flash), 'super-fast' (gemini-2.5-flash-lite)
-        image_type: 'tomb', 'temple', 'other', or 'unknown'
-        thinking_budget: Thinking budget for the model
+        timeout: Overall deadline in seconds for the model calls, retries and backoff
+            included. None means no deadline.
     
-    Returns:
-        Dict containing analysis results or error information
+    Cancelling the task cancels the in-flight model call, unless other
+    requests are waiting for it (see below).
+    
+    Identical requests in flight at the same time share one analysis (see
+    src.singleflight): same image bytes, speed, image type, thinking budget,
+    prompt version and other answer-changing options. The requests that joined
+    get a copy of its result with 'coalesced': True, and a 'coalesced' counter
+    in their metrics. Requests with use_cache=False, and all requests when
+    SINGLE_FLIGHT=0, always run their own analysis.
     """
+    thinking_budget = _applied_thinking_budget(thinking_budget)
+    # The caller that owns the metrics emits them; otherwise this request does
+    emit_metrics = metrics is None
+    if metrics is None:
+        metrics = RequestMetrics(speed=speed)
+    # Sampled calls are profiled, unless they already run inside a profiled request (see src.profiling)
+    session = profiling.begin('analysis')
     try:
-        api_call_duration = 0  # Initialize in case of early errors
+        with profiling.thread_scope():
+            result = await _analyze_coalesced(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                                              near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                                              preprocess, timeout, metrics, hedge, fallback, latency_target,
+                                              min_confidence)
+    finally:
+        profile = session.finish() if session is not None else None
+    metrics.set(status=result["failure_status"], cache_hit=result.get("cache_hit", False))
+    result["metrics"] = metrics.to_dict()
+    if emit_metrics:
+        metrics.emit()
+    if profile is not None:
+        result["profile"] = profile
+    return result
+
+async def _analyze_coalesced(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                             near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                             preprocess, timeout, metrics, hedge, fallback, latency_target, min_confidence):
+    def analyze():
+        if speed == AUTO_SPEED:
+            return _analyze_cascade(image_data, image_type, thinking_budget, use_cache, cache,
+                                    near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                                    preprocess, timeout, metrics, hedge, latency_target, min_confidence)
+        return _analyze_async(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                              near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                              preprocess, timeout, metrics, hedge, fallback, latency_target)
+    
+    if not use_cache or os.environ.get('SINGLE_FLIGHT') == '0':
+        result = await analyze()
+    else:
+        with metrics.stage("base64_decode"):
+            image_data = _decode_image_data(image_data)
+        flight_key = make_cache_key(image_data, speed, image_type, thinking_budget, PROMPT_VERSION, variant=json.dumps(
+            [preprocess, near_duplicate_mode, near_duplicate_threshold, fallback, latency_target, min_confidence,
+             id(cache), id(near_duplicate_index)], sort_keys=True, default=str
+        ))
+        try:
+            result, shared = await get_single_flight().do_async(flight_key, analyze, timeout)
+        except TimeoutError as e:
+            result, shared = _failure_result(e, timeout), False
+        # Every request gets its own copy, as the joined ones share the object
+        result = dict(result)
+        if shared:
+            result["coalesced"] = True
+            metrics.add_counter("coalesced", 1)
+    return result
+
+async def _analyze_async(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                         near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                         preprocess, timeout, metrics, hedge, fallback, latency_target):
+    api_call_start_time = None
+    context = None
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        # Decoding, hashing and resizing are CPU-bound, so keep them off the event loop
+        early_result, context = await asyncio.to_thread(
+            profiling.call_in_scope, _prepare_analysis, image_data, speed, image_type, thinking_budget, use_cache,
+            cache, near_duplicate_index, near_duplicate_threshold, near_duplicate_mode, preprocess, metrics
+        )
+        if early_result is not None:
+            return early_result
+        
         api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
         if not api_key:
             return {
@@ -52,169 +790,802 @@ def analyze_egyptian_art_with_gemini(image_data, speed='fast', image_type='unkno
                 "api_call_duration": 0
             }
 
-        genai.configure(api_key=api_key)
+        _ensure_configured(api_key)
+        _resolve_thinking_budget(context, thinking_budget, latency_target, metrics)
         
-        image_bytes = base64.b64decode(image_data)
-        image = PIL.Image.open(io.BytesIO(image_bytes))
+        logger.debug("Calling %s: image_type=%s, thinking_budget=%s, image=%d bytes, prompt=%d chars, deadline=%s",
+                     SPEED_TO_MODEL.get(speed, DEFAULT_MODEL), image_type, context['thinking_budget'], context['image_size'],
+                     len(context['contents'][0]), f'{timeout:.1f}s' if timeout is not None else 'none')
         
-        prompt_text = create_egyptian_art_prompt(image_type)
-        
-        # Select model based on speed setting
-        speed_to_model = {
-            'regular': 'gemini-2.5-pro',
-            'fast': 'gemini-2.5-flash', 
-            'super-fast': 'gemini-2.5-flash-lite'
+        api_call_start_time = time.time()
+        response = await _generate(context, deadline, timeout, metrics, hedge, fallback)
+        api_call_duration = time.time() - api_call_start_time
+        with metrics.stage("json_parse"):
+            response_text = _extract_response_text(response)
+        return _finish_analysis(context, response_text, api_call_duration, metrics)
+            
+    except Exception as e:
+        api_call_duration = time.time() - api_call_start_time if api_call_start_time is not None else 0
+        return _failure_result(e, api_call_duration, context)
+
+async def _analyze_cascade(image_data, image_type, thinking_budget, use_cache, cache,
+                           near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                           preprocess, timeout, metrics, hedge, latency_target, min_confidence):
+    """
+    speed='auto': analyze on each tier of CASCADE_SPEEDS in turn until an answer
+    is confident enough (see src.cascade), and return the most confident one.
+    """
+    if min_confidence is None:
+        min_confidence = float(os.environ.get('CASCADE_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE))
+    start_time = time.time()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    with metrics.stage("base64_decode"):
+        image_bytes = _decode_image_data(image_data)
+    tiers = []
+    best, best_score, result = None, -1.0, None
+    for speed in CASCADE_SPEEDS:
+        remaining = deadline - time.monotonic() if deadline is not None else None
+        if remaining is not None and remaining <= 0:
+            break
+        tier_start = time.perf_counter()
+        # The cascade itself moves between tiers, so a throttled tier escalates instead of falling back
+        result = await _analyze_async(image_bytes, speed, image_type, thinking_budget, use_cache, cache,
+                                      near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                                      preprocess, remaining, metrics, hedge, False, latency_target)
+        tier = {
+            "speed": speed,
+            "model": result.get("model", SPEED_TO_MODEL[speed]),
+            "failure_status": result["failure_status"],
+            "duration": round(time.perf_counter() - tier_start, 3),
+            "cache_hit": result.get("cache_hit", False)
         }
-        model_name = speed_to_model.get(speed, 'gemini-2.5-flash')
+        tiers.append(tier)
+        if result["failure_status"] == "image_too_large":
+            # Refused before any model call; no tier can do better
+            break
+        if result["failure_status"] != "success":
+            logger.info("Cascade tier %s failed (%s), escalating", speed, result["failure_status"])
+            continue
+        score, reasons = confidence_score(result["analysis"])
+        tier.update(confidence=score, low_confidence=reasons)
+        if score > best_score:
+            best, best_score = result, score
+        if score >= min_confidence:
+            break
+        logger.info("Cascade tier %s answered with confidence %.2f (%s)", speed, score, ", ".join(reasons))
+    
+    result = dict(best if best is not None else result or {
+        "failure_status": "timeout",
+        "failure_reason": f"Gemini API call failed: Deadline of {timeout:.1f}s exceeded"
+    }, api_call_duration=time.time() - start_time)
+    result["cascade"] = {
+        "tiers": tiers,
+        "escalations": max(len(tiers) - 1, 0),
+        "min_confidence": min_confidence,
+        "confident": best_score >= min_confidence
+    }
+    metrics.add_counter("cascade_escalations", result["cascade"]["escalations"])
+    if "model" in result:
+        metrics.set(model=result["model"])
+    return result
+
+async def analyze_egyptian_art_streaming_async(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                               use_cache=True, cache=None,
+                                               near_duplicate_index=None, near_duplicate_threshold=None, near_duplicate_mode=None,
+                                               preprocess=None, timeout=None, metrics=None, fallback=True,
+                                               latency_target=None):
+    """
+    Stream an analysis, yielding each part of the response as soon as the model has written it.
+    
+    Takes the same arguments as analyze_egyptian_art_with_gemini_async, except
+    that streamed calls are never hedged. Yields
+    the events of src.streaming.IncrementalJSONParser - one per top-level field
+    and one per character - and finally {"type": "result", "result": ...} with
+    the same result dict the non-streaming API returns. Streamed values are not
+    validated yet; the final result is. Cache and near-duplicate hits replay the
+    stored analysis as events.
+    
+    The time to the first event is recorded as the 'first_field' mark in the
+    result's metrics. A failed call is only retried while nothing has been
+    yielded yet.
+    
+    Raises:
+        ValueError: for speed='auto', whose cascade needs the whole answer of a
+            tier before it can decide to escalate
+    """
+    if speed == AUTO_SPEED:
+        raise ValueError("speed='auto' cannot be streamed; use analyze_egyptian_art_with_gemini_async")
+    thinking_budget = _applied_thinking_budget(thinking_budget)
+    emit_metrics = metrics is None
+    if metrics is None:
+        metrics = RequestMetrics(speed=speed)
+    async for event in _stream_async(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                                     near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                                     preprocess, timeout, metrics, fallback, latency_target):
+        if event["type"] == "result":
+            result = event["result"]
+            metrics.set(status=result["failure_status"], cache_hit=result.get("cache_hit", False))
+            result["metrics"] = metrics.to_dict()
+            if emit_metrics:
+                metrics.emit()
+        else:
+            metrics.mark("first_field")
+        yield event
+
+async def _stream_async(image_data, speed, image_type, thinking_budget, use_cache, cache,
+                        near_duplicate_index, near_duplicate_threshold, near_duplicate_mode,
+                        preprocess, timeout, metrics, fallback, latency_target):
+    api_call_start_time = None
+    context = None
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        early_result, context = await asyncio.to_thread(
+            profiling.call_in_scope, _prepare_analysis, image_data, speed, image_type, thinking_budget, use_cache,
+            cache, near_duplicate_index, near_duplicate_threshold, near_duplicate_mode, preprocess, metrics
+        )
+        if early_result is not None:
+            for event in analysis_events(early_result["analysis"]):
+                yield event
+            yield {"type": "result", "result": early_result}
+            return
         
-        # Initialize retry configuration before debug logging
-        max_retries = 2
+        api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+        if not api_key:
+            yield {"type": "result", "result": {
+                "failure_status": "api_failure",
+                "failure_reason": "No Google API key found in environment variables",
+                "api_call_duration": 0
+            }}
+            return
+
+        _ensure_configured(api_key)
+        _resolve_thinking_budget(context, thinking_budget, latency_target, metrics)
         
-        print(f"=== GEMINI API CALL DEBUG INFO ===")
-        print(f"Model: {model_name}")
-        print(f"Speed setting: {speed}")
-        print(f"Image type hint: {image_type}")
-        print(f"Thinking budget: {thinking_budget}")
-        print(f"Image data size: {len(image_data)} characters (base64)")
-        print(f"Prompt length: {len(prompt_text)} characters")
-        print(f"Max retries: {max_retries}")
-        print(f"Temperature: 0 (deterministic)")
-        print(f"Response format: JSON with structured schema")
-        print(f"Schema: EgyptianArtAnalysis (characters, picture_location, interesting_detail, date, ancient_text_translation)")
-        print(f"=== END DEBUG INFO ===")
+        requested_model = SPEED_TO_MODEL.get(speed, DEFAULT_MODEL)
+        ladder = fallback_ladder(requested_model, fallback)
+        logger.debug("Streaming from %s: image_type=%s, thinking_budget=%s, image=%d bytes",
+                     requested_model, image_type, context['thinking_budget'], context['image_size'])
         
         api_call_start_time = time.time()
-        retry_count = 0
+        backoff = DecorrelatedJitterBackoff()
+        attempt = 0
         
-        while retry_count <= max_retries:
+        while True:
+            attempt += 1
+            model_name = await _acquire_model(ladder, context, deadline, timeout, metrics)
+            attempt_start = time.perf_counter()
+            parser = IncrementalJSONParser()
+            delivered = False
             try:
-                if retry_count > 0:
-                    # Exponential backoff: wait 1s, then 2s, then 4s, etc.
-                    wait_time = 2 ** (retry_count - 1)
-                    print(f"RETRY: Gemini call retry #{retry_count + 1}/{max_retries + 1} after {wait_time}s wait")
-                    time.sleep(wait_time)
-                else:
-                    print(f"STARTING: Initial Gemini API call to {model_name}")
+                model, contents = await _model_for(context, model_name, metrics)
                 
-                model = genai.GenerativeModel(
-                    model_name=model_name,
-                    generation_config=genai.types.GenerationConfig(
-                        response_schema=EgyptianArtAnalysis,
-                        response_mime_type="application/json",
-                        temperature=0
+                # The deadline is applied to each await rather than around the
+                # loop, so it never fires while the consumer holds an event
+                with metrics.stage("network"):
+                    request_options = {} if deadline is None else {"timeout": max(deadline - time.monotonic(), 0)}
+                    response = await _await_with_deadline(
+                        lambda: model.generate_content_async(contents, stream=True, request_options=request_options),
+                        deadline, timeout
                     )
-                )
-                
-                print(f"MODEL CREATED: {model_name} with JSON schema enforcement")
-                print(f"CALLING: generate_content() with prompt + image...")
-                
-                response = model.generate_content([prompt_text, image])
+                chunks = aiter(response)
+                while True:
+                    try:
+                        with metrics.stage("network"):
+                            chunk = await _await_with_deadline(lambda: anext(chunks), deadline, timeout)
+                    except StopAsyncIteration:
+                        break
+                    # Each chunk reports the usage so far; the last one has the totals
+                    context["usage"] = _usage_counts(chunk) or context["usage"]
+                    with metrics.stage("json_parse"):
+                        events = parser.feed(_chunk_text(chunk))
+                    for event in events:
+                        delivered = True
+                        yield event
                 
-                # If we get here, the call succeeded
-                print(f"SUCCESS: API call completed in {time.time() - api_call_start_time:.2f}s")
-                print(f"RESPONSE TYPE: {type(response)}")
-                print(f"RESPONSE CANDIDATES: {len(response.candidates) if hasattr(response, 'candidates') else 'N/A'}")
+                metrics.record_attempt(attempt, model_name, time.perf_counter() - attempt_start, "success")
+                _record_health(model_name, "success", None)
                 break
-                
+            
+            except TimeoutError as e:
+                metrics.record_attempt(attempt, model_name, time.perf_counter() - attempt_start, "timeout", e)
+                raise TimeoutError(str(e) or f"Deadline of {timeout:.1f}s exceeded") from e
             except Exception as e:
-                error_str = str(e).lower()
-                is_5xx_error = any(code in error_str for code in ['500', '502', '503', '504', '429', 'rate limit', 'quota', 'internal error', 'service unavailable', 'timeout'])
-                
-                if is_5xx_error and retry_count < max_retries:
-                    retry_count += 1
-                    print(f"Gemini API error (5xx): {str(e)}. Retrying... ({retry_count}/{max_retries})")
+                metrics.record_attempt(attempt, model_name, time.perf_counter() - attempt_start, "error", e)
+                _record_health(model_name, "error", e)
+                if delivered or not is_retryable_error(e) or attempt > MAX_RETRIES:
+                    raise
+                if get_breaker(model_name).state != 'closed' and model_name != ladder[-1]:
+                    logger.warning("Gemini API error: %s. %s circuit open, falling back", e, model_name)
                     continue
-                else:
-                    # Either not a 5xx error, or we've exhausted retries
-                    raise e
+                wait_time = _retry_wait(backoff, deadline, timeout, attempt, e)
+                logger.warning("Gemini API error: %s. Retry #%d/%d of %s in %.2fs",
+                               e, attempt + 1, MAX_RETRIES + 1, model_name, wait_time)
+                with metrics.stage("backoff"):
+                    await asyncio.sleep(wait_time)
         
+        context["model_name"] = model_name
+        context["requested_model"] = requested_model
+        metrics.set(model=model_name)
         api_call_duration = time.time() - api_call_start_time
-        
-        # Try different ways to access the response text
+        result = _finish_analysis(context, parser.text, api_call_duration, metrics)
+    except Exception as e:
+        api_call_duration = time.time() - api_call_start_time if api_call_start_time is not None else 0
+        result = _failure_result(e, api_call_duration, context)
+    yield {"type": "result", "result": result}
+
+def _merge_results(part_results, merge, metrics, start_time):
+    """
+    One result from the results of a request's concurrently analyzed parts (tiles, keyframes).
+
+    merge turns the parts' analyses (None for failed parts) into one analysis
+    dict. The request succeeds when one part does: the result names the model
+    most parts were answered by and sums their usage. Otherwise it is the first
+    part's failure.
+    """
+    analyses = [part_result["analysis"] if part_result["failure_status"] == "success" else None
+                for part_result in part_results]
+    if all(analysis is None for analysis in analyses):
+        return dict(part_results[0], api_call_duration=time.time() - start_time)
+    with metrics.stage("merge"):
+        merged = EgyptianArtAnalysis(**merge(analyses))
+    models = [part_result["model"] for part_result in part_results if "model" in part_result]
+    result = {
+        "failure_status": "success",
+        "analysis": merged.model_dump(),
+        "api_call_duration": time.time() - start_time,
+        "cache_hit": all(part_result.get("cache_hit", False) for part_result in part_results),
+        "model": max(set(models), key=models.count) if models else None
+    }
+    usages = [part_result["usage"] for part_result in part_results if "usage" in part_result]
+    if usages:
+        result["usage"] = {name: sum(usage[name] for usage in usages) for name in usages[0]}
+    return result
+
+async def _analyze_tiles(image_bytes, speed, image_type, thinking_budget, tile_edge, overlap, max_tiles,
+                         metrics, options, start_time):
+    """Split the image, analyze every tile concurrently and merge the tile analyses."""
+    from src.tiling import merge_tile_analyses, split_image
+    
+    preprocess_config = resolve_preprocess_config(speed, {'max_edge': tile_edge})
+    with metrics.stage("tiling"):
+        tiles, boxes, size = await asyncio.to_thread(profiling.call_in_scope, split_image, image_bytes,
+                                                     preprocess_config, overlap, max_tiles)
+    logger.info("Tiled %dx%d image into %d tiles of up to %d px", size[0], size[1], len(tiles),
+                preprocess_config['max_edge'])
+
+    # The tiles are already encoded for upload, so they are sent as they are
+    tile_results = await asyncio.gather(*(
+        analyze_egyptian_art_with_gemini_async(tile, speed, image_type, thinking_budget, preprocess=False, **options)
+        for tile in tiles
+    ))
+    result = _merge_results(tile_results, lambda analyses: merge_tile_analyses(analyses, boxes, size),
+                            metrics, start_time)
+    result["tiles"] = [
+        {"box": list(box), "failure_status": tile_result["failure_status"], "model": tile_result.get("model"),
+         "cache_hit": tile_result.get("cache_hit", False)}
+        for box, tile_result in zip(boxes, tile_results)
+    ]
+    result["tiling"] = {
+        "image_size": list(size),
+        "tile_count": len(tiles),
+        "failed_tiles": sum(1 for tile_result in tile_results if tile_result["failure_status"] != "success")
+    }
+    return result
+
+async def analyze_egyptian_art_tiled_async(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                           use_cache=True, cache=None, tile_edge=None, overlap=None, max_tiles=None,
+                                           only_if_large=False, timeout=None, metrics=None, hedge=True, fallback=True,
+                                           latency_target=None):
+    """
+    Analyze a panorama or very large photo as overlapping tiles, concurrently, and merge the results.
+    
+    Takes the same arguments as analyze_egyptian_art_with_gemini_async, plus:
+    
+    Args:
+        tile_edge: Tile size in pixels (default: the speed tier's preprocessing max_edge,
+            so tiles are sent at full resolution)
+        overlap: Overlap between neighbouring tiles as a fraction of tile_edge
+        max_tiles: Upper bound on the number of tiles; larger images get larger,
+            downscaled tiles
+        only_if_large: Analyze images that src.tiling.should_tile rejects in a single call
+    
+    Returns the usual result dict with the merged analysis (see src.tiling),
+    plus 'tiles' (box, status and model per tile) and 'tiling' (image size,
+    tile count, failed tiles). The request succeeds when at least one tile does;
+    'usage' sums the tiles and 'metrics' stages are summed over them too.
+    """
+    # Imported lazily: NumPy is only needed for tiled requests
+    from src.tiling import DEFAULT_MAX_TILES, DEFAULT_TILE_OVERLAP, should_tile
+    
+    emit_metrics = metrics is None
+    if metrics is None:
+        metrics = RequestMetrics(speed=speed)
+    start_time = time.time()
+    options = dict(use_cache=use_cache, cache=cache, timeout=timeout, metrics=metrics, hedge=hedge,
+                   fallback=fallback, latency_target=latency_target)
+    try:
+        with metrics.stage("base64_decode"):
+            image_bytes = _decode_image_data(image_data)
+        if only_if_large and not should_tile(open_image(image_bytes).size):
+            result = await analyze_egyptian_art_with_gemini_async(image_bytes, speed, image_type, thinking_budget,
+                                                                  **options)
+        else:
+            result = await _analyze_tiles(image_bytes, speed, image_type, thinking_budget, tile_edge,
+                                          DEFAULT_TILE_OVERLAP if overlap is None else overlap,
+                                          DEFAULT_MAX_TILES if max_tiles is None else max_tiles,
+                                          metrics, options, start_time)
+    except Exception as e:
+        result = _failure_result(e, time.time() - start_time)
+    metrics.set(status=result["failure_status"], tiles=len(result.get("tiles", [])))
+    result["metrics"] = metrics.to_dict()
+    if emit_metrics:
+        metrics.emit()
+    return result
+
+async def _analyze_keyframes(sources, speed, image_type, thinking_budget, preprocess, selection_options,
+                             metrics, options, start_time):
+    """Pick the keyframes, analyze them concurrently and merge their analyses."""
+    from src.keyframes import extract_keyframes, merge_frame_analyses
+    
+    preprocess_config = resolve_preprocess_config(speed, preprocess if isinstance(preprocess, dict) else None)
+    with metrics.stage("keyframes"):
+        selection = await asyncio.to_thread(profiling.call_in_scope, extract_keyframes, sources, preprocess_config,
+                                            *selection_options)
+    selection_duration = time.time() - start_time
+    indices = [index for index, _ in selection["keyframes"]]
+    logger.info("Picked %d of %d %s frames", len(indices), selection["frame_count"], selection["source"])
+    if options["timeout"] is not None:
+        # Frame selection already used part of the deadline
+        options = dict(options, timeout=max(0.1, options["timeout"] - selection_duration))
+    
+    # Frames of animations and videos are already encoded for upload, so they are sent as they are
+    frame_results = await asyncio.gather(*(
+        analyze_egyptian_art_with_gemini_async(blob, speed, image_type, thinking_budget,
+                                               preprocess=False if selection["encoded"] else preprocess, **options)
+        for _, blob in selection["keyframes"]
+    ))
+    result = _merge_results(frame_results, lambda analyses: merge_frame_analyses(analyses, indices),
+                            metrics, start_time)
+    
+    frames = {frame["index"]: frame for frame in selection["frames"]}
+    for index, frame_result in zip(indices, frame_results):
+        frames[index].update(failure_status=frame_result["failure_status"], model=frame_result.get("model"),
+                             cache_hit=frame_result.get("cache_hit", False))
+    dropped = {status: 0 for status in ("duplicate", "blurry", "surplus")}
+    for frame in selection["frames"]:
+        if frame["status"] in dropped:
+            dropped[frame["status"]] += 1
+    dropped["unsampled"] = selection["frame_count"] - len(selection["frames"])
+    # What analyzing every scored frame would have added, at the keyframes' average per call
+    answered = [frame_result for frame_result in frame_results
+                if frame_result["failure_status"] == "success" and not frame_result.get("cache_hit")]
+    calls_saved = len(selection["frames"]) - len(indices)
+    result["keyframes"] = {
+        "source": selection["source"],
+        "frame_count": selection["frame_count"],
+        "scored_frames": len(selection["frames"]),
+        "analyzed_frames": len(indices),
+        "dropped": dropped,
+        "selection_duration": selection_duration,
+        "model_calls_saved": calls_saved,
+        "estimated_seconds_saved": (calls_saved * sum(frame_result["api_call_duration"] for frame_result in answered)
+                                    / len(answered) if answered else 0.0),
+        "frames": selection["frames"]
+    }
+    answered_usage = [frame_result["usage"]["total_tokens"] for frame_result in answered if "usage" in frame_result]
+    if answered_usage:
+        result["keyframes"]["estimated_tokens_saved"] = calls_saved * sum(answered_usage) // len(answered_usage)
+    return result
+
+async def analyze_egyptian_art_keyframes_async(frames, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                               use_cache=True, cache=None, preprocess=None, keyframes=None,
+                                               max_frames=None, distinct_distance=None, min_sharpness=None,
+                                               timeout=None, metrics=None, hedge=True, fallback=True,
+                                               latency_target=None):
+    """
+    Analyze a photo burst or video clip through its sharpest distinct frames, concurrently, and merge the results.
+    
+    Takes the same arguments as analyze_egyptian_art_with_gemini_async, plus:
+    
+    Args:
+        frames: List of encoded photos (a burst), or one multi-frame image (animated
+            WebP/GIF/PNG, MPO) or video (needs PyAV), as bytes or base64
+        keyframes: Most frames to analyze (default 3)
+        max_frames: Most frames to score; longer inputs are sampled evenly (default 60)
+        distinct_distance: dHash Hamming distance up to which frames count as the
+            same view (default: the near-duplicate threshold, 8)
+        min_sharpness: Fraction of the sharpest frame's Laplacian variance a frame
+            needs to be analyzed (default 0.25)
+    
+    Returns the usual result dict with the merged analysis (see src.keyframes),
+    plus 'keyframes': the source kind, frame counts, the frames dropped by
+    reason ('duplicate', 'blurry', 'surplus', 'unsampled'), the selection time,
+    the model calls saved against analyzing every scored frame and the model
+    seconds (and tokens, when reported) they would have cost at the keyframes'
+    average, and per scored frame its index, sharpness and status. The request
+    succeeds when at least one keyframe does; 'usage' sums the keyframes.
+    """
+    # Imported lazily: NumPy is only needed for keyframe requests
+    from src.keyframes import DEFAULT_DISTINCT_DISTANCE, DEFAULT_KEYFRAMES, DEFAULT_MAX_FRAMES, DEFAULT_MIN_SHARPNESS
+    
+    emit_metrics = metrics is None
+    if metrics is None:
+        metrics = RequestMetrics(speed=speed)
+    start_time = time.time()
+    options = dict(use_cache=use_cache, cache=cache, timeout=timeout, metrics=metrics, hedge=hedge,
+                   fallback=fallback, latency_target=latency_target)
+    selection_options = (
+        DEFAULT_KEYFRAMES if keyframes is None else keyframes,
+        DEFAULT_MAX_FRAMES if max_frames is None else max_frames,
+        DEFAULT_DISTINCT_DISTANCE if distinct_distance is None else distinct_distance,
+        DEFAULT_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+    )
+    try:
+        if not isinstance(frames, (list, tuple)):
+            frames = [frames]
+        with metrics.stage("base64_decode"):
+            sources = [_decode_image_data(frame) for frame in frames]
+        result = await _analyze_keyframes(sources, speed, image_type, thinking_budget, preprocess, selection_options,
+                                          metrics, options, start_time)
+    except Exception as e:
+        result = _failure_result(e, time.time() - start_time)
+    metrics.set(status=result["failure_status"], keyframes=result.get("keyframes", {}).get("analyzed_frames", 0))
+    result["metrics"] = metrics.to_dict()
+    if emit_metrics:
+        metrics.emit()
+    return result
+
+async def _analyze_pack(entries, speed, thinking_budget, deadline, timeout, metrics, hedge, fallback):
+    """
+    One packed call for entries, a list of (image position, prepared context).
+
+    Returns:
+        List of (image position, result), where result is None for images that
+        need a call of their own
+    """
+    prompt_text = create_packed_prompt(len(entries))
+    contents = [prompt_text]
+    input_tokens = len(prompt_text) // CHARS_PER_TOKEN
+    for pack_index, (_, context) in enumerate(entries):
+        label = f"Image {pack_index}:"
+        if context["image_type"] and context["image_type"] != 'unknown':
+            label = f"Image {pack_index} (most likely from a {context['image_type']}):"
+        contents += [label, context["contents"][1]]
+        input_tokens += context["input_tokens"] - len(context["contents"][0]) // CHARS_PER_TOKEN
+    pack_context = {
+        "speed": speed,
+        "contents": contents,
+        "prompt_prefix": get_prompt(),
+        "input_tokens": input_tokens,
+        # The budget is per image, and the call thinks about all of them
+        "thinking_budget": thinking_budget * len(entries) if thinking_budget and thinking_budget > 0 else thinking_budget
+    }
+    
+    api_call_start_time = time.time()
+    try:
+        response = await _generate(pack_context, deadline, timeout, metrics, hedge, fallback, response_schema=PackedAnalyses)
+    except Exception as e:
+        failure = _failure_result(e, time.time() - api_call_start_time)
+        return [(position, dict(failure)) for position, _ in entries]
+    api_call_duration = time.time() - api_call_start_time
+    try:
+        with metrics.stage("json_parse"):
+            response_text = _extract_response_text(response)
+            analyses = _parse_packed_analyses(response_text)
+    except Exception as e:
+        logger.warning("Unreadable answer for a pack of %d images, analyzing them one by one: %s", len(entries), e)
+        return [(position, None) for position, _ in entries]
+    metrics.add_counter("response_chars", len(response_text))
+    usage = pack_context["usage"]
+    if usage is not None:
+        for name, count in usage.items():
+            metrics.add_counter(name, count)
+        _packed_output_tokens.record(usage["output_tokens"], len(analyses))
+    
+    results = []
+    for pack_index, (position, context) in enumerate(entries):
+        analysis = analyses.get(pack_index)
+        if analysis is None:
+            results.append((position, None))
+            continue
+        context.update(model_name=pack_context["model_name"], requested_model=pack_context["requested_model"],
+                       thinking_budget=pack_context["thinking_budget"], usage=None,
+                       pack={"size": len(entries), "index": pack_index, "usage": usage})
+        results.append((position, _record_analysis(context, analysis, api_call_duration, metrics)))
+    return results
+
+async def _analyze_packed(images, speed, thinking_budget, use_cache, cache, preprocess, token_budget, max_pack_size,
+                          timeout, metrics, hedge, fallback, latency_target):
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    
+    async def prepare(image_data, image_type):
         try:
-            # Method 1: Direct text access
-            response_text = response.text
-        except AttributeError:
-            try:
-                # Method 2: Through candidates
-                response_text = response.candidates[0].content.parts[0].text
-            except AttributeError:
-                try:
-                    # Method 3: Check if parts contain text differently
-                    part = response.candidates[0].content.parts[0]
-                    response_text = getattr(part, 'text', str(part))
-                except Exception as e:
-                    raise Exception(f"Cannot access response text. Response structure: {type(response)}")
-        
-        # Debug: Log the raw response for troubleshooting
-        print(f"Raw Gemini response (first 500 chars): {response_text[:500]}")
-        print(f"Raw Gemini response (last 200 chars): {response_text[-200:]}")
-        print(f"Response length: {len(response_text)} characters")
-        
-        # Try to parse JSON with better error handling
+            return await asyncio.to_thread(profiling.call_in_scope, _prepare_analysis, image_data, speed, image_type,
+                                           thinking_budget, use_cache, cache, None, None, None, preprocess, metrics)
+        except Exception as e:
+            return _failure_result(e, 0), None
+    
+    prepared = await asyncio.gather(*(prepare(image_data, image_type) for image_data, image_type in images))
+    results = [early_result for early_result, _ in prepared]
+    pending = [(position, context) for position, (early_result, context) in enumerate(prepared) if early_result is None]
+    if not pending:
+        return results
+    
+    api_key = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        for position, _ in pending:
+            results[position] = {
+                "failure_status": "api_failure",
+                "failure_reason": "No Google API key found in environment variables",
+                "api_call_duration": 0
+            }
+        return results
+    _ensure_configured(api_key)
+    
+    budget_context = {"speed": speed, "image_type": "packed"}
+    _resolve_thinking_budget(budget_context, thinking_budget, latency_target, metrics)
+    resolved_budget = budget_context["thinking_budget"]
+    shared_prompt_tokens = len(create_packed_prompt(max_pack_size)) // CHARS_PER_TOKEN
+    packs = plan_packs(
+        [context["input_tokens"] - len(context["contents"][0]) // CHARS_PER_TOKEN for _, context in pending],
+        token_budget - shared_prompt_tokens, max_pack_size,
+        _packed_output_tokens.value + max(resolved_budget or 0, 0)
+    )
+    logger.info("Packing %d images into %d calls (%s)", len(pending), len(packs), ", ".join(str(len(pack)) for pack in packs))
+    metrics.add_counter("packed_calls", len(packs))
+    pack_results = await asyncio.gather(*(
+        _analyze_pack([pending[index] for index in pack], speed, resolved_budget, deadline, timeout, metrics,
+                      hedge, fallback)
+        for pack in packs
+    ))
+    for pack_result in pack_results:
+        for position, result in pack_result:
+            results[position] = result
+    
+    retry = [position for position, result in enumerate(results) if result is None]
+    if retry:
+        logger.info("Analyzing %d images of failed pack entries one by one", len(retry))
+        metrics.add_counter("pack_fallbacks", len(retry))
+        remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+        single_results = await asyncio.gather(*(
+            analyze_egyptian_art_with_gemini_async(images[position][0], speed, images[position][1], thinking_budget,
+                                                   use_cache=use_cache, cache=cache, preprocess=preprocess,
+                                                   timeout=remaining, hedge=hedge, fallback=fallback,
+                                                   latency_target=latency_target)
+            for position in retry
+        ))
+        for position, result in zip(retry, single_results):
+            results[position] = result
+    return results
+
+async def analyze_egyptian_art_packed_async(images, speed='fast', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                            use_cache=True, cache=None, preprocess=None,
+                                            token_budget=DEFAULT_PACK_TOKEN_BUDGET, max_pack_size=DEFAULT_MAX_PACK_SIZE,
+                                            timeout=None, metrics=None, hedge=True, fallback=True, latency_target=None):
+    """
+    Analyze several images with as few model calls as possible.
+    
+    Images that are not answered from the cache are packed into shared calls
+    (see src.packing), answered as a PackedAnalyses and split back into one
+    result per image. An image whose entry is missing or fails validation - or
+    every image of a pack whose answer cannot be read at all - gets a call of
+    its own through analyze_egyptian_art_with_gemini_async.
+    
+    Args:
+        images: List of (image_data, image_type) pairs
+        token_budget: Upper bound on a call's estimated input plus output tokens
+        max_pack_size: Upper bound on the images per call
+        thinking_budget: Per image; a packed call gets it once for each of its images
+        Others as for analyze_egyptian_art_with_gemini_async. The metrics cover
+        all packed calls; images analyzed on their own record their own.
+    
+    Returns:
+        List of result dicts in the order of images, as returned by
+        analyze_egyptian_art_with_gemini. Packed answers also carry 'pack': the
+        call's 'size', the image's 'index' in it, and the call's 'usage'.
+    
+    Raises:
+        ValueError: for speed='auto', which escalates image by image and cannot share calls
+    """
+    if speed == AUTO_SPEED:
+        raise ValueError("speed='auto' cannot be packed; analyze the images one by one")
+    thinking_budget = _applied_thinking_budget(thinking_budget)
+    emit_metrics = metrics is None
+    if metrics is None:
+        metrics = RequestMetrics(speed=speed)
+    results = await _analyze_packed(images, speed, thinking_budget, use_cache, cache, preprocess, token_budget,
+                                    max_pack_size, timeout, metrics, hedge, fallback, latency_target)
+    failed = [result["failure_status"] for result in results if result["failure_status"] != "success"]
+    metrics.set(status=failed[0] if failed else "success", images=len(images))
+    metrics_dict = metrics.to_dict()
+    for result in results:
+        result.setdefault("metrics", metrics_dict)
+    if emit_metrics:
+        metrics.emit()
+    return results
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_background_loop():
+    """
+    Event loop shared by all synchronous callers.
+
+    A single long-lived loop (rather than asyncio.run per call) keeps the SDK's
+    async transport bound to one loop, and lets threaded callers such as the
+    batch runner share it.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='gemini-analysis-loop', daemon=True).start()
+        return _loop
+
+def analyze_egyptian_art_with_gemini(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                     use_cache=True, cache=None,
+                                     near_duplicate_index=None, near_duplicate_threshold=None, near_duplicate_mode=None,
+                                     preprocess=None, timeout=None, metrics=None, hedge=True, fallback=True,
+                                     latency_target=None, min_confidence=None):
+    """
+    Analyze Egyptian art image using Gemini with structured output.
+    
+    Thin blocking wrapper over analyze_egyptian_art_with_gemini_async.
+    
+    Args:
+        image_data: Decoded image bytes (bytes, bytearray or memoryview), or base64-encoded image data
+        speed: 'regular' (gemini-2.5-pro), 'fast' (gemini-2.5-flash), 'super-fast' (gemini-2.5-flash-lite),
+            or 'auto' to start on flash-lite and escalate only unsure answers (see src.cascade)
+        image_type: 'tomb', 'temple', 'other', or 'unknown'
+        thinking_budget: Thinking tokens the model may spend, clamped to the model's range;
+            0 turns thinking off where the model allows it, -1 lets the model decide,
+            and 'auto' picks a budget from observed latency and quality (see src.thinking)
+        use_cache: Set to False to bypass the result cache for this request
+        cache: Cache to use instead of the process-wide default (see src.cache)
+        near_duplicate_index: Perceptual index to use instead of the default (see src.perceptual_index)
+        near_duplicate_threshold: Max dHash Hamming distance counted as the same picture
+        near_duplicate_mode: 'return' to reuse a matching analysis, 'seed' to pass it to the model as a hint
+        preprocess: Overrides for the per-tier resize/re-encode stage ('max_edge', 'format', 'quality'),
+            or False to send the uploaded image unchanged
+        timeout: Overall deadline in seconds for the model calls, retries and backoff
+            included, or None. Retries that cannot finish in time are not started.
+        metrics: RequestMetrics to record stage timings into. When omitted a new one
+            is created and emitted as an EMF log line (see src.metrics).
+        hedge: Send a second request when the first one is slower than the model's
+            recent p95 and take the first success (see src.retry)
+        fallback: Move down the model ladder (pro -> flash -> flash-lite) when the
+            requested tier is rate limited or its circuit breaker is open (see src.quota)
+        latency_target: Seconds the answer should take; guides thinking_budget='auto'
+        min_confidence: Confidence a speed='auto' answer needs to stop escalating
+            (default: CASCADE_MIN_CONFIDENCE or 0.75)
+    
+    Returns:
+        Dict containing analysis results or error information, including a
+        'metrics' dict with the per-stage timings. Successful results name the
+        model that answered in 'model', and the requested one in 'degraded_from'
+        when a fallback tier answered, the 'thinking_budget' used and, when the
+        API reports it, token 'usage' (input, cached input, output, thinking and total).
+        With speed='auto', 'cascade' lists the tiers tried with their status,
+        duration and confidence, and whether the answer met min_confidence.
+    """
+    # bind() carries a profiling session of the calling thread over to the loop
+    future = asyncio.run_coroutine_threadsafe(
+        profiling.bind(analyze_egyptian_art_with_gemini_async(
+            image_data, speed, image_type, thinking_budget,
+            use_cache=use_cache, cache=cache,
+            near_duplicate_index=near_duplicate_index,
+            near_duplicate_threshold=near_duplicate_threshold,
+            near_duplicate_mode=near_duplicate_mode,
+            preprocess=preprocess, timeout=timeout, metrics=metrics, hedge=hedge, fallback=fallback,
+            latency_target=latency_target, min_confidence=min_confidence
+        )),
+        _get_background_loop()
+    )
+    try:
+        return future.result()
+    except BaseException:
+        # e.g. KeyboardInterrupt in the calling thread: cancel the in-flight call too
+        future.cancel()
+        raise
+
+
+def analyze_egyptian_art_streaming(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                   use_cache=True, cache=None,
+                                   near_duplicate_index=None, near_duplicate_threshold=None, near_duplicate_mode=None,
+                                   preprocess=None, timeout=None, metrics=None, fallback=True,
+                                   latency_target=None):
+    """
+    Blocking generator over analyze_egyptian_art_streaming_async.
+    
+    Takes the same arguments as analyze_egyptian_art_with_gemini and yields the
+    same events as the async version, ending with the 'result' event. Closing
+    the generator early cancels the model call.
+    """
+    events = queue.Queue()
+    finished = object()
+    
+    async def pump():
         try:
-            analysis_data = json.loads(response_text)
-        except json.JSONDecodeError as json_error:
-            print(f"JSON parsing failed: {json_error}")
-            print(f"Error at position {json_error.pos}: '{response_text[max(0, json_error.pos-50):json_error.pos+50]}'")
-            
-            # Try to fix common JSON issues
-            cleaned_text = response_text.strip()
-            
-            # Remove markdown code blocks if present
-            if cleaned_text.startswith('```json'):
-                cleaned_text = cleaned_text[7:]
-            if cleaned_text.endswith('```'):
-                cleaned_text = cleaned_text[:-3]
-            cleaned_text = cleaned_text.strip()
-            
-            # Try parsing the cleaned text
-            try:
-                analysis_data = json.loads(cleaned_text)
-                print("Successfully parsed after cleaning")
-            except json.JSONDecodeError:
-                # Last resort: try to extract just the JSON part
-                import re
-                json_match = re.search(r'\{.*\}', cleaned_text, re.DOTALL)
-                if json_match:
-                    try:
-                        analysis_data = json.loads(json_match.group())
-                        print("Successfully extracted and parsed JSON")
-                    except json.JSONDecodeError:
-                        raise Exception(f"Could not parse Gemini response as JSON. Raw response: {response_text[:1000]}...")
-                else:
-                    raise Exception(f"No JSON found in Gemini response. Raw response: {response_text[:1000]}...")
-        
-        analysis = EgyptianArtAnalysis(**analysis_data)
-        
-        # Final debug summary
-        print(f"=== FINAL RESULT SUMMARY ===")
-        print(f"Status: SUCCESS")
-        print(f"Total duration: {api_call_duration:.2f}s")
-        print(f"Characters found: {len(analysis.characters)}")
-        print(f"Location: {analysis.picture_location[:50]}{'...' if len(analysis.picture_location) > 50 else ''}")
-        print(f"Historical period: {analysis.date}")
-        print(f"Translation length: {len(analysis.ancient_text_translation)} chars")
-        print(f"=== END SUMMARY ===")
-        
-        return {
-            "failure_status": "success",
-            "analysis": analysis.model_dump(),
-            "api_call_duration": api_call_duration,
-            "raw_response": analysis_data
-        }
-            
-    except Exception as e:
-        import traceback
-        api_call_duration = time.time() - api_call_start_time if 'api_call_start_time' in locals() else 0
-        print(f"=== ERROR SUMMARY ===")
-        print(f"Status: FAILED")
-        print(f"Duration before failure: {api_call_duration:.2f}s")
-        print(f"Error: {str(e)}")
-        print(f"=== END ERROR SUMMARY ===")
-        return {
-            "failure_status": "api_failure",
-            "failure_reason": f"Gemini API call failed: {str(e)}",
-            "api_call_duration": api_call_duration,
-            "traceback": traceback.format_exc()
-        } 
\ No newline at end of file
+            async for event in analyze_egyptian_art_streaming_async(
+                image_data, speed, image_type, thinking_budget,
+                use_cache=use_cache, cache=cache,
+                near_duplicate_index=near_duplicate_index,
+                near_duplicate_threshold=near_duplicate_threshold,
+                near_duplicate_mode=near_duplicate_mode,
+                preprocess=preprocess, timeout=timeout, metrics=metrics, fallback=fallback,
+                latency_target=latency_target
+            ):
+                events.put(event)
+        finally:
+            events.put(finished)
+    
+    future = asyncio.run_coroutine_threadsafe(profiling.bind(pump()), _get_background_loop())
+    try:
+        while True:
+            event = events.get()
+            if event is finished:
+                break
+            yield event
+        future.result()
+    finally:
+        future.cancel()
+
+
+def analyze_egyptian_art_tiled(image_data, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                               use_cache=True, cache=None, tile_edge=None, overlap=None, max_tiles=None,
+                               only_if_large=False, timeout=None, metrics=None, hedge=True, fallback=True,
+                               latency_target=None):
+    """Blocking wrapper over analyze_egyptian_art_tiled_async; takes and returns the same."""
+    future = asyncio.run_coroutine_threadsafe(
+        profiling.bind(analyze_egyptian_art_tiled_async(
+            image_data, speed, image_type, thinking_budget,
+            use_cache=use_cache, cache=cache, tile_edge=tile_edge, overlap=overlap, max_tiles=max_tiles,
+            only_if_large=only_if_large, timeout=timeout, metrics=metrics, hedge=hedge, fallback=fallback,
+            latency_target=latency_target
+        )),
+        _get_background_loop()
+    )
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+def analyze_egyptian_art_keyframes(frames, speed='fast', image_type='unknown', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                   use_cache=True, cache=None, preprocess=None, keyframes=None, max_frames=None,
+                                   distinct_distance=None, min_sharpness=None, timeout=None, metrics=None, hedge=True,
+                                   fallback=True, latency_target=None):
+    """Blocking wrapper over analyze_egyptian_art_keyframes_async; takes and returns the same."""
+    future = asyncio.run_coroutine_threadsafe(
+        profiling.bind(analyze_egyptian_art_keyframes_async(
+            frames, speed, image_type, thinking_budget,
+            use_cache=use_cache, cache=cache, preprocess=preprocess, keyframes=keyframes, max_frames=max_frames,
+            distinct_distance=distinct_distance, min_sharpness=min_sharpness, timeout=timeout, metrics=metrics,
+            hedge=hedge, fallback=fallback, latency_target=latency_target
+        )),
+        _get_background_loop()
+    )
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+def analyze_egyptian_art_packed(images, speed='fast', thinking_budget=DEFAULT_THINKING_BUDGET,
+                                use_cache=True, cache=None, preprocess=None,
+                                token_budget=DEFAULT_PACK_TOKEN_BUDGET, max_pack_size=DEFAULT_MAX_PACK_SIZE,
+                                timeout=None, metrics=None, hedge=True, fallback=True, latency_target=None):
+    """Blocking wrapper over analyze_egyptian_art_packed_async; takes and returns the same."""
+    future = asyncio.run_coroutine_threadsafe(
+        profiling.bind(analyze_egyptian_art_packed_async(
+            images, speed, thinking_budget, use_cache=use_cache, cache=cache, preprocess=preprocess,
+            token_budget=token_budget, max_pack_size=max_pack_size, timeout=timeout, metrics=metrics,
+            hedge=hedge, fallback=fallback, latency_target=latency_target
+        )),
+        _get_background_loop()
+    )
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
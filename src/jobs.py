@@ -0,0 +1,281 @@
+"""
+Job queue and result store for analyses that outlive an HTTP request.
+
+API Gateway ends an integration after ~29 s, while a gemini-2.5-pro analysis
+with retries can take longer. In job mode the handler stores the request,
+hands the job to a worker and answers 202 with the job id; the worker runs
+the analysis and stores the response, which clients fetch from
+GET /jobs/{id} (or receive on their callback URL).
+
+The job id is derived from the image bytes and every parameter that changes
+the answer (make_job_id), so submitting the same image again while its job is
+queued, running or finished returns that job instead of starting another.
+
+JobStore is the interface the handler uses; SQLiteJobStore keeps jobs in a
+SQLite file and the images next to it on the filesystem. On Lambda the API
+invocation and the worker invocation may run in different execution
+environments, so the store has to be shared: point JOB_STORE_PATH at an EFS
+mount, or install another JobStore (e.g. DynamoDB and S3) with set_job_store.
+"""
+
+import abc
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.metrics import get_logger
+
+logger = get_logger('jobs')
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+DEFAULT_JOB_TTL_SECONDS = 24 * 3600
+# A queued or running job not finished within this long is handed out again
+# (Lambda's longest invocation is 15 minutes)
+DEFAULT_LEASE_SECONDS = 900
+LAMBDA_JOB_STORE_PATH = '/tmp/egyptian-art-jobs'
+# Lambda's instance-local scratch space
+LOCAL_TMP_PATH = '/tmp'
+# How long a writer waits for another environment's lock on a shared store
+SHARED_BUSY_TIMEOUT_SECONDS = 30
+
+
+def make_job_id(image_bytes, request_key):
+    """
+    Job id for an image and the request parameters that change its answer.
+
+    Args:
+        image_bytes: The decoded image
+        request_key: A stable string of the answer-changing parameters
+    """
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    return hashlib.sha256(f"{image_digest}|{request_key}".encode('utf-8')).hexdigest()[:32]
+
+
+class JobStore(abc.ABC):
+    """
+    Interface of a job store. Job records are dicts with id, status,
+    status_code, result (the API response body once finished), request,
+    callbacks, created_at and updated_at.
+    """
+
+    # Whether other execution environments see the same jobs: a worker invoked
+    # asynchronously on Lambda can only run jobs from a shared store
+    shared = True
+
+    @abc.abstractmethod
+    def submit(self, job_id, request, image_bytes, callback_url=None, restart=False):
+        """
+        Queue a job unless an equivalent one exists.
+
+        An existing job is reused while it is queued or running within its
+        lease, or has succeeded and restart is False; a failed or abandoned
+        one is queued again. callback_url is added to the job's callbacks.
+
+        Returns:
+            (job record, whether the job was (re)queued and needs a worker)
+        """
+
+    @abc.abstractmethod
+    def claim(self, job_id):
+        """
+        Mark a queued job running and return (request, image bytes), or None
+        when the job is unknown, finished or already running within its lease.
+        """
+
+    @abc.abstractmethod
+    def complete(self, job_id, status, status_code, result):
+        """Store a finished job's status and response body and return its record (None if unknown)."""
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        """The job record, or None for an unknown or expired job."""
+
+
+class SQLiteJobStore(JobStore):
+    """
+    JobStore in a SQLite file, with the queued images as files in the same directory.
+
+    A directory under /tmp is local to one execution environment and uses
+    WAL; anything else (an EFS mount) is taken to be shared and uses the
+    rollback journal, which works across hosts over NFS.
+    """
+
+    def __init__(self, directory, ttl_seconds=DEFAULT_JOB_TTL_SECONDS, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 clock=time.time):
+        self.directory = directory
+        real_directory = os.path.realpath(directory)
+        self.shared = not (real_directory == LOCAL_TMP_PATH or real_directory.startswith(LOCAL_TMP_PATH + os.sep))
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Several processes may share the file (EFS), so writes take the database lock up front
+        self._conn = sqlite3.connect(os.path.join(directory, 'jobs.sqlite3'), check_same_thread=False,
+                                     isolation_level=None,
+                                     timeout=SHARED_BUSY_TIMEOUT_SECONDS if self.shared else 10)
+        # WAL keeps its index in shared memory, which processes on different hosts (EFS is
+        # NFS) do not share; a shared store uses the rollback journal and file locks instead
+        self._conn.execute("PRAGMA journal_mode=DELETE" if self.shared else "PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, status_code INTEGER, result TEXT, "
+            "request TEXT NOT NULL, callbacks TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, claimed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at)")
+
+    def _image_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.image")
+
+    def _remove_image(self, job_id):
+        try:
+            os.remove(self._image_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _row(self, job_id):
+        return self._conn.execute(
+            "SELECT id, status, status_code, result, request, callbacks, created_at, updated_at, claimed_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+
+    @staticmethod
+    def _record(row):
+        return {
+            "id": row[0],
+            "status": row[1],
+            "status_code": row[2],
+            "result": json.loads(row[3]) if row[3] is not None else None,
+            "request": json.loads(row[4]),
+            "callbacks": json.loads(row[5]),
+            "created_at": row[6],
+            "updated_at": row[7]
+        }
+
+    def _leased(self, row, now):
+        """Whether a queued or running job is still owned by its dispatch or worker."""
+        started = row[8] if row[8] is not None else row[7]
+        return now - started < self.lease_seconds
+
+    def _purge(self, now):
+        expired = [job_id for (job_id,) in self._conn.execute(
+            "SELECT id FROM jobs WHERE updated_at < ? AND status IN (?, ?)",
+            (now - self.ttl_seconds, JOB_SUCCEEDED, JOB_FAILED)
+        ).fetchall()]
+        for job_id in expired:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._remove_image(job_id)
+
+    def submit(self, job_id, request, image_bytes, callback_url=None, restart=False):
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge(now)
+                row = self._row(job_id)
+                if row is not None:
+                    callbacks = json.loads(row[5])
+                    if callback_url and callback_url not in callbacks:
+                        callbacks.append(callback_url)
+                        self._conn.execute("UPDATE jobs SET callbacks = ? WHERE id = ?", (json.dumps(callbacks), job_id))
+                    in_flight = row[1] in (JOB_QUEUED, JOB_RUNNING) and self._leased(row, now)
+                    if in_flight or (row[1] == JOB_SUCCEEDED and not restart):
+                        self._conn.execute("COMMIT")
+                        return self._record(self._row(job_id)), False
+                    created_at = row[6]
+                else:
+                    callbacks = [callback_url] if callback_url else []
+                    created_at = now
+                # Written before the row commits, so a worker that sees the job finds its image
+                temp_path = f"{self._image_path(job_id)}.{os.getpid()}.{threading.get_ident()}"
+                with open(temp_path, 'wb') as f:
+                    f.write(image_bytes)
+                os.replace(temp_path, self._image_path(job_id))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (id, status, status_code, result, request, callbacks, attempts, "
+                    "created_at, updated_at, claimed_at) VALUES (?, ?, NULL, NULL, ?, ?, 0, ?, ?, NULL)",
+                    (job_id, JOB_QUEUED, json.dumps(request), json.dumps(callbacks), created_at, now)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._record(self._row(job_id)), True
+
+    def claim(self, job_id):
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._row(job_id)
+                if row is None or row[1] not in (JOB_QUEUED, JOB_RUNNING) or (row[1] == JOB_RUNNING and self._leased(row, now)):
+                    self._conn.execute("COMMIT")
+                    return None
+                try:
+                    with open(self._image_path(job_id), 'rb') as f:
+                        image_bytes = f.read()
+                except FileNotFoundError:
+                    logger.warning("Job %s has no stored image", job_id)
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, claimed_at = ?, updated_at = ? WHERE id = ?",
+                    (JOB_RUNNING, now, now, job_id)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return json.loads(row[4]), image_bytes
+
+    def complete(self, job_id, status, status_code, result):
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, status_code = ?, result = ?, updated_at = ?, claimed_at = NULL WHERE id = ?",
+                (status, status_code, json.dumps(result), now, job_id)
+            )
+            self._remove_image(job_id)
+            row = self._row(job_id)
+        return self._record(row) if row is not None else None
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._row(job_id)
+        if row is None or (row[1] in (JOB_SUCCEEDED, JOB_FAILED) and row[7] < self.clock() - self.ttl_seconds):
+            return None
+        return self._record(row)
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """
+    The process-wide job store: set_job_store's, or a SQLiteJobStore at
+    JOB_STORE_PATH (default /tmp/egyptian-art-jobs) with JOB_TTL_SECONDS.
+    """
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = SQLiteJobStore(
+                os.environ.get('JOB_STORE_PATH', LAMBDA_JOB_STORE_PATH),
+                ttl_seconds=float(os.environ.get('JOB_TTL_SECONDS', DEFAULT_JOB_TTL_SECONDS))
+            )
+        return _job_store
+
+
+def set_job_store(store):
+    """Replace the process-wide job store (None: build the default again on next use)."""
+    global _job_store
+    with _job_store_lock:
+        _job_store = store
@@ -0,0 +1,86 @@
+"""
+JSON helpers for the response path: tolerant extraction of the model's JSON
+object, and compact (optionally compressed) encoding of API responses.
+
+Standard library only, so lambda_function can import it without delaying
+cheap requests. orjson is used for encoding when it is installed, and Brotli
+when the brotli package is.
+"""
+
+import gzip
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# One token per match: a complete string (skipped whole, so braces inside it
+# don't count), a bracket, or a comma directly before a closing bracket
+_JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]|,(?=\s*[}\]])')
+
+
+def extract_json_object(text):
+    """
+    The first complete JSON object in text, in one pass.
+
+    Tolerates what models wrap around or leave in their JSON: markdown code
+    fences, prose before or after the object, and trailing commas (which are
+    dropped).
+
+    Raises:
+        ValueError: when text holds no complete object (e.g. it was cut off)
+    """
+    start = text.find('{')
+    if start < 0:
+        raise ValueError("No JSON object found in response")
+    depth = 0
+    pieces = []
+    piece_start = start
+    for match in _JSON_TOKEN.finditer(text, start):
+        token = match.group()
+        if token in '{[':
+            depth += 1
+        elif token in '}]':
+            depth -= 1
+            if depth == 0:
+                pieces.append(text[piece_start:match.end()])
+                return ''.join(pieces)
+        elif token == ',':
+            pieces.append(text[piece_start:match.start()])
+            piece_start = match.end()
+    raise ValueError("Response JSON object is incomplete")
+
+
+def dumps(data):
+    """Compact JSON bytes (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def accepted_encoding(accept_encoding):
+    """'br', 'gzip' or None: the best encoding allowed by an Accept-Encoding header that we can produce."""
+    accepted = set()
+    for item in (accept_encoding or '').lower().split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=5)
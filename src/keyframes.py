@@ -0,0 +1,259 @@
+"""
+Keyframe selection for photo bursts and short video clips.
+
+A burst of ten photos, or a few seconds of video, of the same wall gives
+near-identical answers for ten times the cost. Instead every frame is scored
+on a small grayscale copy:
+
+- sharpness is the variance of its Laplacian (vectorized with NumPy): motion
+  blur and missed focus flatten the edges and lower it
+- its dHash fingerprint (src.perceptual_index) tells near-identical frames apart
+  from frames that show something new
+
+Frames are then taken sharpest first; a frame within the near-duplicate
+distance of one already taken is a 'duplicate', one much blurrier than the
+sharpest frame is 'blurry', and distinct frames beyond the requested count are
+'surplus'. Only the kept keyframes are analyzed, and their analyses merged.
+
+Inputs are a burst (several encoded photos), one multi-frame image (animated
+WebP/GIF/PNG, MPO, multi-page TIFF) or a video (MP4, MOV, WebM, MKV, AVI;
+needs PyAV, pip install av). Long inputs are sampled evenly down to
+max_frames frames. Burst photos are sent as uploaded; frames of animations and
+videos are encoded for upload like tiles are.
+"""
+
+import io
+import math
+
+import numpy as np
+import PIL.Image
+
+from src.perceptual_index import DEFAULT_THRESHOLD, dhash, hamming_distance
+from src.preprocessing import UnsupportedMediaError, draft_image, open_image, preprocess_image
+from src.thinking import informative
+from src.tiling import dedupe_characters, merge_analyses
+
+DEFAULT_KEYFRAMES = 3
+DEFAULT_MAX_FRAMES = 60
+# dHash Hamming distance up to which two frames count as the same view
+DEFAULT_DISTINCT_DISTANCE = DEFAULT_THRESHOLD
+# Frames below this fraction of the sharpest frame's score are not analyzed
+DEFAULT_MIN_SHARPNESS = 0.25
+# Longest edge of the grayscale copy frames are scored on
+SCORE_EDGE = 512
+
+# ISO base media files ('ftyp' box) that are still images, not video
+IMAGE_BRANDS = (b'heic', b'heix', b'heim', b'heis', b'mif1', b'msf1', b'avif', b'avis')
+
+
+def is_video(data):
+    """True for MP4/MOV, Matroska/WebM and AVI containers, by their signature."""
+    head = bytes(data[:12])
+    if head[4:8] == b'ftyp':
+        return head[8:12] not in IMAGE_BRANDS
+    return head[:4] == b'\x1a\x45\xdf\xa3' or (head[:4] == b'RIFF' and head[8:12] == b'AVI ')
+
+
+def laplacian_variance(pixels):
+    """Variance of the 4-neighbour Laplacian of a 2-D grayscale array: higher is sharper."""
+    if min(pixels.shape) < 3:
+        return 0.0
+    laplacian = (pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+                 - 4 * pixels[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def frame_signature(image, score_edge=SCORE_EDGE):
+    """(sharpness, dHash) of a frame, measured on a grayscale copy at most score_edge pixels long."""
+    gray = image.convert('L')
+    if max(gray.size) > score_edge:
+        gray.thumbnail((score_edge, score_edge), PIL.Image.Resampling.BILINEAR)
+    return laplacian_variance(np.asarray(gray, dtype=np.float32)), dhash(gray)
+
+
+def _sample_step(frame_count, max_frames):
+    return max(1, math.ceil(frame_count / max_frames)) if frame_count else 1
+
+
+def _count_video_packets(av, data):
+    with av.open(io.BytesIO(bytes(data))) as container:
+        return sum(1 for packet in container.demux(video=0) if packet.size)
+
+
+def _video_frames(data, max_frames, wanted=None):
+    try:
+        import av
+    except ImportError:
+        raise UnsupportedMediaError("Video input needs PyAV (pip install av); "
+                                    "send the frames as a burst of photos or an animated WebP instead")
+    with av.open(io.BytesIO(bytes(data))) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        frame_count = stream.frames
+        if not frame_count and container.duration and stream.average_rate:
+            frame_count = int(container.duration / av.time_base * stream.average_rate)
+        if not frame_count:
+            # No length in the headers: count the packets (demuxing, no decoding), so the
+            # stride covers the whole clip rather than stopping after its first max_frames
+            frame_count = _count_video_packets(av, data)
+        step = _sample_step(frame_count, max_frames)
+        sampled = 0
+        for index, frame in enumerate(container.decode(stream)):
+            if index % step:
+                continue
+            if wanted is None or index in wanted:
+                yield index, frame.to_image()
+            sampled += 1
+            if sampled >= max_frames or (wanted is not None and index >= max(wanted)):
+                break
+
+
+def iter_frames(sources, max_frames=DEFAULT_MAX_FRAMES, wanted=None):
+    """
+    Decode the frames of a burst, multi-frame image or video, evenly sampled down to max_frames.
+
+    Args:
+        sources: List of encoded images (a burst), or a list with one multi-frame image or video
+        max_frames: Most frames to yield
+        wanted: Only yield these frame indices (as yielded by an earlier pass)
+
+    Yields:
+        (frame index, PIL image); images of a burst are opened but not decoded yet
+    """
+    if len(sources) > 1:
+        step = _sample_step(len(sources), max_frames)
+        for index in range(0, len(sources), step):
+            if wanted is None or index in wanted:
+                yield index, open_image(sources[index])
+        return
+    if is_video(sources[0]):
+        yield from _video_frames(sources[0], max_frames, wanted)
+        return
+    container = open_image(sources[0])
+    step = _sample_step(getattr(container, 'n_frames', 1), max_frames)
+    for index in range(0, getattr(container, 'n_frames', 1), step):
+        if wanted is None or index in wanted:
+            container.seek(index)
+            # A copy, so downscaling the frame leaves the container intact for the next seek
+            yield index, container.copy()
+
+
+def select_keyframes(signatures, keyframes=DEFAULT_KEYFRAMES, distinct_distance=DEFAULT_DISTINCT_DISTANCE,
+                     min_sharpness=DEFAULT_MIN_SHARPNESS):
+    """
+    Pick the sharpest distinct frames.
+
+    Args:
+        signatures: (sharpness, dHash) per frame
+        keyframes: Most frames to keep
+        distinct_distance: Frames within this dHash Hamming distance of a kept frame are duplicates
+        min_sharpness: Fraction of the sharpest frame's score a frame needs to be kept
+
+    Returns:
+        Per frame, 'keyframe', 'duplicate', 'blurry' or 'surplus'
+    """
+    statuses = [None] * len(signatures)
+    if not signatures:
+        return statuses
+    best = max(sharpness for sharpness, _ in signatures)
+    kept = []
+    # Sharpest first; sorted() is stable, so the earlier frame wins a tie
+    for index in sorted(range(len(signatures)), key=lambda index: -signatures[index][0]):
+        sharpness, fingerprint = signatures[index]
+        if any(hamming_distance(fingerprint, signatures[other][1]) <= distinct_distance for other in kept):
+            statuses[index] = 'duplicate'
+        elif kept and sharpness < min_sharpness * best:
+            statuses[index] = 'blurry'
+        elif len(kept) >= keyframes:
+            statuses[index] = 'surplus'
+        else:
+            kept.append(index)
+            statuses[index] = 'keyframe'
+    return statuses
+
+
+def extract_keyframes(sources, preprocess_config, keyframes=DEFAULT_KEYFRAMES, max_frames=DEFAULT_MAX_FRAMES,
+                      distinct_distance=DEFAULT_DISTINCT_DISTANCE, min_sharpness=DEFAULT_MIN_SHARPNESS):
+    """
+    Score the frames of a burst, multi-frame image or video and return the keyframes to analyze.
+
+    Args:
+        sources: List of encoded images (a burst), or a list with one multi-frame image or video
+        preprocess_config: 'max_edge', 'format' and 'quality' for frames that have to be
+            encoded (see src.preprocessing.resolve_preprocess_config)
+        keyframes, distinct_distance, min_sharpness: See select_keyframes
+        max_frames: Most frames to score; longer inputs are sampled evenly
+
+    Returns:
+        Dict with 'source' ('burst', 'animation' or 'video'), 'frame_count' (frames
+        in the input, or decoded from a video), 'frames' (index, sharpness and
+        status per scored frame) and 'keyframes' (list of (frame index, encoded
+        image)); 'encoded' says whether the keyframes are already encoded for upload
+
+    Raises:
+        UnsupportedMediaError: for video input without PyAV, or an input without frames
+    """
+    if keyframes < 1:
+        raise ValueError(f"keyframes must be at least 1, got {keyframes}")
+    if not sources:
+        raise UnsupportedMediaError("No frames provided")
+    if len(sources) > 1:
+        source, frame_count = 'burst', len(sources)
+    elif is_video(sources[0]):
+        source, frame_count = 'video', None
+    else:
+        source, frame_count = 'animation', getattr(open_image(sources[0]), 'n_frames', 1)
+
+    indices, signatures = [], []
+    for index, image in iter_frames(sources, max_frames):
+        if source == 'burst':
+            draft_image(image, SCORE_EDGE)
+        indices.append(index)
+        signatures.append(frame_signature(image))
+    if not indices:
+        raise UnsupportedMediaError("The upload contains no decodable frames")
+    statuses = select_keyframes(signatures, keyframes, distinct_distance, min_sharpness)
+    wanted = {index for index, status in zip(indices, statuses) if status == 'keyframe'}
+
+    if source == 'burst':
+        # Burst photos are full uploads already: the analysis preprocesses them as usual
+        selected = [(index, sources[index]) for index in sorted(wanted)]
+    else:
+        selected = [(index, preprocess_image(image, 0, **preprocess_config)[0]['data'])
+                    for index, image in iter_frames(sources, max_frames, wanted)]
+    return {
+        'source': source,
+        # A video's frame count is what was decoded up to the last sampled frame
+        'frame_count': frame_count if frame_count is not None else indices[-1] + 1,
+        'frames': [{'index': index, 'sharpness': round(sharpness, 2), 'status': status}
+                   for index, (sharpness, _), status in zip(indices, signatures, statuses)],
+        'keyframes': selected,
+        'encoded': source != 'burst'
+    }
+
+
+def merge_frame_analyses(analyses, indices):
+    """
+    Merge the analysis dicts of several keyframes into one analysis.
+
+    Characters with the same name are kept once (the longest description wins)
+    and their location names the frame; the other fields are merged in frame
+    order as for tiles (see src.tiling.merge_analyses).
+
+    Args:
+        analyses: Analysis dict per keyframe, or None for keyframes that failed
+        indices: The keyframes' frame indices
+
+    Returns:
+        Dict with the EgyptianArtAnalysis fields
+    """
+    ordered = sorted(zip(analyses, indices), key=lambda pair: pair[1])
+    placed = [
+        {'name': character.get('character_name', '').strip().lower(),
+         'character': dict(character, location=f"{character.get('location', '')} (frame {index})")}
+        for analysis, index in ordered if analysis is not None
+        for character in analysis.get('characters', [])
+    ]
+    characters = dedupe_characters(
+        placed, lambda kept, candidate: informative(candidate['name']) and kept['name'] == candidate['name'])
+    return merge_analyses([analysis for analysis, _ in ordered], [item['character'] for item in characters])
@@ -1,204 +1,796 @@
 import json
 import base64
+import binascii
 import os
+import re
+import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+
+from src import profiling
+from src.json_codec import accepted_encoding, compress, dumps
+from src.metrics import RequestMetrics, get_logger
+from src.thinking import DEFAULT_THINKING_BUDGET, parse_thinking_budget
+
+# Only the standard library (and the stdlib-only src.json_codec, src.metrics,
+# src.profiling and src.thinking; src.jobs and src.prompts for job requests) is imported at module level: CORS preflights and 4xx validation errors are answered
+# without loading google.generativeai, PIL, NumPy or pydantic. The analysis stack
+# is loaded by _load_analyzer().
+
+logger = get_logger('lambda')
+
+_analyzer = None
+_prime_thread = None
+
+
+def prime_analysis_path() -> None:
+    """Import the analysis stack and prebuild the SDK client and models."""
+    from src.gemini_strategy import prewarm_models
+    prewarm_models()
+
+
+def _prime_in_background() -> None:
+    try:
+        prime_analysis_path()
+    except Exception as e:
+        # The request path imports again and reports the real error
+        logger.warning("Init-phase priming failed: %s", e)
+
+
+def _load_analyzer():
+    """Return analyze_egyptian_art_with_gemini, waiting for init-phase priming if it is still running."""
+    global _analyzer
+    if _analyzer is None:
+        if _prime_thread is not None:
+            _prime_thread.join()
+        from src.gemini_strategy import analyze_egyptian_art_with_gemini
+        _analyzer = analyze_egyptian_art_with_gemini
+    return _analyzer
+
+
+# PRIME_ON_INIT controls the init phase: 'background' (default) primes the
+# analysis path in a thread so cheap requests are not held up by it, 'sync'
+# primes before the first request (best with provisioned concurrency), and
+# 'off' defers everything to the first analysis request.
+_prime_mode = os.environ.get('PRIME_ON_INIT', 'background')
+if _prime_mode == 'sync':
+    prime_analysis_path()
+elif _prime_mode == 'background':
+    _prime_thread = threading.Thread(target=_prime_in_background, name='analysis-prime', daemon=True)
+    _prime_thread.start()
+
+BINARY_CONTENT_TYPES = ('application/octet-stream', 'image/')
+# Seconds kept back from the invocation's remaining time to build and return the response
+DEADLINE_MARGIN_SECONDS = float(os.environ.get('DEADLINE_MARGIN_SECONDS', '1.0'))
+EVENT_STREAM_TYPE = 'text/event-stream'
+# Bodies at least this large are compressed when the client accepts gzip or br (0 disables)
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+# Budget for requests without thinkingBudget: an integer, or 'auto' for the adaptive policy
+THINKING_BUDGET = parse_thinking_budget(os.environ.get('THINKING_BUDGET', str(DEFAULT_THINKING_BUDGET)))
+
+# Analysis failure_status -> HTTP status (anything else is a 500)
+FAILURE_STATUS_CODES = {
+    'timeout': 504,
+    'rate_limited': 429,
+    'image_too_large': 413,
+    'unsupported_media': 415
+}
+
+# Analysis field -> API response field
+RESPONSE_FIELDS = {
+    'picture_location': 'location',
+    'date': 'date',
+    'characters': 'characters',
+    'ancient_text_translation': 'translation',
+    'interesting_detail': 'interesting_detail'
+}
+# Result keys passed through to a successful response, when the result has them
+OPTIONAL_RESPONSE_FIELDS = ('model', 'thinking_budget', 'usage', 'tiling', 'cascade', 'keyframes')
+# Job mode: GET /jobs/{id} (id as produced by src.jobs.make_job_id)
+JOB_PATH_PATTERN = re.compile(r'/jobs/([0-9a-f]{32})/?$')
+# How a queued job reaches its worker: 'lambda' (asynchronous self-invocation,
+# the default on Lambda) or 'thread' (a thread in this process, the default elsewhere)
+JOB_DISPATCH = os.environ.get('JOB_DISPATCH', 'lambda' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'thread')
+CALLBACK_TIMEOUT_SECONDS = 10
+# Comma-separated hosts job callbacks may go to ('.example.com' also allows its subdomains); empty allows any public host
+JOB_CALLBACK_HOSTS = [host.strip().lower() for host in os.environ.get('JOB_CALLBACK_HOSTS', '').split(',') if host.strip()]
+BASE64_CHUNK_CHARS = 1 << 20  # multiple of 4, so chunk boundaries never split a quantum
+
+
+def _b64decode_strict(image_data: str) -> bytes:
+    """Decode base64, ignoring whitespace but rejecting any other non-alphabet character."""
+    try:
+        return base64.b64decode(image_data, validate=True)
+    except binascii.Error:
+        return base64.b64decode(''.join(image_data.split()), validate=True)
+
+
+def decode_base64_image(image_data: str) -> memoryview:
+    """
+    Decode a base64 string into a preallocated buffer, one chunk at a time.
+
+    base64.b64decode(str) first copies the whole string to ASCII bytes, so a
+    one-shot decode briefly holds the string, its byte copy and the output.
+    Decoding in fixed-size chunks keeps that extra copy down to one chunk.
+    Input containing whitespace (which breaks chunk alignment) falls back to a
+    one-shot decode. Characters outside the base64 alphabet, and non-empty
+    input that decodes to nothing, raise binascii.Error.
+    """
+    if len(image_data) <= BASE64_CHUNK_CHARS:
+        decoded = memoryview(_b64decode_strict(image_data))
+    else:
+        buffer = bytearray(len(image_data) // 4 * 3)
+        view = memoryview(buffer)
+        written = 0
+        try:
+            for start in range(0, len(image_data), BASE64_CHUNK_CHARS):
+                chunk = base64.b64decode(image_data[start:start + BASE64_CHUNK_CHARS], validate=True)
+                view[written:written + len(chunk)] = chunk
+                written += len(chunk)
+            decoded = view[:written]
+        except binascii.Error:
+            decoded = memoryview(_b64decode_strict(image_data))
+    if image_data and not decoded:
+        raise binascii.Error('base64 input decodes to no data')
+    return decoded
+
+
+def error_response(status_code: int, error: str, processing_time: str = 'Request failed') -> Dict[str, Any]:
+    """Build an error response with the same body shape as a successful analysis."""
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Content-Type': 'application/json'
+        },
+        'body': dumps({
+            'error': error,
+            'translation': None,
+            'characters': [],
+            'location': None,
+            'processing_time': processing_time,
+            'interesting_detail': None,
+            'date': None
+        }).decode('utf-8')
+    }
+
+
+def encoded_response(event: Dict[str, Any], status_code: int, headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """
+    Build a response around body, gzip- or Brotli-compressed when the request's
+    Accept-Encoding allows it and the body is at least COMPRESSION_MIN_BYTES.
+
+    Compressed bodies are returned base64-encoded with isBase64Encoded set, which
+    API Gateway REST APIs only decode when '*/*' is a binary media type.
+    """
+    encoding = None
+    if COMPRESSION_MIN_BYTES and len(body) >= COMPRESSION_MIN_BYTES:
+        encoding = accepted_encoding(_get_header(event, 'accept-encoding'))
+    if encoding is None:
+        return {'statusCode': status_code, 'headers': headers, 'body': body.decode('utf-8')}
+    return {
+        'statusCode': status_code,
+        'headers': dict(headers, **{'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}),
+        'body': base64.b64encode(compress(body, encoding)).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def _get_header(event: Dict[str, Any], name: str) -> str:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+
+def _parse_multipart(content_type: str, raw_body: bytes) -> Tuple[Dict[str, Any], Any]:
+    """Split a multipart/form-data body into form fields and the 'image' file part (a list when there are several)."""
+    from email.parser import BytesParser
+    from email.policy import HTTP
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + raw_body
+    )
+    if not message.is_multipart():
+        raise ValueError('Invalid multipart request body')
+    fields = {}
+    images = []
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name == 'image':
+            images.append(part.get_payload(decode=True))
+        elif name:
+            fields[name] = part.get_content().strip()
+    return fields, images[0] if len(images) == 1 else images or None
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def _tiling_mode(value: Any) -> Any:
+    """False, True or 'auto' (tile only panoramas and very large images) from a request's 'tiled' field."""
+    if isinstance(value, str) and value.lower() == 'auto':
+        return 'auto'
+    return _flag(value)
+
+
+def _keyframes_mode(value: Any) -> Any:
+    """False, True (the default frame count) or a frame count from a request's 'keyframes' field."""
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    if isinstance(value, str) and not value.strip().isdigit():
+        return _flag(value)
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid keyframes. Must be true or a number of frames.')
+    if count < 1:
+        raise ValueError('Invalid keyframes. Must be true or a number of frames.')
+    return count
+
+
+def parse_analysis_request(event: Dict[str, Any], metrics: RequestMetrics = None) -> Tuple[Dict[str, Any], Any]:
+    """
+    Extract the analysis parameters and the decoded image bytes from an API Gateway event.
+
+    Three body formats are accepted:
+      - JSON with a base64 'image' field (the original contract)
+      - a raw binary body (application/octet-stream or image/*), with parameters in the query string
+      - multipart/form-data with an 'image' file part and the parameters as form fields
+
+    A photo burst is sent as a JSON 'frames' list of base64 images, or as
+    several 'image' parts, and is analyzed in keyframe mode; so is an upload
+    with 'keyframes' set (a video or multi-frame image).
+
+    Binary formats require API Gateway to deliver the body with isBase64Encoded set;
+    the body may also be bytes (the raw body, as src.server passes it).
+    The image is base64-decoded exactly once, here. When metrics is given, the
+    time spent is recorded as the 'body_parse' and 'base64_decode' stages.
+
+    Returns:
+        (request parameters, image bytes or memoryview, or a list of them for a burst)
+
+    Raises:
+        ValueError: with a client-facing message when the request is invalid
+    """
+    body = event.get('body', '')
+    if not body:
+        raise ValueError('No request body provided')
+    if metrics is None:
+        metrics = RequestMetrics()
+
+    content_type = _get_header(event, 'content-type')
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    raw_body = None
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        raw_body = body
+    elif event.get('isBase64Encoded'):
+        try:
+            with metrics.stage('base64_decode'):
+                if media_type.startswith(BINARY_CONTENT_TYPES):
+                    raw_body = decode_base64_image(body)
+                else:
+                    raw_body = base64.b64decode(body)
+        except binascii.Error:
+            raise ValueError('Invalid request body. Expected base64 encoding for binary payloads.')
+
+    if media_type.startswith(BINARY_CONTENT_TYPES):
+        image_bytes = raw_body if raw_body is not None else body.encode('utf-8')
+        request_data = dict(event.get('queryStringParameters') or {})
+    elif media_type == 'multipart/form-data':
+        with metrics.stage('body_parse'):
+            request_data, image_bytes = _parse_multipart(
+                content_type, raw_body if raw_body is not None else body.encode('utf-8')
+            )
+    else:
+        try:
+            with metrics.stage('body_parse'):
+                request_data = json.loads(raw_body if raw_body is not None else body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ValueError('Invalid JSON in request body')
+        if not isinstance(request_data, dict):
+            raise ValueError('Invalid JSON in request body')
+        image_data = request_data.pop('image', None) or request_data.pop('frames', None)
+        if not image_data:
+            raise ValueError('No image data provided in request')
+        try:
+            with metrics.stage('base64_decode'):
+                if isinstance(image_data, list):
+                    image_bytes = [decode_base64_image(frame) for frame in image_data]
+                else:
+                    image_bytes = decode_base64_image(image_data)
+        except (binascii.Error, ValueError, TypeError):
+            raise ValueError('Invalid image data. Must be base64 encoded.')
+        # Drop the base64 copy so it can be freed during the model call
+        del image_data
+
+    if not image_bytes or (isinstance(image_bytes, list) and not all(image_bytes)):
+        raise ValueError('No image data provided in request')
+
+    preprocess = request_data.get('preprocess')
+    if isinstance(preprocess, dict):
+        preprocess = {
+            'max_edge': preprocess.get('maxEdge'),
+            'format': preprocess.get('format'),
+            'quality': preprocess.get('quality')
+        }
+    elif preprocess is not False:
+        preprocess = None
+
+    thinking_budget = THINKING_BUDGET
+    if request_data.get('thinkingBudget') is not None:
+        thinking_budget = parse_thinking_budget(request_data['thinkingBudget'])
+    latency_target = request_data.get('latencyTarget')
+    if latency_target is not None:
+        try:
+            latency_target = float(latency_target)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid latencyTarget. Must be a positive number of seconds.')
+        if latency_target <= 0:
+            raise ValueError('Invalid latencyTarget. Must be a positive number of seconds.')
+    callback_url = request_data.get('callbackUrl') or None
+    if callback_url is not None:
+        check_callback_url(callback_url)
+
+    params = {
+        'speed': request_data.get('speed', 'fast'),
+        'image_type': request_data.get('imageType', 'unknown'),
+        'use_cache': not _flag(request_data.get('bypassCache', False)),
+        'preprocess': preprocess,
+        'thinking_budget': thinking_budget,
+        'latency_target': latency_target,
+        'tiled': _tiling_mode(request_data.get('tiled', False)),
+        'stream': _flag(request_data.get('stream', False)) or EVENT_STREAM_TYPE in _get_header(event, 'accept'),
+        'job': (_flag(request_data.get('job', False)) or callback_url is not None
+                or 'respond-async' in _get_header(event, 'prefer')),
+        'callback_url': callback_url,
+        'keyframes': _keyframes_mode(request_data.get('keyframes')) or isinstance(image_bytes, list)
+    }
+    if params['speed'] == 'auto' and params['stream'] and not params['job']:
+        raise ValueError("speed 'auto' cannot be streamed: the cascade needs each tier's full answer.")
+    if params['keyframes'] and (params['tiled'] or params['stream']):
+        raise ValueError('keyframes cannot be combined with tiled or stream.')
+    if params['job'] and isinstance(image_bytes, list):
+        raise ValueError('Job mode takes a single upload: send a burst as a video or an animated WebP.')
+    return params, image_bytes
+
+
+def check_callback_url(url: Any) -> None:
+    """
+    Refuse callback URLs the worker must not POST results to.
+
+    The URL must be https://, its host must be in JOB_CALLBACK_HOSTS when that
+    is set, and every address the host resolves to must be public: private,
+    loopback, link-local (including the instance metadata endpoint), reserved
+    and multicast addresses are refused.
+
+    Raises:
+        ValueError: with a client-facing message
+    """
+    import ipaddress
+    import socket
+    from urllib.parse import urlsplit
+
+    if not (isinstance(url, str) and url.startswith('https://')):
+        raise ValueError('Invalid callbackUrl. Must be an https:// URL.')
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        port = parts.port or 443
+    except ValueError:
+        raise ValueError('Invalid callbackUrl. Must be an https:// URL.')
+    if not host:
+        raise ValueError('Invalid callbackUrl. Must be an https:// URL.')
+    if JOB_CALLBACK_HOSTS and not any(host == allowed or (allowed.startswith('.') and host.endswith(allowed))
+                                      for allowed in JOB_CALLBACK_HOSTS):
+        raise ValueError(f"Invalid callbackUrl. Host {host} is not an allowed callback host.")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"Invalid callbackUrl. Host {host} does not resolve.")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Invalid callbackUrl. Host {host} resolves to a non-public address.")
+
+
+def analysis_timeout(context: Any) -> Any:
+    """Seconds the analysis may take in this invocation, or None outside Lambda."""
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining is None:
+        return None
+    return max(get_remaining() / 1000 - DEADLINE_MARGIN_SECONDS, 0.1)
+
+
+def build_response_data(gemini_result: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """Turn an analysis result into the API status code and response body."""
+    if gemini_result.get("failure_status") == "success":
+        analysis = gemini_result["analysis"]
+        response_data = {
+            "translation": analysis.get("ancient_text_translation", "No ancient text detected or translation unavailable"),
+            "characters": analysis.get("characters", []),
+            "location": analysis.get("picture_location", "Location unknown"),
+            "processing_time": f"Analysis completed in {gemini_result['api_call_duration']:.2f}s",
+            "interesting_detail": analysis.get("interesting_detail", "No notable details identified"),
+            "date": analysis.get("date", "Period unknown")
+        }
+        response_data.update((name, gemini_result[name]) for name in OPTIONAL_RESPONSE_FIELDS
+                             if gemini_result.get(name) is not None)
+        return 200, response_data
+
+    logger.warning("Gemini analysis failed: %s", gemini_result.get('failure_reason', 'Unknown error'))
+    error_details = gemini_result.get('failure_reason', 'Unknown error')
+    if 'traceback' in gemini_result:
+        error_details += f"\n\nDebug trace:\n{gemini_result['traceback']}"
+    status_code = FAILURE_STATUS_CODES.get(gemini_result.get("failure_status"), 500)
+    return status_code, {
+        "error": error_details,
+        "translation": None,
+        "characters": [],
+        "location": None,
+        "processing_time": f"Failed after {gemini_result.get('api_call_duration', 0):.2f}s",
+        "interesting_detail": None,
+        "date": None
+    }
+
+
+def _streaming_args(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics, timeout: Any) -> Tuple[tuple, Dict[str, Any]]:
+    return (image_bytes, params['speed'], params['image_type'], params['thinking_budget']), {
+        'use_cache': params['use_cache'], 'preprocess': params['preprocess'], 'timeout': timeout,
+        'metrics': metrics, 'latency_target': params['latency_target']
+    }
+
+
+def _sse_chunk(event: Dict[str, Any], metrics: RequestMetrics) -> Any:
+    """The server-sent event for one streaming analysis event, or None for events that are not sent."""
+    from src.streaming import format_sse
+
+    elapsed_ms = round(metrics.total() * 1000, 2)
+    if event['type'] == 'item':
+        return format_sse('character', {'index': event['index'], 'value': event['value'], 'elapsed_ms': elapsed_ms})
+    if event['type'] == 'field':
+        if event['name'] in RESPONSE_FIELDS and event['name'] != 'characters':
+            return format_sse('field', {'name': RESPONSE_FIELDS[event['name']], 'value': event['value'],
+                                        'elapsed_ms': elapsed_ms})
+        return None
+    status_code, response_data = build_response_data(event['result'])
+    response_data['timings'] = event['result'].get('metrics')
+    return format_sse('done' if status_code == 200 else 'error', response_data)
+
+
+def stream_analysis_sse(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics, timeout: Any = None):
+    """
+    Run a streaming analysis and yield it as server-sent events.
+
+    'field' events carry each top-level field under its API name, 'character'
+    events each character as soon as it is complete, and a final 'done' (or
+    'error') event the full response body. Every event includes elapsed_ms
+    since the request started.
+    """
+    from src.gemini_strategy import analyze_egyptian_art_streaming
+
+    args, kwargs = _streaming_args(params, image_bytes, metrics, timeout)
+    for event in analyze_egyptian_art_streaming(*args, **kwargs):
+        chunk = _sse_chunk(event, metrics)
+        if chunk is not None:
+            yield chunk
+
+
+async def stream_analysis_sse_async(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics,
+                                    timeout: Any = None):
+    """stream_analysis_sse on the running event loop; closing it early cancels the model call."""
+    from src.gemini_strategy import analyze_egyptian_art_streaming_async
+
+    args, kwargs = _streaming_args(params, image_bytes, metrics, timeout)
+    async for event in analyze_egyptian_art_streaming_async(*args, **kwargs):
+        chunk = _sse_chunk(event, metrics)
+        if chunk is not None:
+            yield chunk
+
+
+def _analysis_call(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics,
+                   timeout: Any) -> Tuple[str, tuple, Dict[str, Any]]:
+    """The src.gemini_strategy function (by name) for the analysis a request asks for, and its arguments."""
+    args = (image_bytes, params['speed'], params['image_type'], params['thinking_budget'])
+    kwargs = {'use_cache': params['use_cache'], 'timeout': timeout, 'metrics': metrics,
+              'latency_target': params['latency_target']}
+    if params.get('keyframes'):
+        return 'analyze_egyptian_art_keyframes', args, dict(
+            kwargs, preprocess=params['preprocess'],
+            keyframes=None if params['keyframes'] is True else params['keyframes'])
+    if params['tiled']:
+        return 'analyze_egyptian_art_tiled', args, dict(kwargs, only_if_large=params['tiled'] == 'auto')
+    return 'analyze_egyptian_art_with_gemini', args, dict(kwargs, preprocess=params['preprocess'])
+
+
+def run_analysis(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics, timeout: Any = None) -> Dict[str, Any]:
+    """Run the (tiled, keyframe or single-call) analysis a request asks for and return its result dict."""
+    _load_analyzer()
+    # Imported after _load_analyzer(), so it is already loaded
+    import src.gemini_strategy as gemini_strategy
+    name, args, kwargs = _analysis_call(params, image_bytes, metrics, timeout)
+    return getattr(gemini_strategy, name)(*args, **kwargs)
+
+
+async def run_analysis_async(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics,
+                             timeout: Any = None) -> Dict[str, Any]:
+    """
+    run_analysis for callers on an event loop: awaits the analysis on the
+    running loop instead of blocking a thread on the shared one. Call
+    _load_analyzer() (off the loop) first.
+    """
+    import src.gemini_strategy as gemini_strategy
+    name, args, kwargs = _analysis_call(params, image_bytes, metrics, timeout)
+    return await getattr(gemini_strategy, f'{name}_async')(*args, **kwargs)
+
+
+def _job_request(params: Dict[str, Any]) -> Dict[str, Any]:
+    """The parameters a job's worker needs (everything but how the answer is delivered)."""
+    return {name: value for name, value in params.items() if name not in ('stream', 'job', 'callback_url')}
+
+
+def _job_body(job: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    # REST APIs put the stage in front of the resource path
+    request_path = (event.get('requestContext') or {}).get('path') or ''
+    path = event.get('path') or ''
+    prefix = request_path[:-len(path)] if path and request_path.endswith(path) else ''
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"{prefix}/jobs/{job['id']}",
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'status_code': job['status_code'],
+        'result': job['result']
+    }
+
+
+def job_response(event: Dict[str, Any], job: Dict[str, Any], status_code: int = 200) -> Dict[str, Any]:
+    """Build the response describing a job, with its result once it has finished."""
+    body = _job_body(job, event)
+    return encoded_response(event, status_code, {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Location',
+        'Content-Type': 'application/json',
+        'Location': body['status_url']
+    }, dumps(body))
+
+
+def submit_job(event: Dict[str, Any], context: Any, params: Dict[str, Any], image_bytes: Any) -> Dict[str, Any]:
+    """
+    Queue the analysis as a job and answer without waiting for it.
+
+    Requests for the same image and answer-changing parameters share one job
+    (bypassCache runs a finished job again). Answers 202 while the job is
+    queued or running, 200 with the result when it has already finished.
+    """
+    from src.jobs import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, get_job_store, make_job_id
+    from src.prompts import PROMPT_VERSION
+
+    store = get_job_store()
+    if JOB_DISPATCH == 'lambda' and not store.shared:
+        # The asynchronously invoked worker would run in another execution environment and never see the job
+        logger.error("Job mode needs a shared job store; %s is local to this instance",
+                     getattr(store, 'directory', type(store).__name__))
+        return error_response(501, 'Job mode is not available: the job store is not shared between Lambda '
+                                   'instances. Set JOB_STORE_PATH to an EFS mount or install a shared store.')
+    request = _job_request(params)
+    request_key = dumps(dict(request, use_cache=None, prompt_version=PROMPT_VERSION)).decode('utf-8')
+    job_id = make_job_id(bytes(image_bytes), request_key)
+    job, queued = store.submit(job_id, request, bytes(image_bytes), callback_url=params['callback_url'],
+                               restart=not params['use_cache'])
+    if queued:
+        logger.info("Queued job %s (speed=%s)", job_id, params['speed'])
+        try:
+            dispatch_job(job_id, context)
+        except Exception as e:
+            logger.warning("Could not dispatch job %s: %s", job_id, e)
+            job = store.complete(job_id, JOB_FAILED, 500, {'error': f"Could not start the job: {e}"})
+    else:
+        logger.info("Request joined job %s (%s)", job_id, job['status'])
+    return job_response(event, job, 202 if job['status'] in (JOB_QUEUED, JOB_RUNNING) else 200)
+
+
+_lambda_client = None
+
+
+def dispatch_job(job_id: str, context: Any) -> None:
+    """Start a worker for a queued job, as JOB_DISPATCH says."""
+    global _lambda_client
+    if JOB_DISPATCH == 'thread':
+        threading.Thread(target=run_job, args=(job_id,), name=f'job-{job_id[:8]}', daemon=True).start()
+        return
+    if JOB_DISPATCH != 'lambda':
+        raise ValueError(f"Unknown JOB_DISPATCH {JOB_DISPATCH!r}: expected 'lambda' or 'thread'")
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client('lambda')
+    function_name = getattr(context, 'invoked_function_arn', None) or os.environ['AWS_LAMBDA_FUNCTION_NAME']
+    _lambda_client.invoke(FunctionName=function_name, InvocationType='Event', Payload=dumps({'jobWorker': job_id}))
+
+
+def run_job(job_id: str, context: Any = None) -> Dict[str, Any]:
+    """
+    Worker path: run a queued job's analysis, store its response and notify
+    its callback URLs. A job that is unknown, finished or being run by
+    another worker is skipped.
+    """
+    from src.jobs import JOB_FAILED, JOB_SUCCEEDED, get_job_store
+
+    store = get_job_store()
+    claimed = store.claim(job_id)
+    if claimed is None:
+        logger.info("Job %s is not waiting for a worker", job_id)
+        return {'jobId': job_id, 'status': 'skipped'}
+    params, image_bytes = claimed
+    metrics = RequestMetrics(job_id=job_id)
+    metrics.set(speed=params['speed'], image_type=params['image_type'])
+    try:
+        gemini_result = run_analysis(params, image_bytes, metrics, timeout=analysis_timeout(context))
+        status_code, response_data = build_response_data(gemini_result)
+    except Exception as e:
+        logger.exception("Job %s failed: %s", job_id, e)
+        status_code, response_data = 500, {'error': f"Server error: {e}"}
+    metrics.emit()
+    job = store.complete(job_id, JOB_SUCCEEDED if status_code == 200 else JOB_FAILED, status_code, response_data)
+    if job is not None:
+        for callback_url in job['callbacks']:
+            _post_callback(callback_url, _job_body(job, {}))
+    return {'jobId': job_id, 'status': job['status'] if job else JOB_FAILED}
+
+
+def _refuse_redirects_handler():
+    """urllib handler that turns redirects into errors, so a callback cannot be bounced to an internal host."""
+    import urllib.error
+    import urllib.request
+
+    class RefuseRedirects(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, req, fp, code, msg, headers, newurl):
+            raise urllib.error.HTTPError(req.full_url, code, f"Callback redirect to {newurl} not followed", headers, fp)
+
+    return RefuseRedirects()
+
+
+def _post_callback(url: str, body: Dict[str, Any]) -> None:
+    import urllib.request
+    request = urllib.request.Request(url, data=dumps(body), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        # Checked again: the host may resolve differently by the time the job finishes
+        check_callback_url(url)
+        opener = urllib.request.build_opener(_refuse_redirects_handler())
+        with opener.open(request, timeout=CALLBACK_TIMEOUT_SECONDS) as response:
+            response.read()
+    except Exception as e:
+        # The result stays available from GET /jobs/{id}
+        logger.warning("Callback for job %s to %s failed: %s", body['job_id'], url, e)
+
+
+def log_analysis_request(params: Dict[str, Any], image_bytes: Any, metrics: RequestMetrics) -> None:
+    """Log a parsed analysis request and label its metrics."""
+    speed = params['speed']
+    image_type = params['image_type']
+    metrics.set(speed=speed, image_type=image_type)
+    if isinstance(image_bytes, list):
+        logger.info("Received burst: %d images, %d bytes (speed=%s, image_type=%s)", len(image_bytes),
+                    sum(len(frame) for frame in image_bytes), speed, image_type)
+    else:
+        logger.info("Received image: %d bytes (speed=%s, image_type=%s)", len(image_bytes), speed, image_type)
+
+
+def handle_analysis_request(event: Dict[str, Any], context: Any, params: Dict[str, Any], image_bytes: Any,
+                            metrics: RequestMetrics) -> Dict[str, Any]:
+    """Answer a parsed analysis request: queue it as a job, or run it and build the (SSE or JSON) response."""
+    log_analysis_request(params, image_bytes, metrics)
+
+    if params['job']:
+        return submit_job(event, context, params, image_bytes)
+
+    if params['stream']:
+        # Buffered here (the managed Python runtime cannot stream a response),
+        # but the events keep their timing; streaming-capable front ends can
+        # iterate stream_analysis_sse() directly.
+        _load_analyzer()
+        body = ''.join(stream_analysis_sse(params, image_bytes, metrics, timeout=analysis_timeout(context)))
+        metrics.emit()
+        return encoded_response(event, 200, {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Server-Timing, X-Profile',
+            'Content-Type': EVENT_STREAM_TYPE,
+            'Cache-Control': 'no-cache',
+            'Server-Timing': metrics.server_timing()
+        }, body.encode('utf-8'))
+
+    # Call the Gemini analysis
+    gemini_result = run_analysis(params, image_bytes, metrics, timeout=analysis_timeout(context))
+    metrics.emit()
+    return analysis_response(event, gemini_result, metrics)
+
+
+def analysis_response(event: Dict[str, Any], gemini_result: Dict[str, Any], metrics: RequestMetrics) -> Dict[str, Any]:
+    """Build the JSON response for an analysis result."""
+    status_code, response_data = build_response_data(gemini_result)
+    return encoded_response(event, status_code, {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Server-Timing, X-Profile',
+        'Content-Type': 'application/json',
+        'Server-Timing': metrics.server_timing()
+    }, dumps(response_data))
+
+
+def server_error_response(e: Exception) -> Dict[str, Any]:
+    """Log an unexpected exception and build the 500 response for it."""
+    logger.exception("Error processing request: %s", e)
+    import traceback
+    error_details = f"Server error: {str(e)}\n\nDebug trace:\n{traceback.format_exc()}"
+    return error_response(500, error_details, 'Processing failed')
 
-from src.gemini_strategy import analyze_egyptian_art_with_gemini
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     AWS Lambda handler for Egyptian art analysis API
+
+    Sampled invocations, and requests that ask for it when PROFILE_REQUEST_FLAG=1,
+    are profiled (see src.profiling); requested profiles are summarized in the
+    X-Profile response header.
     """
+    session = profiling.begin('lambda_handler', profiling.requested_mode(event))
+    if session is None:
+        return _handle_event(event, context)
+    try:
+        with profiling.thread_scope():
+            response = _handle_event(event, context)
+    finally:
+        report = session.finish()
+    if session.inline:
+        response.setdefault('headers', {})['X-Profile'] = dumps(report).decode('utf-8')
+    return response
+
+
+def _handle_event(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
+        # Asynchronous invocation by dispatch_job
+        if 'jobWorker' in event:
+            return run_job(event['jobWorker'], context)
+
         # Handle CORS preflight requests
         if event.get('httpMethod') == 'OPTIONS':
             return {
                 'statusCode': 200,
                 'headers': {
                     'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type'
+                    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, Prefer, X-Profile'
                 },
                 'body': ''
             }
-        
-        # Only handle POST requests
+
+        # Job status: GET /jobs/{id}
+        if event.get('httpMethod') == 'GET':
+            match = JOB_PATH_PATTERN.search(event.get('path') or '')
+            if match is None:
+                return error_response(405, 'Method not allowed. Only POST requests and GET /jobs/{id} are supported.')
+            from src.jobs import get_job_store
+            job = get_job_store().get(match.group(1))
+            if job is None:
+                return error_response(404, f"Unknown or expired job {match.group(1)}")
+            return job_response(event, job)
+
+        # Otherwise only handle POST requests
         if event.get('httpMethod') != 'POST':
-            return {
-                'statusCode': 405,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'error': 'Method not allowed. Only POST requests are supported.',
-                    'translation': None,
-                    'characters': [],
-                    'location': None,
-                    'processing_time': 'Request failed',
-                    'interesting_detail': None,
-                    'date': None
-                })
-            }
-        
-        # Parse the request body
-        body = event.get('body', '')
-        if not body:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'error': 'No request body provided',
-                    'translation': None,
-                    'characters': [],
-                    'location': None,
-                    'processing_time': 'Request failed',
-                    'interesting_detail': None,
-                    'date': None
-                })
-            }
-        
-        # Parse JSON body
-        try:
-            request_data = json.loads(body)
-        except json.JSONDecodeError:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'error': 'Invalid JSON in request body',
-                    'translation': None,
-                    'characters': [],
-                    'location': None,
-                    'processing_time': 'Request failed',
-                    'interesting_detail': None,
-                    'date': None
-                })
-            }
-        
-        # Extract parameters
-        image_data = request_data.get('image')
-        speed = request_data.get('speed', 'fast')
-        image_type = request_data.get('imageType', 'unknown')
-        
-        if not image_data:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'error': 'No image data provided in request',
-                    'translation': None,
-                    'characters': [],
-                    'location': None,
-                    'processing_time': 'Request failed',
-                    'interesting_detail': None,
-                    'date': None
-                })
-            }
-        
-        # Validate image data (should be base64)
+            return error_response(405, 'Method not allowed. Only POST requests and GET /jobs/{id} are supported.')
+
+        # Parse the request body and decode the image once
+        metrics = RequestMetrics()
         try:
-            # Try to decode to validate it's proper base64
-            base64.b64decode(image_data)
-        except Exception:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps({
-                    'error': 'Invalid image data. Must be base64 encoded.',
-                    'translation': None,
-                    'characters': [],
-                    'location': None,
-                    'processing_time': 'Request failed',
-                    'interesting_detail': None,
-                    'date': None
-                })
-            }
-        
-        print(f"Received image: {len(image_data)} characters (base64)")
-        print(f"Analysis settings: speed={speed}, image_type={image_type}")
-        
-        # Call the Gemini analysis
-        print("Calling Gemini API for Egyptian art analysis...")
-        gemini_result = analyze_egyptian_art_with_gemini(image_data, speed, image_type)
-        
-        if gemini_result.get("failure_status") == "success":
-            analysis = gemini_result["analysis"]
-            response_data = {
-                "translation": analysis.get("ancient_text_translation", "No ancient text detected or translation unavailable"),
-                "characters": analysis.get("characters", []),
-                "location": analysis.get("picture_location", "Location unknown"),
-                "processing_time": f"Analysis completed in {gemini_result['api_call_duration']:.2f}s",
-                "interesting_detail": analysis.get("interesting_detail", "No notable details identified"),
-                "date": analysis.get("date", "Period unknown")
-            }
-            print("Gemini analysis successful!")
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps(response_data, indent=2)
-            }
-            
-        else:
-            print(f"Gemini analysis failed: {gemini_result.get('failure_reason', 'Unknown error')}")
-            error_details = gemini_result.get('failure_reason', 'Unknown error')
-            if 'traceback' in gemini_result:
-                error_details += f"\n\nDebug trace:\n{gemini_result['traceback']}"
-            
-            response_data = {
-                "error": error_details,
-                "translation": None,
-                "characters": [],
-                "location": None,
-                "processing_time": f"Failed after {gemini_result.get('api_call_duration', 0):.2f}s",
-                "interesting_detail": None,
-                "date": None
-            }
-            
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Type': 'application/json'
-                },
-                'body': json.dumps(response_data, indent=2)
-            }
-            
+            params, image_bytes = parse_analysis_request(event, metrics)
+        except ValueError as e:
+            return error_response(400, str(e))
+
+        return handle_analysis_request(event, context, params, image_bytes, metrics)
+
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
-        import traceback
-        error_details = f"Server error: {str(e)}\n\nDebug trace:\n{traceback.format_exc()}"
-        
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                "error": error_details,
-                "translation": None,
-                "characters": [],
-                "location": None,
-                "processing_time": "Processing failed",
-                "interesting_detail": None,
-                "date": None
-            }, indent=2)
-        }
+        return server_error_response(e)
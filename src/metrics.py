@@ -0,0 +1,146 @@
+"""
+Level-gated logging and per-request stage timings.
+
+Every module logs through get_logger(), whose level comes from LOG_LEVEL
+(default WARNING, so a healthy request writes nothing but its metrics line).
+A RequestMetrics object follows one request through the pipeline, timing each
+stage, and is emitted once as a single JSON line in CloudWatch Embedded Metric
+Format (EMF): Lambda turns it into metrics without any API calls. The line is
+written by default only on Lambda; METRICS_EMF=1 or 0 forces it on or off.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER_NAME = 'egyptian_art'
+METRICS_NAMESPACE = 'EgyptianArtAnalyzer'
+
+_logging_configured = False
+
+
+def get_logger(name=None):
+    """Return a child of the package logger, configuring it from LOG_LEVEL on first use."""
+    global _logging_configured
+    base = logging.getLogger(LOGGER_NAME)
+    if not _logging_configured:
+        base.setLevel(os.environ.get('LOG_LEVEL', 'WARNING').upper())
+        if not logging.getLogger().handlers:
+            # Outside Lambda (whose runtime installs a root handler) nothing would print
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(levelname)s %(name)s: %(message)s'))
+            base.addHandler(handler)
+            base.propagate = False
+        _logging_configured = True
+    return base.getChild(name) if name else base
+
+
+class RequestMetrics:
+    """
+    Stage timings for one analysis request.
+
+    Stages with the same name accumulate (e.g. 'network' across retries); each
+    model attempt is also recorded individually. Marks record when something
+    happened relative to the start of the request (e.g. the first streamed field).
+    Worker threads of the same request (asyncio.to_thread) may record into it
+    at once, so the read-modify-write updates are locked.
+    """
+
+    def __init__(self, **properties):
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.marks = {}
+        self.attempts = []
+        self.counters = {}
+        self.properties = dict(properties)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def mark(self, name):
+        """Record the time since the start of the request under name, once."""
+        with self._lock:
+            if name not in self.marks:
+                self.marks[name] = self.total()
+
+    def add_counter(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_attempt(self, attempt, model, duration, outcome, error=None, hedge=False):
+        entry = {"attempt": attempt, "model": model, "duration_ms": round(duration * 1000, 2), "outcome": outcome}
+        if hedge:
+            entry["hedge"] = True
+        if error is not None:
+            entry["error"] = str(error)[:200]
+        self.attempts.append(entry)
+
+    def set(self, **properties):
+        self.properties.update(properties)
+
+    def total(self):
+        return time.perf_counter() - self.start_time
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self.stages), dict(self.marks), dict(self.counters)
+
+    def to_dict(self):
+        stages, marks, counters = self._snapshot()
+        return {
+            "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+            "marks_ms": {name: round(seconds * 1000, 2) for name, seconds in marks.items()},
+            "total_ms": round(self.total() * 1000, 2),
+            "attempts": list(self.attempts),
+            "counters": counters
+        }
+
+    def server_timing(self):
+        """Value for an HTTP Server-Timing header."""
+        stages, marks, _ = self._snapshot()
+        timings = list(stages.items()) + list(marks.items())
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+
+    def emf_record(self, dimensions=('speed', 'status')):
+        stages, marks, counters = self._snapshot()
+        stage_metrics = {f"{name}_ms": round(seconds * 1000, 2)
+                         for name, seconds in list(stages.items()) + list(marks.items())}
+        stage_metrics["total_ms"] = round(self.total() * 1000, 2)
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [[d for d in dimensions if d in self.properties]],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in stage_metrics]
+                        + [{"Name": name, "Unit": "Count"} for name in counters]
+                }]
+            },
+            "attempts": self.attempts
+        }
+        record.update(self.properties)
+        record.update(stage_metrics)
+        record.update(counters)
+        return record
+
+    def emit(self):
+        """Write the EMF line for this request to stdout if enabled (see module docstring)."""
+        default = '1' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else '0'
+        if os.environ.get('METRICS_EMF', default) == '0':
+            return
+        sys.stdout.write(json.dumps(self.emf_record(), default=str) + "\n")
+        sys.stdout.flush()
@@ -0,0 +1,77 @@
+"""
+Multi-image packing: planning which images share one model call.
+
+Every call pays for the expert prompt and the per-request overhead, so for
+archive reprocessing several images are packed into one generate_content
+request and answered as a PackedAnalyses (src.schemas). A pack is bounded by
+a token budget - the images' input tokens plus the output and thinking each
+answer is expected to take - and by a maximum number of images, since answer
+quality drops when one call has to keep too many images apart.
+
+The expected output per image starts at DEFAULT_OUTPUT_TOKENS_PER_IMAGE and
+follows the usage the API reports for packed calls (OutputTokenEstimate), so
+packs shrink when answers turn out longer than assumed.
+"""
+
+import threading
+
+DEFAULT_PACK_TOKEN_BUDGET = 32_000
+DEFAULT_MAX_PACK_SIZE = 8
+DEFAULT_OUTPUT_TOKENS_PER_IMAGE = 800
+OUTPUT_EWMA_ALPHA = 0.3
+
+
+class OutputTokenEstimate:
+    """Thread-safe moving average of the output tokens one packed answer takes."""
+
+    def __init__(self, initial=DEFAULT_OUTPUT_TOKENS_PER_IMAGE, alpha=OUTPUT_EWMA_ALPHA):
+        self.initial = initial
+        self.alpha = alpha
+        self._value = float(initial)
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        with self._lock:
+            return int(self._value)
+
+    def record(self, output_tokens, images):
+        """Update from the output tokens of one packed call that answered images images."""
+        if images <= 0 or output_tokens <= 0:
+            return
+        with self._lock:
+            self._value += self.alpha * (output_tokens / images - self._value)
+
+    def reset(self):
+        with self._lock:
+            self._value = float(self.initial)
+
+
+def plan_packs(input_tokens, token_budget=DEFAULT_PACK_TOKEN_BUDGET, max_pack_size=DEFAULT_MAX_PACK_SIZE,
+               tokens_per_answer=DEFAULT_OUTPUT_TOKENS_PER_IMAGE):
+    """
+    Group images, in order, into packs that fit the token budget.
+
+    Args:
+        input_tokens: Estimated input tokens per image, without the shared prompt
+        token_budget: Upper bound on the estimated input plus output tokens of
+            one call, less the shared prompt
+        max_pack_size: Upper bound on the images per call
+        tokens_per_answer: Expected output (and thinking) tokens per image
+
+    Returns:
+        List of packs, each a list of indices into input_tokens. An image that
+        does not fit the budget on its own gets a pack of its own.
+    """
+    packs = []
+    current, used = [], 0
+    for index, tokens in enumerate(input_tokens):
+        cost = tokens + tokens_per_answer
+        if current and (used + cost > token_budget or len(current) >= max_pack_size):
+            packs.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
@@ -0,0 +1,332 @@
+"""
+Perceptual-fingerprint index for reusing analyses of near-duplicate photos.
+
+Each analyzed image is reduced to a 64-bit difference hash (dHash). Lookups use
+multi-index hashing: the hash is split into four 16-bit chunks, and by the
+pigeonhole principle any stored hash within Hamming distance ``t`` of the query
+matches at least one chunk within ``t // 4`` bits. Each chunk table is a sorted
+array probed (vectorized) with ``searchsorted``, so exact distances are only
+computed for a small candidate set instead of for every entry.
+
+A saved index is a directory of ``.npy`` arrays plus a JSON-lines record file.
+All of it is opened with mmap at load time, so cold starts do not pay for
+reading or rebuilding 100k+ entries.
+"""
+
+import atexit
+import collections
+import contextlib
+import itertools
+import json
+import mmap
+import os
+import threading
+
+import numpy as np
+
+from src.metrics import get_logger
+
+logger = get_logger('perceptual_index')
+
+HASH_BITS = 64
+CHUNK_COUNT = 4
+CHUNK_BITS = HASH_BITS // CHUNK_COUNT
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+DEFAULT_THRESHOLD = 8
+# Pending entries that trigger a merge into the arrays, and the cap (as a multiple of it) on pending entries
+DEFAULT_FLUSH_THRESHOLD = 1000
+MAX_PENDING_FACTOR = 10
+
+
+def dhash(image, hash_size=8):
+    """
+    Compute the 64-bit difference hash of a PIL image.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale thumbnail and
+    each bit records whether a pixel is brighter than its right-hand neighbour.
+    """
+    import PIL.Image
+
+    gray = image.convert('L')
+    pixels = np.asarray(gray.resize((hash_size + 1, hash_size), PIL.Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def _popcount64(values):
+    """Vectorized popcount of a uint64 array."""
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _chunk(value, index):
+    return (value >> (index * CHUNK_BITS)) & CHUNK_MASK
+
+
+_probe_masks_cache = {}
+
+
+def _probe_masks(radius):
+    """XOR masks reaching every chunk value within ``radius`` bits (including 0)."""
+    masks = _probe_masks_cache.get(radius)
+    if masks is None:
+        values = [0]
+        for distance in range(1, radius + 1):
+            for positions in itertools.combinations(range(CHUNK_BITS), distance):
+                values.append(sum(1 << position for position in positions))
+        masks = np.array(values, dtype=np.uint16)
+        _probe_masks_cache[radius] = masks
+    return masks
+
+
+IndexArrays = collections.namedtuple('IndexArrays', 'hashes sorted_chunks chunk_order offsets records')
+_EMPTY_ARRAYS = IndexArrays(np.zeros(0, dtype=np.uint64), np.zeros((CHUNK_COUNT, 0), dtype=np.uint16),
+                            np.zeros((CHUNK_COUNT, 0), dtype=np.int64), np.zeros(1, dtype=np.int64), b'')
+
+
+def _build_arrays(arrays, entries):
+    """IndexArrays (records as bytes) holding the entries of arrays plus the (fingerprint, record) entries."""
+    hashes = np.concatenate([arrays.hashes, np.array([h for h, _ in entries], dtype=np.uint64)])
+    records = (bytes(arrays.records[:int(arrays.offsets[-1])])
+               + b''.join(json.dumps(record).encode('utf-8') + b'\n' for _, record in entries))
+    chunk_values = np.stack([
+        ((hashes >> np.uint64(i * CHUNK_BITS)) & np.uint64(CHUNK_MASK)).astype(np.uint16)
+        for i in range(CHUNK_COUNT)
+    ]) if len(hashes) else np.zeros((CHUNK_COUNT, 0), dtype=np.uint16)
+    chunk_order = np.argsort(chunk_values, axis=1, kind='stable').astype(np.int64)
+    sorted_chunks = np.take_along_axis(chunk_values, chunk_order, axis=1)
+    offsets = np.concatenate([arrays.offsets, np.zeros(len(entries), dtype=np.int64)])
+    if entries:
+        offsets[len(arrays.offsets):] = int(arrays.offsets[-1]) + np.cumsum(
+            [len(json.dumps(record).encode('utf-8')) + 1 for _, record in entries])
+    return IndexArrays(hashes, sorted_chunks, chunk_order, offsets, records)
+
+
+def _load_arrays(path):
+    if not os.path.exists(os.path.join(path, 'hashes.npy')):
+        return _EMPTY_ARRAYS
+    # np.asarray drops the memmap subclass (whose indexing is slow) but keeps the mapping
+    arrays = [np.asarray(np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+              for name in ('hashes', 'sorted_chunks', 'chunk_order', 'offsets')]
+    records = b''
+    # The mmap keeps its own handle, so the file can be closed
+    with open(os.path.join(path, 'records.jsonl'), 'rb') as records_file:
+        if os.fstat(records_file.fileno()).st_size:
+            records = mmap.mmap(records_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return IndexArrays(*arrays, records)
+
+
+def _write_atomic(target, data):
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, target)
+
+
+def _write_arrays(path, arrays):
+    _write_atomic(os.path.join(path, 'records.jsonl'), arrays.records)
+    for name in ('hashes', 'sorted_chunks', 'chunk_order', 'offsets'):
+        tmp_path = os.path.join(path, f'{name}.{os.getpid()}.{threading.get_ident()}.tmp.npy')
+        np.save(tmp_path, getattr(arrays, name))
+        os.replace(tmp_path, os.path.join(path, f'{name}.npy'))
+
+
+class PerceptualIndex:
+    """
+    Hamming-distance index mapping dHash fingerprints to stored analyses.
+
+    Entries loaded from disk are read through mmap. Entries added since are kept
+    in memory and scanned linearly, until they are merged into the arrays: in a
+    background thread once ``flush_threshold`` have accumulated, or on
+    ``flush()`` / ``save()``. With a path the merged index is written there and
+    reopened via mmap (merged with what other processes wrote meanwhile);
+    without one it stays in memory. At most ``max_pending`` entries wait for a
+    merge; beyond that the oldest are dropped.
+
+    Lookups read one snapshot of the arrays, so a concurrent merge cannot hand
+    them mismatched or closed arrays.
+    """
+
+    def __init__(self, path=None, flush_threshold=None, max_pending=None):
+        """
+        Args:
+            path: Index directory to load from and write to, or None for an in-memory index
+            flush_threshold: Pending entries that start a merge (default PHASH_FLUSH_THRESHOLD
+                or 1000; 0 merges only on flush() and save())
+            max_pending: Most entries waiting for a merge (default 10 x flush_threshold; 0: no limit)
+        """
+        self.path = path
+        if flush_threshold is None:
+            flush_threshold = int(os.environ.get('PHASH_FLUSH_THRESHOLD', DEFAULT_FLUSH_THRESHOLD))
+        self.flush_threshold = flush_threshold
+        self.max_pending = max_pending if max_pending is not None else MAX_PENDING_FACTOR * flush_threshold
+        self.dropped = 0
+        # _lock guards the snapshot and the pending lists; _merge_lock runs one merge at a time
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._arrays = _load_arrays(path) if path else _EMPTY_ARRAYS
+        self._pending = []
+        # Entries being merged: still scanned by lookups until the merged arrays are in place
+        self._merging = []
+        self._flushing = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._arrays.hashes) + len(self._pending) + len(self._merging)
+
+    @staticmethod
+    def _stored_record(arrays, index):
+        start, end = int(arrays.offsets[index]), int(arrays.offsets[index + 1])
+        return json.loads(arrays.records[start:end])
+
+    def add(self, fingerprint, record):
+        """Add a fingerprint and its record (must be JSON-serializable)."""
+        with self._lock:
+            self._pending.append((int(fingerprint), record))
+            if self.max_pending and len(self._pending) > self.max_pending:
+                del self._pending[0]
+                self.dropped += 1
+            start_flush = (self.flush_threshold and len(self._pending) >= self.flush_threshold
+                           and not self._flushing)
+            if start_flush:
+                self._flushing = True
+        if start_flush:
+            threading.Thread(target=self._flush_in_background, name='phash-flush', daemon=True).start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # The entries are pending again; the next threshold crossing retries
+            logger.warning("Merging the near-duplicate index failed: %s", e)
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def lookup(self, fingerprint, threshold=DEFAULT_THRESHOLD, accept=None):
+        """
+        Find the closest stored entry within ``threshold`` bits.
+
+        Args:
+            fingerprint: 64-bit dHash of the query image
+            threshold: Maximum Hamming distance to accept
+            accept: Optional predicate on the record (e.g. to match prompt version)
+
+        Returns:
+            (distance, record) for the best match, or None
+        """
+        fingerprint = int(fingerprint)
+        with self._lock:
+            arrays = self._arrays
+            pending = self._merging + self._pending
+        best = None
+        if len(arrays.hashes):
+            masks = _probe_masks(threshold // CHUNK_COUNT)
+            ranges = []
+            for chunk_index in range(CHUNK_COUNT):
+                sorted_chunk = arrays.sorted_chunks[chunk_index]
+                probes = np.uint16(_chunk(fingerprint, chunk_index)) ^ masks
+                lefts = np.searchsorted(sorted_chunk, probes, side='left')
+                rights = np.searchsorted(sorted_chunk, probes, side='right')
+                order = arrays.chunk_order[chunk_index]
+                ranges.extend(order[left:right] for left, right in zip(lefts.tolist(), rights.tolist()) if right > left)
+            if ranges:
+                candidates = np.unique(np.concatenate(ranges))
+                distances = _popcount64(arrays.hashes[candidates] ^ np.uint64(fingerprint))
+                close = np.flatnonzero(distances <= threshold)
+                for position in close[np.argsort(distances[close], kind='stable')].tolist():
+                    record = self._stored_record(arrays, int(candidates[position]))
+                    if accept is None or accept(record):
+                        best = (int(distances[position]), record)
+                        break
+
+        for stored_hash, record in pending:
+            distance = hamming_distance(fingerprint, stored_hash)
+            if distance <= threshold and (best is None or distance < best[0]):
+                if accept is None or accept(record):
+                    best = (distance, record)
+        return best
+
+    def flush(self):
+        """Merge the pending entries into the arrays (and the index directory, when there is one)."""
+        self._merge(self.path, force=False)
+
+    def save(self, path=None):
+        """Write all entries (stored and pending) to ``path`` and reopen them via mmap."""
+        path = path or self.path
+        if not path:
+            raise ValueError("No path given for saving the perceptual index")
+        self._merge(path, force=True)
+
+    def _merge(self, path, force):
+        with self._merge_lock:
+            with self._lock:
+                entries = self._merging = self._pending
+                self._pending = []
+                arrays = self._arrays
+            if not entries and not force:
+                return
+            try:
+                if path:
+                    os.makedirs(path, exist_ok=True)
+                    with _directory_lock(path):
+                        # Built on what is on disk now, which other processes may have added to
+                        base = _load_arrays(path) if path == self.path else arrays
+                        merged = _build_arrays(base, entries)
+                        _write_arrays(path, merged)
+                    merged = _load_arrays(path)
+                else:
+                    merged = _build_arrays(arrays, entries)
+            except BaseException:
+                with self._lock:
+                    self._pending = entries + self._pending
+                    self._merging = []
+                raise
+            with self._lock:
+                # Lookups holding the old snapshot keep its arrays open until they are done
+                self.path = path
+                self._arrays = merged
+                self._merging = []
+
+    def close(self):
+        with self._lock:
+            self._arrays = _EMPTY_ARRAYS
+
+
+@contextlib.contextmanager
+def _directory_lock(path):
+    """Exclusive lock on an index directory, so processes sharing it merge one at a time."""
+    import fcntl
+
+    with open(os.path.join(path, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    """
+    Return the process-wide index loaded from PHASH_INDEX_PATH, or None when unset.
+    """
+    global _default_index
+    path = os.environ.get('PHASH_INDEX_PATH')
+    if not path:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = PerceptualIndex(path)
+            # Entries below the flush threshold are written when the process exits
+            atexit.register(_default_index.flush)
+        return _default_index
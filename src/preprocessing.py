@@ -0,0 +1,187 @@
+"""
+Upload-size reduction applied to images before they are sent to Gemini.
+
+Phone photos are far larger than the model needs. Each speed tier gets a
+maximum edge length and an output encoding; the image is rotated according to
+its EXIF orientation, downscaled, stripped of metadata (EXIF, GPS, ICC) and
+re-encoded. The result is passed to the SDK as a ready-made blob so it is not
+re-encoded again at full resolution.
+
+Decoding is bounded. open_image reads only the header and refuses images
+with more than IMAGE_MAX_PIXELS pixels before any pixel data is decoded.
+draft_image asks the JPEG decoder for a reduced-scale decode (1/2, 1/4 or 1/8
+in the DCT) that still covers the target edge, so a 24 MP photo bound for
+2048 px is decoded at 3000x2000 instead of 6000x4000. It also refuses an
+image whose decoded pixels would exceed the per-request memory budget
+(IMAGE_MEMORY_BUDGET_MB).
+"""
+
+import io
+import os
+import time
+
+import PIL.Image
+import PIL.ImageOps
+
+DEFAULT_PREPROCESS_CONFIG = {
+    'regular': {'max_edge': 3072, 'format': 'JPEG', 'quality': 90},
+    'fast': {'max_edge': 2048, 'format': 'JPEG', 'quality': 85},
+    'super-fast': {'max_edge': 1536, 'format': 'JPEG', 'quality': 80},
+}
+
+FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+DEFAULT_MAX_PIXELS = 100_000_000
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+
+class ImageTooLargeError(ValueError):
+    """The image's dimensions or decoded size exceed the configured limits."""
+
+
+class UnsupportedMediaError(ValueError):
+    """The upload is in a format, or has a content, the analysis cannot read."""
+
+
+def decoded_size(size, mode):
+    """Bytes Pillow holds for a decoded image: multi-band pixels are stored in 4 bytes."""
+    if mode in ('1', 'L', 'P'):
+        bytes_per_pixel = 1
+    elif mode.startswith('I;16'):
+        bytes_per_pixel = 2
+    else:
+        bytes_per_pixel = 4
+    return size[0] * size[1] * bytes_per_pixel
+
+
+def open_image(image_bytes, max_pixels=None):
+    """
+    Open an encoded image, reading only its header.
+
+    Raises:
+        ImageTooLargeError: when it has more than max_pixels (default IMAGE_MAX_PIXELS) pixels
+    """
+    if max_pixels is None:
+        max_pixels = int(os.environ.get('IMAGE_MAX_PIXELS', DEFAULT_MAX_PIXELS))
+    try:
+        image = PIL.Image.open(io.BytesIO(image_bytes))
+    except PIL.Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"Image of {width}x{height} pixels exceeds the limit of {max_pixels} pixels")
+    return image
+
+
+def draft_image(image, max_edge=None, memory_budget=None):
+    """
+    Prepare a not yet decoded image to be decoded within max_edge and the memory budget.
+
+    JPEGs are switched to the smallest reduced-scale decode whose longest edge
+    still reaches max_edge; other formats decode at full size. Changes
+    image.size to the size that will be decoded.
+
+    Args:
+        image: Image from open_image, before anything loaded its pixels
+        max_edge: Longest edge the caller needs, or None for full resolution
+        memory_budget: Bytes the decoded pixels may take (default IMAGE_MEMORY_BUDGET_MB)
+
+    Returns:
+        The decode scale (1, 2, 4 or 8)
+
+    Raises:
+        ImageTooLargeError: when even the reduced decode exceeds the budget
+    """
+    if memory_budget is None:
+        memory_budget = int(os.environ.get('IMAGE_MEMORY_BUDGET_MB', DEFAULT_MEMORY_BUDGET_MB)) * 1024 * 1024
+    original_size = image.size
+    if image.format == 'JPEG' and max_edge is not None and max(original_size) > max_edge:
+        ratio = max_edge / max(original_size)
+        image.draft(image.mode, (max(1, round(original_size[0] * ratio)), max(1, round(original_size[1] * ratio))))
+    if decoded_size(image.size, image.mode) > memory_budget:
+        raise ImageTooLargeError(
+            f"Decoding the {original_size[0]}x{original_size[1]} image at {image.size[0]}x{image.size[1]} needs "
+            f"{decoded_size(image.size, image.mode) / 1024 / 1024:.0f} MB, over the "
+            f"{memory_budget / 1024 / 1024:.0f} MB budget"
+        )
+    return round(original_size[0] / image.size[0])
+
+
+def resolve_preprocess_config(speed, overrides=None):
+    """
+    Merge request-level overrides into the defaults for a speed tier.
+
+    Args:
+        speed: Speed tier ('regular', 'fast', 'super-fast')
+        overrides: Optional dict with any of 'max_edge', 'format', 'quality'
+
+    Returns:
+        Dict with 'max_edge', 'format' and 'quality'
+    """
+    config = dict(DEFAULT_PREPROCESS_CONFIG.get(speed, DEFAULT_PREPROCESS_CONFIG['fast']))
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            config[key] = value
+    config['format'] = config['format'].upper()
+    if config['format'] == 'JPG':
+        config['format'] = 'JPEG'
+    if config['format'] not in FORMAT_MIME_TYPES:
+        raise ValueError(f"Unsupported output format: {config['format']}")
+    return config
+
+
+def preprocess_image(image, original_bytes, max_edge, format='JPEG', quality=85, memory_budget=None):
+    """
+    Orient, downscale, strip metadata and re-encode an image.
+
+    Args:
+        image: Opened PIL image; when its pixels are not loaded yet it is decoded
+            at reduced scale (see draft_image) and downscaled in place
+        original_bytes: Size of the uploaded (decoded) image in bytes
+        max_edge: Longest edge of the output image in pixels
+        format: 'JPEG' or 'WEBP'
+        quality: Encoder quality (1-100)
+        memory_budget: Bytes the decoded pixels may take (see draft_image)
+
+    Returns:
+        Tuple of (blob dict for the Gemini SDK, stats dict)
+
+    Raises:
+        ImageTooLargeError: when the image cannot be decoded within the memory budget
+    """
+    start_time = time.time()
+    original_size = image.size
+    decode_scale = draft_image(image, max_edge, memory_budget)
+
+    # Downscaled before the EXIF rotation, which copies the image: the longest
+    # edge is the same either way, and only the small image gets copied
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), PIL.Image.Resampling.LANCZOS)
+    image = PIL.ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    save_kwargs = {'quality': quality}
+    if format == 'JPEG':
+        save_kwargs.update(optimize=True, progressive=True)
+    elif format == 'WEBP':
+        save_kwargs.update(method=4)
+    # Saving without passing exif/icc_profile drops all metadata.
+    image.save(output, format=format, **save_kwargs)
+    data = output.getvalue()
+
+    stats = {
+        "original_bytes": original_bytes,
+        "processed_bytes": len(data),
+        "original_size": list(original_size),
+        "processed_size": list(image.size),
+        "format": format,
+        "quality": quality,
+        "decode_scale": decode_scale,
+        "duration": time.time() - start_time
+    }
+    return {"mime_type": FORMAT_MIME_TYPES[format], "data": data}, stats
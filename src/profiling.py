@@ -0,0 +1,380 @@
+"""
+Opt-in, sampled profiling of the request path.
+
+When a warm instance turns slow, stage timings say which stage grew but not
+which code inside it: pydantic validation, PIL, JSON parsing or the SDK.
+PROFILE_MODE ('cprofile', 'tracemalloc' or 'both') profiles one invocation in
+PROFILE_SAMPLE_RATE (default 100; the first, then every Nth), decided once
+per request by its outermost begin(). With
+PROFILE_REQUEST_FLAG=1, a request can also ask for a profile with an
+X-Profile header or a 'profile' query parameter naming the mode.
+
+A session covers lambda_handler or, for direct callers, one
+analyze_egyptian_art_with_gemini call. cProfile is per thread, so every
+thread that works on the request joins the session with thread_scope(): the
+handler thread, the event loop thread running the analysis and the worker
+thread that decodes and resizes the image. Their profiles are merged. The
+event loop thread runs other requests' coroutines too, and those show up in
+the profile. A thread that is already being profiled for another session is
+left out and counted in 'skipped_threads'. tracemalloc is process-wide; it
+reports the peak and the largest allocations made during the session.
+
+Reports are written to PROFILE_DIR (default /tmp/egyptian-art-profiles) as a
+pstats file plus a compact JSON summary. PROFILE_DIR=none disables the files.
+The summary is also returned: in the analysis result under 'profile', and,
+for requested profiles, in the X-Profile response header.
+`python -m src.profiling` aggregates the dumped profiles into the top hot
+functions across invocations.
+
+Disabled, begin() is a dict lookup and thread_scope() returns a shared no-op
+context manager; cProfile, pstats and tracemalloc are not even imported.
+"""
+
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+MODES = ('cprofile', 'tracemalloc', 'both')
+DEFAULT_SAMPLE_RATE = 100
+DEFAULT_PROFILE_DIR = '/tmp/egyptian-art-profiles'
+# Functions and allocation sites in a summary
+SUMMARY_TOP = 10
+
+_config = None
+_counter = itertools.count()
+_sequence = itertools.count()
+_current = contextvars.ContextVar('profile_session', default=None)
+_threads = threading.local()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_sessions = 0
+_NO_SCOPE = contextlib.nullcontext()
+
+
+def parse_profile_mode(value):
+    """
+    Read a profiling mode from the environment or a request: one of MODES, or off.
+
+    Returns:
+        The mode, or None for '', 'off', '0' and 'false'
+
+    Raises:
+        ValueError: for anything else
+    """
+    mode = (value or '').strip().lower()
+    if mode in ('', 'off', '0', 'false', 'none'):
+        return None
+    if mode in ('1', 'true', 'on'):
+        return 'cprofile'
+    if mode not in MODES:
+        raise ValueError(f"Invalid profile mode {value!r}: expected one of {', '.join(MODES)} or off")
+    return mode
+
+
+def configure(mode=None, sample_rate=None, profile_dir=None, allow_request=None):
+    """Set the profiling configuration; anything not given comes from the environment."""
+    global _config
+    profile_dir = profile_dir or os.environ.get('PROFILE_DIR', DEFAULT_PROFILE_DIR)
+    _config = {
+        'mode': parse_profile_mode(mode if mode is not None else os.environ.get('PROFILE_MODE')),
+        'sample_rate': max(1, sample_rate or int(os.environ.get('PROFILE_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))),
+        'profile_dir': None if profile_dir.lower() == 'none' else profile_dir,
+        'allow_request': (allow_request if allow_request is not None
+                          else os.environ.get('PROFILE_REQUEST_FLAG') == '1'),
+    }
+    return _config
+
+
+def requested_mode(event):
+    """The mode an API Gateway event asks for, when request flags are allowed; None otherwise."""
+    config = _config or configure()
+    if not config['allow_request']:
+        return None
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    value = headers.get('x-profile') or (event.get('queryStringParameters') or {}).get('profile')
+    try:
+        return parse_profile_mode(value)
+    except ValueError:
+        return None
+
+
+def begin(label, mode=None):
+    """
+    Start a profiling session for this request when it is sampled, or when mode asks for one.
+
+    Only the outermost call of a request decides: inside a request that has
+    already been sampled or passed over, begin() returns None and the caller
+    only joins the request's session with thread_scope(). It also returns None
+    when profiling is off. Otherwise the returned session (an empty one when
+    the request is not sampled) must be ended with finish().
+    """
+    config = _config or configure()
+    if mode is None and config['mode'] is None:
+        return None
+    if _current.get() is not None:
+        return None
+    if mode is not None:
+        # Asked for by the request, which gets the summary back
+        return ProfileSession(label, mode, inline=True)
+    if next(_counter) % config['sample_rate']:
+        return UnsampledRequest()
+    return ProfileSession(label, config['mode'])
+
+
+def thread_scope():
+    """Context manager that profiles the current thread as part of the active session, if any."""
+    session = _current.get()
+    if session is None or not session.cprofile:
+        return _NO_SCOPE
+    return session.thread_scope()
+
+
+def call_in_scope(function, *args):
+    """function(*args) inside thread_scope(), e.g. as the target of asyncio.to_thread."""
+    with thread_scope():
+        return function(*args)
+
+
+def bind(coroutine):
+    """Run coroutine in the active session (if any), e.g. when it is handed to another thread's event loop."""
+    session = _current.get()
+    if session is None:
+        return coroutine
+
+    async def in_session():
+        _current.set(session)
+        return await coroutine
+
+    return in_session()
+
+
+def _start_tracemalloc():
+    global _tracemalloc_sessions
+    import tracemalloc
+    with _tracemalloc_lock:
+        if _tracemalloc_sessions == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            before = None
+        else:
+            before = tracemalloc.take_snapshot()
+        _tracemalloc_sessions += 1
+        tracemalloc.reset_peak()
+    return before
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_sessions
+    import tracemalloc
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        _tracemalloc_sessions -= 1
+        if _tracemalloc_sessions == 0:
+            tracemalloc.stop()
+    return snapshot, peak
+
+
+def _function_name(key):
+    filename, line, name = key
+    if filename == '~':
+        # Built-ins are keyed as ('~', 0, '<built-in method ...>')
+        return name
+    return f"{'/'.join(filename.split(os.sep)[-2:])}:{line}({name})"
+
+
+class UnsampledRequest:
+    """Stands in for the session of a request that is not sampled, so the calls nested in it do not sample either."""
+
+    cprofile = False
+    inline = False
+
+    def __init__(self):
+        self._token = _current.set(self)
+
+    def finish(self):
+        _current.reset(self._token)
+        return None
+
+
+class ProfileSession:
+    """One profiled request: per-thread cProfile profiles and/or a tracemalloc window."""
+
+    def __init__(self, label, mode, inline=False):
+        self.label = label
+        self.mode = mode
+        self.inline = inline
+        self.cprofile = mode in ('cprofile', 'both')
+        self.tracemalloc = mode in ('tracemalloc', 'both')
+        self.skipped_threads = 0
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        self._before = _start_tracemalloc() if self.tracemalloc else None
+        self._token = _current.set(self)
+
+    @contextlib.contextmanager
+    def thread_scope(self):
+        if getattr(_threads, 'busy', False):
+            # cProfile replaces the thread's profile function; two at once would cut each other off
+            with self._lock:
+                self.skipped_threads += 1
+            yield
+            return
+        import cProfile
+        profile = cProfile.Profile()
+        _threads.busy = True
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _threads.busy = False
+            with self._lock:
+                self._profiles.append(profile)
+
+    def finish(self):
+        """End the session, write its files and return its summary."""
+        _current.reset(self._token)
+        duration = time.perf_counter() - self._start
+        report = {
+            "label": self.label,
+            "mode": self.mode,
+            "started_at": round(self._started_at, 3),
+            "duration_ms": round(duration * 1000, 2),
+        }
+        if self.tracemalloc:
+            # Stopped first, so building the summary does not count as the request's allocations
+            snapshot, peak = _stop_tracemalloc()
+        stats = None
+        if self._profiles:
+            import pstats
+            stats = pstats.Stats(*self._profiles)
+            hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:SUMMARY_TOP]
+            report["threads"] = len(self._profiles)
+            report["skipped_threads"] = self.skipped_threads
+            report["functions"] = [
+                {"function": _function_name(key), "calls": calls, "tottime_ms": round(tottime * 1000, 3),
+                 "cumtime_ms": round(cumtime * 1000, 3)}
+                for key, (_, calls, tottime, cumtime, _) in hot
+            ]
+        if self.tracemalloc:
+            if self._before is not None:
+                allocations = [(stat.traceback, stat.size_diff, stat.count_diff)
+                               for stat in snapshot.compare_to(self._before, 'lineno')]
+            else:
+                allocations = [(stat.traceback, stat.size, stat.count) for stat in snapshot.statistics('lineno')]
+            allocations.sort(key=lambda allocation: allocation[1], reverse=True)
+            report["memory"] = {
+                "peak_mb": round(peak / 1024 / 1024, 3),
+                "allocations": [
+                    {"line": f"{'/'.join(trace[0].filename.split(os.sep)[-2:])}:{trace[0].lineno}",
+                     "size_kb": round(size / 1024, 1), "count": count}
+                    for trace, size, count in allocations[:SUMMARY_TOP] if size > 0
+                ]
+            }
+        self._write(report, stats)
+        return report
+
+    def _write(self, report, stats):
+        profile_dir = (_config or configure())['profile_dir']
+        if profile_dir is None:
+            return
+        name = f"{int(self._started_at * 1000)}-{os.getpid()}-{next(_sequence)}-{self.label}"
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            if stats is not None:
+                report["pstats_path"] = os.path.join(profile_dir, name + '.prof')
+                stats.dump_stats(report["pstats_path"])
+            with open(os.path.join(profile_dir, name + '.json'), 'w') as f:
+                json.dump(report, f, separators=(',', ':'))
+        except OSError as e:
+            report["write_error"] = str(e)
+
+
+def aggregate(paths, top=20, sort='tottime', label=None):
+    """
+    Merge dumped profiles into the top functions across invocations.
+
+    Args:
+        paths: Profile directories and/or .prof / .json files
+        top: Number of functions and allocation sites to return
+        sort: 'tottime', 'cumtime' or 'calls'
+        label: Only use sessions with this label ('lambda_handler', 'analysis')
+
+    Returns:
+        Dict with 'sessions', 'functions' (summed over sessions, with their share
+        of the total own time) and 'allocations' (summed size per line)
+    """
+    import glob
+    import pstats
+
+    reports = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+        for file in files:
+            if file.endswith('.prof'):
+                file = file[:-len('.prof')] + '.json'
+            with open(file) as f:
+                report = json.load(f)
+            if label is None or report.get("label") == label:
+                reports.append(report)
+
+    profiles = [report["pstats_path"] for report in reports if os.path.exists(report.get("pstats_path") or '')]
+    functions = []
+    if profiles:
+        stats = pstats.Stats(*profiles)
+        total = sum(tottime for _, _, tottime, _, _ in stats.stats.values()) or 1.0
+        column = {'tottime': 2, 'cumtime': 3, 'calls': 1}[sort]
+        for key, values in sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)[:top]:
+            _, calls, tottime, cumtime, _ = values
+            functions.append({"function": _function_name(key), "calls": calls,
+                              "tottime_ms": round(tottime * 1000, 3), "cumtime_ms": round(cumtime * 1000, 3),
+                              "share": round(tottime / total, 4)})
+    allocations = {}
+    for report in reports:
+        for allocation in report.get("memory", {}).get("allocations", []):
+            entry = allocations.setdefault(allocation["line"], {"line": allocation["line"], "size_kb": 0.0, "count": 0})
+            entry["size_kb"] += allocation["size_kb"]
+            entry["count"] += allocation["count"]
+    return {
+        "sessions": len(reports),
+        "profiled_sessions": len(profiles),
+        "functions": functions,
+        "allocations": sorted(allocations.values(), key=lambda entry: entry["size_kb"], reverse=True)[:top]
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Aggregate dumped profiles into the top hot functions')
+    parser.add_argument('paths', nargs='*', default=[os.environ.get('PROFILE_DIR', DEFAULT_PROFILE_DIR)],
+                        help='Profile directories or files (default: PROFILE_DIR)')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--sort', choices=('tottime', 'cumtime', 'calls'), default='tottime')
+    parser.add_argument('--label', help="Only sessions with this label, e.g. 'lambda_handler' or 'analysis'")
+    parser.add_argument('--json', action='store_true', help='Print the aggregate as JSON')
+    args = parser.parse_args()
+
+    result = aggregate(args.paths, args.top, args.sort, args.label)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"Sessions: {result['sessions']} ({result['profiled_sessions']} with cProfile data)")
+    if result['functions']:
+        print(f"\n{'own ms':>10} {'cum ms':>10} {'calls':>9} {'share':>6}  function")
+        for entry in result['functions']:
+            print(f"{entry['tottime_ms']:10.1f} {entry['cumtime_ms']:10.1f} {entry['calls']:9d} "
+                  f"{entry['share']:6.1%}  {entry['function']}")
+    if result['allocations']:
+        print(f"\n{'KB':>10} {'blocks':>9}  allocated at")
+        for entry in result['allocations']:
+            print(f"{entry['size_kb']:10.1f} {entry['count']:9d}  {entry['line']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Prompt registry: every (version, image type) prompt is built once, at import.
+
+A prompt is a constant prefix - the expert Egyptologist instructions, the
+same for every request of a version - and a short per-request suffix (the
+image type hint). Keeping them apart lets the prefix be stored model-side as
+cached content (see src.context_cache) while only the suffix is sent.
+
+Prompt ids ('v1:tomb') and prefix ids ('v1:1f3c9a2b7e40', which change
+whenever the prefix text does) are what caches and benchmarks key on.
+Bump PROMPT_VERSION whenever the prompt text or the response schema changes,
+so analyses produced by an older prompt are not served.
+"""
+
+import hashlib
+from typing import NamedTuple
+
+PROMPT_VERSION = "v1"
+IMAGE_TYPES = ('tomb', 'temple', 'other', 'unknown')
+
+V1_PREFIX = """You are an expert Egyptologist with deep knowledge of ancient Egyptian art, tomb paintings, temple reliefs, and ancient texts. You are analyzing a photograph taken by a tourist of ancient Egyptian wall decorations, likely from famous sites like the Valley of the Kings, Karnak Temple, or other well-documented locations.
+
+**IMPORTANT: Use your extensive knowledge of famous Egyptian tombs and their documented artwork, especially:**
+- Valley of the Kings tombs (KV1-KV64), such as Tutankhamun's tomb (KV62)
+- Valley of the Queens tombs
+- Well-documented temple reliefs from Karnak, Luxor, Abu Simbel
+- Famous Egyptian artworks
+
+Your task is to analyze what is depicted in the captured image. Provide a detailed analysis in the specified JSON format.
+"""
+V1_HINT = "\n\nHint: The image most likely belongs to a {image_type}."
+
+
+class PromptVariant(NamedTuple):
+    prompt_id: str
+    prefix_id: str
+    prefix: str
+    suffix: str
+    text: str
+
+
+_versions = {}
+_variants = {}
+
+
+def register_prompt_version(version, prefix, hint_template):
+    """
+    Build and register the variants of a prompt version for every known image type.
+
+    Args:
+        version: Version id, e.g. 'v2'
+        prefix: The constant instructions
+        hint_template: Suffix for a known image type, with an {image_type} field
+    """
+    prefix_id = f"{version}:{hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:12]}"
+    _versions[version] = (prefix_id, prefix, hint_template)
+    for image_type in IMAGE_TYPES:
+        _variants[version, image_type] = _build(version, image_type)
+
+
+def _build(version, image_type):
+    prefix_id, prefix, hint_template = _versions[version]
+    suffix = hint_template.format(image_type=image_type) if image_type and image_type != 'unknown' else ''
+    return PromptVariant(f"{version}:{image_type or 'unknown'}", prefix_id, prefix, suffix, prefix + suffix)
+
+
+def get_prompt(image_type=None, version=PROMPT_VERSION):
+    """
+    The prompt for an image type hint.
+
+    Known image types come from the registry; any other hint (it is free text
+    from the request) is built on the spot and not kept.
+
+    Raises:
+        KeyError: for an unregistered version
+    """
+    variant = _variants.get((version, image_type or 'unknown'))
+    if variant is None:
+        variant = _build(version, image_type)
+    return variant
+
+
+def prompt_ids(version=None):
+    """Ids of the registered prompt variants, of one version or of all."""
+    return [variant.prompt_id for (variant_version, _), variant in _variants.items()
+            if version is None or variant_version == version]
+
+
+register_prompt_version("v1", V1_PREFIX, V1_HINT)
@@ -0,0 +1,260 @@
+"""
+Client-side quota management: rate limiting, circuit breaking and tier fallback.
+
+Each model gets a token-bucket limiter for requests per minute (RPM) and
+approximate input tokens per minute (TPM), shared by every thread and event
+loop in the process, so concurrent requests queue briefly instead of all
+running into the same 429. Each model also gets a circuit breaker that opens
+after consecutive throttling/availability failures; while it is open, requests
+move down the fallback ladder (by default pro -> flash -> flash-lite) instead
+of waiting for the tier to recover.
+
+Configuration (environment, read on first use or by configure()):
+  MODEL_LIMITS             JSON {"model": {"rpm": ..., "tpm": ...}} merged over DEFAULT_MODEL_LIMITS
+  MODEL_FALLBACK_LADDER    Comma-separated models, best first
+  RATE_LIMIT_MAX_WAIT      Longest a request queues for one tier, in seconds (default 5)
+  BREAKER_FAILURE_THRESHOLD  Consecutive failures that open a breaker (default 5, 0 disables)
+  BREAKER_RESET_SECONDS    How long a breaker stays open before a probe request (default 30)
+"""
+
+import json
+import math
+import os
+import threading
+import time
+
+# Paid tier 1 limits for the Gemini API
+DEFAULT_MODEL_LIMITS = {
+    'gemini-2.5-pro': {'rpm': 150, 'tpm': 2_000_000},
+    'gemini-2.5-flash': {'rpm': 1000, 'tpm': 1_000_000},
+    'gemini-2.5-flash-lite': {'rpm': 4000, 'tpm': 4_000_000},
+}
+DEFAULT_LADDER = ('gemini-2.5-pro', 'gemini-2.5-flash', 'gemini-2.5-flash-lite')
+DEFAULT_MAX_WAIT = 5.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_SECONDS = 30.0
+
+# Gemini bills small images as one 258-token tile and larger ones per 768px tile
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_PIXELS = 768
+CHARS_PER_TOKEN = 4
+
+
+class QuotaExhaustedError(Exception):
+    """No model on the ladder can take the request within the allowed wait."""
+
+
+def estimate_input_tokens(prompt_text, image_size):
+    """Approximate input tokens for one prompt plus one image of image_size (width, height)."""
+    width, height = image_size
+    if width <= 384 and height <= 384:
+        tiles = 1
+    else:
+        tiles = math.ceil(width / IMAGE_TILE_PIXELS) * math.ceil(height / IMAGE_TILE_PIXELS)
+    return len(prompt_text) // CHARS_PER_TOKEN + tiles * IMAGE_TILE_TOKENS
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount, max_wait):
+        """
+        Take amount tokens, possibly ahead of time.
+
+        Returns the seconds the caller must wait before using them, or None
+        (taking nothing) if that would be longer than max_wait.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def refund(self, amount):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class ModelLimiter:
+    """RPM and TPM buckets for one model; a limit of None is not enforced."""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def reserve(self, input_tokens, max_wait):
+        """Seconds to wait before sending the request, or None if over max_wait (nothing is taken)."""
+        request_wait = token_wait = 0.0
+        if self.requests is not None:
+            request_wait = self.requests.reserve(1, max_wait)
+            if request_wait is None:
+                return None
+        if self.tokens is not None:
+            token_wait = self.tokens.reserve(input_tokens, max_wait)
+            if token_wait is None:
+                if self.requests is not None:
+                    self.requests.refund(1)
+                return None
+        return max(request_wait, token_wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_seconds; then lets a single probe through (half-open), closing on
+    its success and reopening on its failure.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            # Also re-admits a probe if the previous one never reported back
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+_lock = threading.Lock()
+_config = None
+_limiters = {}
+_breakers = {}
+
+
+def configure(limits=None, ladder=None, max_wait=None, failure_threshold=None, reset_seconds=None):
+    """
+    Set the quota configuration and reset all limiters and breakers.
+
+    Arguments left as None come from the environment (see module docstring),
+    falling back to the defaults.
+    """
+    global _config
+    if limits is None:
+        limits = json.loads(os.environ.get('MODEL_LIMITS', '{}'))
+    merged = {name: dict(values) for name, values in DEFAULT_MODEL_LIMITS.items()}
+    for name, values in limits.items():
+        merged.setdefault(name, {}).update(values)
+    if ladder is None:
+        ladder = [name.strip() for name in os.environ.get('MODEL_FALLBACK_LADDER', '').split(',') if name.strip()]
+    with _lock:
+        _config = {
+            'limits': merged,
+            'ladder': tuple(ladder or DEFAULT_LADDER),
+            'max_wait': float(os.environ.get('RATE_LIMIT_MAX_WAIT', DEFAULT_MAX_WAIT)) if max_wait is None else max_wait,
+            'failure_threshold': int(os.environ.get('BREAKER_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD))
+                if failure_threshold is None else failure_threshold,
+            'reset_seconds': float(os.environ.get('BREAKER_RESET_SECONDS', DEFAULT_RESET_SECONDS))
+                if reset_seconds is None else reset_seconds,
+        }
+        _limiters.clear()
+        _breakers.clear()
+
+
+def _get_config():
+    if _config is None:
+        configure()
+    return _config
+
+
+def get_limiter(model_name):
+    """The shared limiter for model_name, or None for a model without configured limits."""
+    config = _get_config()
+    with _lock:
+        limiter = _limiters.get(model_name)
+        if limiter is None and model_name in config['limits']:
+            limits = config['limits'][model_name]
+            limiter = _limiters[model_name] = ModelLimiter(limits.get('rpm'), limits.get('tpm'))
+        return limiter
+
+
+def get_breaker(model_name):
+    config = _get_config()
+    with _lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            breaker = _breakers[model_name] = CircuitBreaker(config['failure_threshold'], config['reset_seconds'])
+        return breaker
+
+
+def fallback_ladder(model_name, allow_fallback=True):
+    """model_name followed by every model below it on the ladder."""
+    ladder = _get_config()['ladder']
+    if not allow_fallback:
+        return (model_name,)
+    if model_name in ladder:
+        return ladder[ladder.index(model_name):]
+    return (model_name,) + ladder
+
+
+def reserve_model(ladder, input_tokens, max_wait=None):
+    """
+    Pick the first model on the ladder whose breaker is closed and whose
+    limiter can take the request within max_wait.
+
+    Returns:
+        (model_name, seconds to wait before sending)
+
+    Raises:
+        QuotaExhaustedError: when every model is open or over its limits
+    """
+    if max_wait is None:
+        max_wait = _get_config()['max_wait']
+    skipped = []
+    for model_name in ladder:
+        if not get_breaker(model_name).allow():
+            skipped.append(f"{model_name} (circuit open)")
+            continue
+        limiter = get_limiter(model_name)
+        wait = 0.0 if limiter is None else limiter.reserve(input_tokens, max_wait)
+        if wait is None:
+            skipped.append(f"{model_name} (rate limited)")
+            continue
+        return model_name, wait
+    raise QuotaExhaustedError(f"No model available: {', '.join(skipped)}")
+
+
+def try_reserve(model_name, input_tokens):
+    """Take quota for one request only if it is available right now (used for hedges)."""
+    limiter = get_limiter(model_name)
+    return limiter is None or limiter.reserve(input_tokens, 0) is not None
@@ -0,0 +1,144 @@
+"""
+Retry and hedging policy for the Gemini call loop.
+
+Errors are classified by SDK exception type rather than by message text.
+Retries wait with decorrelated jitter (each delay is drawn between the base
+and three times the previous delay, capped), so callers that failed together
+do not retry together. Hedging fires a second, identical request once the
+first has been outstanding longer than a high percentile of recent latencies
+for that model, and takes whichever succeeds first.
+"""
+
+import asyncio
+import os
+import random
+import threading
+from collections import deque
+
+from google.api_core import exceptions as api_exceptions
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+DEFAULT_HEDGE_PERCENTILE = 0.95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.Aborted,
+    api_exceptions.Unknown,
+    ConnectionError,
+)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable_error(error):
+    """True for throttling, transient server and connection errors."""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, api_exceptions.GoogleAPICallError):
+        return False
+    # Transports that are not wrapped by google.api_core may still carry an HTTP status
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+class DecorrelatedJitterBackoff:
+    """Delays for successive retries: uniform(base, 3 * previous delay), capped."""
+
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=None):
+        self.base = base
+        self.cap = cap
+        self._previous = base
+        self._random = rng or random
+
+    def next_delay(self):
+        self._previous = min(self.cap, self._random.uniform(self.base, self._previous * 3))
+        return self._previous
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one model."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction, min_samples=DEFAULT_HEDGE_MIN_SAMPLES):
+        """Nearest-rank percentile, or None until min_samples latencies were recorded."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(model_name):
+    with _trackers_lock:
+        tracker = _trackers.get(model_name)
+        if tracker is None:
+            tracker = _trackers[model_name] = LatencyTracker()
+        return tracker
+
+
+def hedge_delay(model_name):
+    """
+    Seconds to wait before hedging a call to model_name, or None to not hedge.
+
+    HEDGE_ENABLED=0 turns hedging off; HEDGE_PERCENTILE (default 0.95) and
+    HEDGE_MIN_SAMPLES (default 20) tune when the second request is sent.
+    """
+    if os.environ.get('HEDGE_ENABLED', '1') == '0':
+        return None
+    return get_latency_tracker(model_name).percentile(
+        float(os.environ.get('HEDGE_PERCENTILE', DEFAULT_HEDGE_PERCENTILE)),
+        int(os.environ.get('HEDGE_MIN_SAMPLES', DEFAULT_HEDGE_MIN_SAMPLES))
+    )
+
+
+async def hedged_call(make_call, delay, deadline_remaining=None):
+    """
+    Await make_call(hedge=False); if it is still running after delay seconds,
+    also start make_call(hedge=True) and return the first successful result.
+
+    The losing call is cancelled. When every call fails, the primary's error
+    is raised. delay=None disables the hedge, and so does a deadline_remaining
+    of 2 * delay or less: the hedge would be sent with at most delay left.
+    """
+    primary = asyncio.ensure_future(make_call(hedge=False))
+    if delay is None or (deadline_remaining is not None and deadline_remaining <= 2 * delay):
+        return await primary
+
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.append(asyncio.ensure_future(make_call(hedge=True)))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    return task.result()
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Mark a losing call's error as retrieved
+                task.exception()
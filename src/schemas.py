@@ -35,4 +35,15 @@ class EgyptianArtAnalysis(BaseModel):
     interesting_detail: str = Field(
         description="Highlight an interesting detail of the picture that would be fascinating to a viewer."
     )
- 
\ No newline at end of file
+ 
+class PackedImageAnalysis(BaseModel):
+    image_index: int = Field(
+        description="Index of the image this analysis is for, as labelled before the image (Image 0, Image 1, ...)"
+    )
+    analysis: EgyptianArtAnalysis
+
+class PackedAnalyses(BaseModel):
+    """Analyses of several images answered in one call, one entry per image."""
+    analyses: List[PackedImageAnalysis] = Field(
+        description="One entry per image, in image order. Analyze every image on its own."
+    )
@@ -0,0 +1,386 @@
+"""
+Self-hosted HTTP entry point: an ASGI app with the lambda_handler contract.
+
+For running the analyzer as a long-lived container behind a load balancer.
+Requests take the same JSON, binary and multipart bodies and get the same
+response and error bodies as the Lambda; GET /jobs/{id} and job mode work
+as there. The difference is concurrency: one process serves many analyses
+at once over keep-alive connections, while the SDK client, models, caches
+and quota state are built once per process instead of once per instance.
+
+Analyses are awaited on the server's event loop, so a request waiting on
+the model holds no thread. Request parsing and the CPU-bound decode and
+preprocessing run on a thread pool sized to the in-flight limit
+(SERVER_MAX_IN_FLIGHT, default 32), which is the loop's default executor.
+Beyond the limit requests are refused at once with 429 and Retry-After
+instead of queueing, so a saturated worker pushes back to the load balancer.
+Streaming requests are sent event by event (stream_analysis_sse_async),
+which the Lambda runtime can only buffer; a client that disconnects
+cancels its analysis.
+
+GET /metrics serves the process's counters in the Prometheus text format
+(including how many identical analyses were coalesced, see src.singleflight) and
+GET /healthz answers 200, or 503 once shutdown has begun. The app needs no
+framework; serve it with any ASGI server, or run
+
+    python -m src.server --workers 4
+
+which uses uvicorn (pip install uvicorn). On SIGTERM uvicorn stops
+accepting connections and waits up to --graceful-timeout for in-flight
+requests before the lifespan shutdown closes the pool.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import src.lambda_function as lambda_function
+from src.json_codec import dumps
+from src.metrics import RequestMetrics, get_logger
+from src.singleflight import get_single_flight
+
+logger = get_logger('server')
+
+DEFAULT_MAX_IN_FLIGHT = 32
+# Larger bodies are refused with 413 before they are read
+DEFAULT_MAX_BODY_BYTES = 32 * 1024 * 1024
+# Time an analysis may take, in place of the Lambda invocation's remaining time
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 60.0
+# Longer than the usual 60 s load balancer idle timeout, so the balancer closes idle connections first
+DEFAULT_KEEP_ALIVE_SECONDS = 75
+DEFAULT_GRACEFUL_TIMEOUT_SECONDS = 30
+RETRY_AFTER_SECONDS = 1
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class RequestDeadline:
+    """Stands in for the Lambda context, so analysis_timeout() applies the server's request timeout."""
+
+    def __init__(self, timeout):
+        self.expires_at = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.expires_at - time.monotonic()) * 1000), 0)
+
+
+class ServerStats:
+    """Request counters of one server process, rendered for /metrics."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.responses = {}
+        self.rejected = 0
+        self.duration_counts = [0] * len(DURATION_BUCKETS)
+        self.duration_sum = 0.0
+        self.duration_count = 0
+        self.stage_seconds = {}
+
+    def record(self, status_code, duration, metrics=None):
+        self.responses[status_code] = self.responses.get(status_code, 0) + 1
+        self.duration_sum += duration
+        self.duration_count += 1
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                self.duration_counts[index] += 1
+        if metrics is not None:
+            for name, seconds in metrics.stages.items():
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+
+    def render(self, max_in_flight):
+        lines = [
+            "# TYPE egyptian_art_in_flight gauge",
+            f"egyptian_art_in_flight {self.in_flight}",
+            "# TYPE egyptian_art_max_in_flight gauge",
+            f"egyptian_art_max_in_flight {max_in_flight}",
+            "# TYPE egyptian_art_rejected_total counter",
+            f"egyptian_art_rejected_total {self.rejected}",
+            "# TYPE egyptian_art_responses_total counter",
+        ]
+        lines += [f'egyptian_art_responses_total{{status="{status}"}} {count}'
+                  for status, count in sorted(self.responses.items())]
+        lines.append("# TYPE egyptian_art_request_duration_seconds histogram")
+        lines += [f'egyptian_art_request_duration_seconds_bucket{{le="{bound}"}} {count}'
+                  for bound, count in zip(DURATION_BUCKETS, self.duration_counts)]
+        lines += [
+            f'egyptian_art_request_duration_seconds_bucket{{le="+Inf"}} {self.duration_count}',
+            f"egyptian_art_request_duration_seconds_sum {self.duration_sum:.6f}",
+            f"egyptian_art_request_duration_seconds_count {self.duration_count}",
+            "# TYPE egyptian_art_stage_seconds_total counter",
+        ]
+        lines += [f'egyptian_art_stage_seconds_total{{stage="{name}"}} {seconds:.6f}'
+                  for name, seconds in sorted(self.stage_seconds.items())]
+        single_flight = get_single_flight().stats()
+        lines += [
+            "# TYPE egyptian_art_single_flight_calls_total counter",
+            f"egyptian_art_single_flight_calls_total {single_flight['calls']}",
+            "# TYPE egyptian_art_single_flight_coalesced_total counter",
+            f"egyptian_art_single_flight_coalesced_total {single_flight['coalesced']}",
+            "# TYPE egyptian_art_single_flight_failures_total counter",
+            f"egyptian_art_single_flight_failures_total {single_flight['failures']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _event(scope, body):
+    """The API Gateway event lambda_handler would get for this request, with the raw body as bytes."""
+    return {
+        'httpMethod': scope['method'],
+        'path': scope['path'],
+        'headers': {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']},
+        'queryStringParameters': dict(parse_qsl(scope['query_string'].decode('latin-1'))) or None,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+async def _send_response(send, response):
+    """Send a lambda_handler-style response dict."""
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        import base64
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    headers = [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+               for name, value in (response.get('headers') or {}).items()]
+    await send({'type': 'http.response.start', 'status': response['statusCode'], 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AnalyzerApp:
+    """
+    The ASGI application.
+
+    Args:
+        max_in_flight: Requests handled at once; more are refused with 429
+        max_body_bytes: Largest request body accepted
+        request_timeout: Seconds an analysis may take
+    """
+
+    def __init__(self, max_in_flight=None, max_body_bytes=None, request_timeout=None):
+        self.max_in_flight = max_in_flight or int(os.environ.get('SERVER_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT))
+        self.max_body_bytes = max_body_bytes or int(os.environ.get('SERVER_MAX_BODY_BYTES', DEFAULT_MAX_BODY_BYTES))
+        self.request_timeout = request_timeout or float(
+            os.environ.get('SERVER_REQUEST_TIMEOUT', DEFAULT_REQUEST_TIMEOUT_SECONDS))
+        self.stats = ServerStats()
+        self.shutting_down = False
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='analysis')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                loop = asyncio.get_running_loop()
+                # asyncio.to_thread() in the analysis path (decode, preprocessing) uses the pool too
+                loop.set_default_executor(self.executor)
+                try:
+                    # Import the analysis stack off the event loop, then build the models on it
+                    await loop.run_in_executor(self.executor, lambda_function._load_analyzer)
+                    from src.gemini_strategy import prewarm_models_async
+                    await prewarm_models_async()
+                except Exception as e:
+                    logger.exception("Startup failed: %s", e)
+                    await send({'type': 'lifespan.startup.failed', 'message': f"{type(e).__name__}: {e}"})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutting_down = True
+                # The pool is the loop's default executor: this waits for it from a thread of its own
+                await asyncio.get_running_loop().shutdown_default_executor()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        path, method = scope['path'], scope['method']
+        if method == 'GET' and path == '/metrics':
+            await _send_response(send, {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'text/plain; version=0.0.4'},
+                'body': self.stats.render(self.max_in_flight)
+            })
+            return
+        if method == 'GET' and path == '/healthz':
+            await _send_response(send, {
+                'statusCode': 503 if self.shutting_down else 200,
+                'headers': {'Content-Type': 'application/json'},
+                'body': dumps({'status': 'shutting_down' if self.shutting_down else 'ok',
+                               'in_flight': self.stats.in_flight}).decode('utf-8')
+            })
+            return
+
+        if self.stats.in_flight >= self.max_in_flight:
+            self.stats.rejected += 1
+            response = lambda_function.error_response(429, 'Server is at capacity. Retry shortly.')
+            response['headers']['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            await _send_response(send, response)
+            return
+
+        self.stats.in_flight += 1
+        start = time.perf_counter()
+        metrics = RequestMetrics()
+        status_code = 500
+        try:
+            body = await self._read_body(scope, receive)
+            if body is None:
+                response = lambda_function.error_response(
+                    413, f'Request body larger than {self.max_body_bytes} bytes.')
+            else:
+                response = await self._handle(_event(scope, body), metrics, receive, send)
+            if response is not None:
+                await _send_response(send, response)
+                status_code = response['statusCode']
+            else:
+                status_code = 200
+        finally:
+            self.stats.in_flight -= 1
+            self.stats.record(status_code, time.perf_counter() - start, metrics)
+
+    async def _read_body(self, scope, receive):
+        """The request body, or None when it exceeds max_body_bytes."""
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_body_bytes:
+                return None
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > self.max_body_bytes:
+                return None
+            more_body = message.get('more_body', False)
+        return bytes(body)
+
+    async def _load_analyzer(self):
+        """Import the analysis stack off the event loop, unless the lifespan startup already did."""
+        if lambda_function._analyzer is None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, lambda_function._load_analyzer)
+
+    async def _handle(self, event, metrics, receive, send):
+        """
+        Answer one request. Returns the response dict, or None when a
+        streaming response has already been sent.
+        """
+        loop = asyncio.get_running_loop()
+        context = RequestDeadline(self.request_timeout)
+        if event['httpMethod'] != 'POST':
+            return await loop.run_in_executor(self.executor, lambda_function.lambda_handler, event, context)
+
+        def parse():
+            try:
+                return lambda_function.parse_analysis_request(event, metrics)
+            except ValueError as e:
+                return lambda_function.error_response(400, str(e))
+
+        parsed = await loop.run_in_executor(self.executor, parse)
+        if isinstance(parsed, dict):
+            return parsed
+        params, image_bytes = parsed
+        if params['job']:
+            def submit():
+                try:
+                    return lambda_function.handle_analysis_request(event, context, params, image_bytes, metrics)
+                except Exception as e:
+                    return lambda_function.server_error_response(e)
+
+            return await loop.run_in_executor(self.executor, submit)
+
+        try:
+            lambda_function.log_analysis_request(params, image_bytes, metrics)
+            await self._load_analyzer()
+            if params['stream']:
+                return await self._stream(params, image_bytes, metrics, context, receive, send)
+            gemini_result = await lambda_function.run_analysis_async(
+                params, image_bytes, metrics, timeout=lambda_function.analysis_timeout(context))
+            metrics.emit()
+            return lambda_function.analysis_response(event, gemini_result, metrics)
+        except Exception as e:
+            return lambda_function.server_error_response(e)
+
+    async def _stream(self, params, image_bytes, metrics, context, receive, send):
+        """Send server-sent events as the analysis produces them, and cancel it if the client goes away."""
+        events = lambda_function.stream_analysis_sse_async(
+            params, image_bytes, metrics, timeout=lambda_function.analysis_timeout(context))
+
+        async def produce():
+            try:
+                async for chunk in events:
+                    await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            except Exception as e:
+                logger.exception("Streaming analysis failed: %s", e)
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'access-control-allow-origin', b'*'),
+            (b'content-type', lambda_function.EVENT_STREAM_TYPE.encode('latin-1')),
+            (b'cache-control', b'no-cache')
+        ]})
+        producer = asyncio.ensure_future(produce())
+        watcher = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait((producer, watcher), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            client_gone = watcher.done()
+            watcher.cancel()
+            if not producer.done():
+                # The client is gone (or this request was cancelled): stop the model call too
+                producer.cancel()
+                if client_gone:
+                    logger.info("Client disconnected; cancelled the streaming analysis")
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+            await events.aclose()
+        if not client_gone:
+            await send({'type': 'http.response.body', 'body': b''})
+        metrics.emit()
+        return None
+
+
+app = AnalyzerApp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the Egyptian art analyzer over HTTP (needs uvicorn)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=1, help='Server processes')
+    parser.add_argument('--max-in-flight', type=int, help=f'Analyses per process before 429 (default {DEFAULT_MAX_IN_FLIGHT})')
+    parser.add_argument('--keep-alive', type=int, default=DEFAULT_KEEP_ALIVE_SECONDS,
+                        help='Seconds an idle keep-alive connection is kept open')
+    parser.add_argument('--graceful-timeout', type=int, default=DEFAULT_GRACEFUL_TIMEOUT_SECONDS,
+                        help='Seconds in-flight requests get to finish on shutdown')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("python -m src.server needs uvicorn: pip install uvicorn "
+                         "(or serve src.server:app with another ASGI server)")
+    if args.max_in_flight:
+        # Worker processes build their app from the environment
+        os.environ['SERVER_MAX_IN_FLIGHT'] = str(args.max_in_flight)
+    uvicorn.run('src.server:app', host=args.host, port=args.port, workers=args.workers, lifespan='on',
+                timeout_keep_alive=args.keep_alive, timeout_graceful_shutdown=args.graceful_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Single-flight coalescing of identical in-flight analyses.
+
+When a client retries, or several users upload the same photo at once,
+identical analyses would otherwise run in parallel against the model. The
+first request for a key runs the call; requests for the same key that arrive
+while it is in flight wait for it and receive its result. Nothing is kept
+once the call finishes - that is the result cache's job. A failed call,
+whether it raised or returned a result whose failure_status is not
+'success', is handed to everyone who was already waiting for it: the key is
+removed before the result is published, so a request that arrives later never
+receives it and starts a new call instead.
+
+Calls are tracked with concurrent.futures.Future, which both threads and
+event loops can wait on, so callers on different event loops and plain
+threads coalesce with each other. A waiter that is cancelled or gives up on
+its own deadline leaves the call running for the others; when the call itself
+is cancelled, its waiters start a new one.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+
+def is_failure_result(result):
+    """Whether an analysis result reports a failure rather than raising one."""
+    return isinstance(result, dict) and result.get("failure_status", "success") != "success"
+
+
+class SingleFlight:
+    """
+    In-flight calls by key, with counters of how many requests joined one.
+
+    Args:
+        is_failure: Predicate telling which returned results count as failures
+    """
+
+    def __init__(self, is_failure=is_failure_result):
+        self.is_failure = is_failure
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def _join(self, key):
+        """(future, leader) for key: a new future when this caller runs the call."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            self.calls += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        # Removed before it resolves, so no request can join a finished call
+        with self._lock:
+            del self._calls[key]
+            if error is not None or self.is_failure(result):
+                self.failures += 1
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _abandon(self, key, future):
+        with self._lock:
+            del self._calls[key]
+        future.cancel()
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn() for key, or wait for the call already in flight for it.
+
+        Returns:
+            (result, shared) - shared is True when another caller's call answered
+
+        Raises:
+            Whatever fn raised, in every caller; TimeoutError when a waiter's
+            timeout passes first
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = fn()
+                except BaseException as e:
+                    if isinstance(e, Exception):
+                        self._finish(key, future, error=e)
+                    else:
+                        self._abandon(key, future)
+                    raise
+                self._finish(key, future, result)
+                return result, False
+            try:
+                return future.result(timeout), True
+            except concurrent.futures.CancelledError:
+                continue
+            except concurrent.futures.TimeoutError:
+                raise TimeoutError(f"Gave up waiting for the in-flight call after {timeout:.1f}s")
+
+    async def do_async(self, key, make_awaitable, timeout=None):
+        """Like do(), for coroutines: awaits make_awaitable() or the call in flight for key."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = await make_awaitable()
+                except BaseException as e:
+                    if isinstance(e, Exception):
+                        self._finish(key, future, error=e)
+                    else:
+                        self._abandon(key, future)
+                    raise
+                self._finish(key, future, result)
+                return result, False
+            try:
+                # Shielded: a waiter that is cancelled or times out must not cancel the shared call
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout), True
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Gave up waiting for the in-flight call after {timeout:.1f}s")
+
+    def stats(self):
+        """Counters for logging or /metrics."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "failures": self.failures,
+                "in_flight": len(self._calls)
+            }
+
+
+_default = SingleFlight()
+
+
+def get_single_flight():
+    """The process-wide SingleFlight used by the analysis API."""
+    return _default
@@ -0,0 +1,125 @@
+"""
+Incremental parsing of a streamed EgyptianArtAnalysis JSON document.
+
+The model emits the fields in schema order (picture_location, date,
+characters, ...), so each top-level field can be shown as soon as its value is
+closed, long before the whole document is finished. Items of list fields such
+as 'characters' are reported one by one as each object closes.
+"""
+
+import json
+
+STREAM_LIST_FIELDS = ('characters',)
+
+_OPENERS = '{['
+_CLOSERS = '}]'
+
+
+class IncrementalJSONParser:
+    """
+    Feed text chunks of one JSON object; get back the parts that completed.
+
+    Events are dicts:
+      {"type": "field", "name": ..., "value": ...} for every top-level field
+      {"type": "item", "name": ..., "index": ..., "value": ...} for every object
+          closed inside one of list_fields
+
+    Text before the opening brace (e.g. a markdown code fence) is ignored.
+    """
+
+    def __init__(self, list_fields=STREAM_LIST_FIELDS):
+        self.list_fields = set(list_fields)
+        self.text = ''
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._item_start = None
+        self._item_index = 0
+
+    def feed(self, chunk):
+        """Consume a chunk of text and return the list of events it completed."""
+        self.text += chunk
+        events = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            if self.done:
+                break
+            char = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:pos + 1])
+                        self._key_start = None
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = pos
+            elif char in _OPENERS:
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                elif self._depth == 3 and char == '{' and self._key in self.list_fields:
+                    self._item_start = pos
+            elif char in _CLOSERS:
+                if self._depth == 3 and self._item_start is not None:
+                    events.append({
+                        "type": "item",
+                        "name": self._key,
+                        "index": self._item_index,
+                        "value": json.loads(text[self._item_start:pos + 1])
+                    })
+                    self._item_start = None
+                    self._item_index += 1
+                elif self._depth == 1:
+                    self._close_field(text, pos, events)
+                    self.done = True
+                self._depth -= 1
+            elif self._depth == 1:
+                if char == ':':
+                    self._expect_key = False
+                    self._value_start = pos + 1
+                elif char == ',':
+                    self._close_field(text, pos, events)
+                    self._expect_key = True
+        self._pos = len(text)
+        return events
+
+    def _close_field(self, text, end, events):
+        if self._value_start is None:
+            return
+        events.append({
+            "type": "field",
+            "name": self._key,
+            "value": json.loads(text[self._value_start:end])
+        })
+        self._value_start = None
+        self._item_index = 0
+
+
+def analysis_events(analysis, list_fields=STREAM_LIST_FIELDS):
+    """The events a full parse of an already complete analysis dict would produce, in order."""
+    events = []
+    for name, value in analysis.items():
+        if name in list_fields:
+            for index, item in enumerate(value):
+                events.append({"type": "item", "name": name, "index": index, "value": item})
+        events.append({"type": "field", "name": name, "value": value})
+    return events
+
+
+def format_sse(event, data):
+    """Encode one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
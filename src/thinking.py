@@ -0,0 +1,179 @@
+"""
+Thinking budget limits and the adaptive budget policy.
+
+Gemini 2.5 models spend part of their output on internal reasoning
+("thinking"), bounded by a per-request thinking budget. More thinking tends
+to give better identifications but costs latency. With thinking_budget='auto'
+the policy picks a budget per (speed tier, image type) from what it has
+observed: among the candidate budgets whose average latency fits the latency
+target, the cheapest one whose quality is within QUALITY_TOLERANCE of the
+best. A small share of requests explores other budgets so the statistics stay
+current.
+
+Quality is a proxy computed from the answer itself (see quality_score); there
+is no ground truth at request time.
+"""
+
+import random
+import re
+import threading
+
+AUTO = 'auto'
+DEFAULT_THINKING_BUDGET = 2000
+
+# (min, max) budget per model; -1 asks the model to decide dynamically.
+# gemini-2.5-pro cannot turn thinking off; flash-lite thinks only when asked.
+THINKING_BUDGET_RANGES = {
+    'gemini-2.5-pro': (128, 32768),
+    'gemini-2.5-flash': (0, 24576),
+    'gemini-2.5-flash-lite': (512, 24576),
+}
+
+CANDIDATE_BUDGETS = {
+    'regular': (512, 1024, 2000, 4096, 8192),
+    'fast': (0, 512, 1024, 2000, 4096),
+    'super-fast': (0, 512, 1024, 2000),
+}
+
+MIN_SAMPLES = 5
+EXPLORE_RATE = 0.05
+QUALITY_TOLERANCE = 0.05
+EWMA_ALPHA = 0.2
+
+UNINFORMATIVE_ANSWERS = ('', 'unknown', 'unidentified', 'n/a', 'none')
+# Answers that start with one of these give up on naming anything ("Unidentified figure",
+# "Unknown deity", "Unknown (damaged)"); matched on whole words after normalization
+UNINFORMATIVE_PREFIXES = ('unknown', 'unidentified', 'unidentifiable', 'not identified', 'not identifiable',
+                          'cannot be identified', 'n/a', 'none', 'no text', 'no inscription', 'no ancient text',
+                          'no visible', 'no legible')
+_WORD = re.compile(r'[\w/]+')
+
+
+def informative(value):
+    """True for a string answer that names something, after lowercasing and dropping punctuation."""
+    if not isinstance(value, str):
+        return False
+    normalized = ' '.join(_WORD.findall(value.lower()))
+    return normalized not in UNINFORMATIVE_ANSWERS and not any(
+        normalized == prefix or normalized.startswith(prefix + ' ') for prefix in UNINFORMATIVE_PREFIXES)
+
+
+def parse_thinking_budget(value):
+    """
+    Read a thinking budget from a request or command line: 'auto' or an integer >= -1.
+
+    Raises:
+        ValueError: for anything else
+    """
+    if isinstance(value, str) and value.strip().lower() == AUTO:
+        return AUTO
+    try:
+        budget = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid thinking budget {value!r}: expected 'auto' or an integer")
+    if budget < -1:
+        raise ValueError(f"Invalid thinking budget {budget}: must be -1 (dynamic), 0 or more")
+    return budget
+
+
+def clamp_thinking_budget(model_name, budget):
+    """Fit a budget into what model_name accepts (0 stays 0 where thinking can be turned off)."""
+    if budget is None or budget == -1 or model_name not in THINKING_BUDGET_RANGES:
+        return budget
+    low, high = THINKING_BUDGET_RANGES[model_name]
+    if budget == 0 and model_name == 'gemini-2.5-flash-lite':
+        return 0
+    return max(low, min(high, budget))
+
+
+def quality_score(analysis):
+    """
+    Share of the answer that is informative, between 0 and 1.
+
+    Counts a located, dated picture with identified characters and a
+    translation attempt as fully informative.
+    """
+    characters = analysis.get('characters') or []
+    named = [c for c in characters if informative(c.get('character_name', ''))]
+    checks = [
+        informative(analysis.get('picture_location', '')),
+        informative(analysis.get('date', '')),
+        bool(characters) and len(named) == len(characters),
+        informative(analysis.get('ancient_text_translation', '')),
+    ]
+    return sum(checks) / len(checks)
+
+
+class _BudgetStats:
+    def __init__(self):
+        self.count = 0
+        self.latency = 0.0
+        self.quality = 0.0
+
+    def add(self, latency, quality):
+        if self.count == 0:
+            self.latency, self.quality = latency, quality
+        else:
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+            self.quality += EWMA_ALPHA * (quality - self.quality)
+        self.count += 1
+
+
+class ThinkingBudgetPolicy:
+    """Per (speed, image_type, budget) moving averages of latency and quality."""
+
+    def __init__(self, default_budget, candidates=None, min_samples=MIN_SAMPLES,
+                 explore_rate=EXPLORE_RATE, rng=None):
+        self.default_budget = default_budget
+        self.candidates = candidates or CANDIDATE_BUDGETS
+        self.min_samples = min_samples
+        self.explore_rate = explore_rate
+        self._random = rng or random.Random()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, speed, image_type, budget, latency, quality):
+        with self._lock:
+            stats = self._stats.setdefault((speed, image_type, budget), _BudgetStats())
+            stats.add(latency, quality)
+
+    def choose(self, speed, image_type, latency_target=None):
+        """Budget for the next request of this kind; see the module docstring."""
+        candidates = self.candidates.get(speed, self.candidates['fast'])
+        with self._lock:
+            if self._random.random() < self.explore_rate:
+                return self._random.choice(candidates)
+            known = {
+                budget: (stats.latency, stats.quality)
+                for budget in candidates
+                for stats in [self._stats.get((speed, image_type, budget))]
+                if stats is not None and stats.count >= self.min_samples
+            }
+        untried = [budget for budget in candidates if budget not in known]
+        if not known:
+            return self.default_budget if self.default_budget in candidates else candidates[len(candidates) // 2]
+        within = {budget: values for budget, values in known.items()
+                  if latency_target is None or values[0] <= latency_target}
+        if not within:
+            # Nothing meets the target: take the fastest budget, or try a cheaper unmeasured one
+            cheaper = [budget for budget in untried if budget < min(known)]
+            return max(cheaper) if cheaper else min(known, key=lambda budget: known[budget][0])
+        best_quality = max(quality for _, quality in within.values())
+        return min(budget for budget, (_, quality) in within.items()
+                   if quality >= best_quality - QUALITY_TOLERANCE)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """Current statistics, for logging or inspection."""
+        with self._lock:
+            return {
+                f"{speed}/{image_type}/{budget}": {
+                    "count": stats.count,
+                    "latency": round(stats.latency, 3),
+                    "quality": round(stats.quality, 3)
+                }
+                for (speed, image_type, budget), stats in self._stats.items()
+            }
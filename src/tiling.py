@@ -0,0 +1,226 @@
+"""
+Tiled analysis of panoramas and very large wall photos.
+
+Downscaling a 20+ MP wall to the model's input size makes hieroglyphs
+unreadable. Instead the image is split into overlapping tiles at (close to)
+full resolution, each tile is analyzed on its own, and the per-tile analyses
+are merged:
+
+- characters are placed on the whole image by mapping their tile-relative
+  location ("far left", "upper right", ...) through the tile's box; the same
+  character reported by two neighbouring tiles (the overlap) is kept once
+- translations are concatenated in reading order (rows top to bottom, tiles
+  left to right), without repeats
+- picture_location and date are the consensus answer: the one most similar
+  to all the others (by shared words)
+"""
+
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import PIL.ImageOps
+
+from src.preprocessing import draft_image, open_image, preprocess_image
+from src.thinking import informative
+
+DEFAULT_TILE_OVERLAP = 0.15
+DEFAULT_MAX_TILES = 12
+# Images at least this large, or this elongated, benefit from tiling
+TILING_MIN_PIXELS = 20_000_000
+TILING_MIN_ASPECT = 2.5
+
+# Tile-relative position words -> fraction of the tile width/height; longer
+# phrases first so 'far left' is not read as 'left'
+HORIZONTAL_POSITIONS = (('far left', 0.1), ('far right', 0.9), ('left', 0.25), ('right', 0.75),
+                        ('center', 0.5), ('centre', 0.5), ('middle', 0.5))
+VERTICAL_POSITIONS = (('top', 0.2), ('upper', 0.25), ('bottom', 0.8), ('lower', 0.75))
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def should_tile(size):
+    """True for images large or elongated enough that a single downscaled call loses detail."""
+    width, height = size
+    return width * height >= TILING_MIN_PIXELS or max(width, height) / max(1, min(width, height)) >= TILING_MIN_ASPECT
+
+
+def _axis_starts(length, tile, overlap):
+    if length <= tile:
+        return np.zeros(1, dtype=int), length
+    count = math.ceil((length - overlap) / (tile - overlap))
+    # Evenly spaced, so the real overlap is at least the requested one
+    return np.linspace(0, length - tile, count).round().astype(int), tile
+
+
+def plan_tiles(size, tile_edge, overlap=DEFAULT_TILE_OVERLAP, max_tiles=DEFAULT_MAX_TILES):
+    """
+    Tile boxes (left, top, right, bottom) covering an image, in reading order.
+
+    Tiles are tile_edge pixels square (smaller along a shorter image side) and
+    overlap by at least overlap times tile_edge. When that would take more than
+    max_tiles, the tiles grow (and are downscaled later) instead.
+    """
+    width, height = size
+    while True:
+        overlap_px = int(tile_edge * overlap)
+        columns, tile_width = _axis_starts(width, tile_edge, overlap_px)
+        rows, tile_height = _axis_starts(height, tile_edge, overlap_px)
+        if len(columns) * len(rows) <= max_tiles:
+            break
+        tile_edge = int(tile_edge * 1.25)
+    return [(int(left), int(top), int(left) + tile_width, int(top) + tile_height) for top in rows for left in columns]
+
+
+def split_image(image_bytes, preprocess_config, overlap=DEFAULT_TILE_OVERLAP, max_tiles=DEFAULT_MAX_TILES):
+    """
+    Cut an encoded image into overlapping tiles, each encoded for upload.
+
+    Args:
+        image_bytes: The encoded image
+        preprocess_config: 'max_edge' (the tile size), 'format' and 'quality' for the
+            tiles, as returned by src.preprocessing.resolve_preprocess_config
+        overlap: Overlap between neighbouring tiles as a fraction of the tile size
+        max_tiles: Upper bound on the number of tiles
+
+    Returns:
+        (list of encoded tile bytes, list of boxes, (width, height) of the upright image)
+    """
+    # Tiles are cut at full resolution, so the whole image is decoded, within the memory budget
+    image = open_image(image_bytes)
+    draft_image(image)
+    image = PIL.ImageOps.exif_transpose(image)
+    boxes = plan_tiles(image.size, preprocess_config['max_edge'], overlap, max_tiles)
+
+    def encode(box):
+        blob, _ = preprocess_image(image.crop(box), 0, **preprocess_config)
+        return blob['data']
+
+    # Pillow releases the GIL while encoding, so tiles encode in parallel
+    with ThreadPoolExecutor(max_workers=min(len(boxes), os.cpu_count() or 1)) as executor:
+        tiles = list(executor.map(encode, boxes))
+    return tiles, boxes, image.size
+
+
+def _position(location, positions):
+    location = location.lower()
+    for phrase, fraction in positions:
+        if phrase in location:
+            return fraction
+    return 0.5
+
+
+def _global_label(x, y):
+    horizontal = ('far left', 'left', 'center', 'right', 'far right')[min(4, int(x * 5))]
+    vertical = 'top ' if y < 1 / 3 else 'bottom ' if y > 2 / 3 else ''
+    return f"{vertical}{horizontal}"
+
+
+def consensus_answer(answers):
+    """The informative answer sharing the most words with the others (first one on ties)."""
+    answers = [answer for answer in answers if informative(answer)]
+    if not answers:
+        return ''
+    words = [set(_WORD.findall(answer.lower())) for answer in answers]
+
+    def support(index):
+        return sum(len(words[index] & other) / max(1, len(words[index] | other))
+                   for other_index, other in enumerate(words) if other_index != index)
+
+    return answers[max(range(len(answers)), key=lambda index: (support(index), -index))]
+
+
+def dedupe_characters(placed, same):
+    """
+    Count characters that several parts of a request (tiles, frames) saw once.
+
+    Args:
+        placed: Dicts holding a 'character' and where it was seen, in output order
+        same: Predicate (kept, candidate) telling whether candidate shows a kept character again
+
+    Returns:
+        The kept dicts; of duplicates, the character with the longest description is kept
+    """
+    kept = []
+    for candidate in placed:
+        duplicate = next((item for item in kept if same(item, candidate)), None)
+        if duplicate is None:
+            kept.append(candidate)
+        elif len(candidate['character'].get('description', '')) > len(duplicate['character'].get('description', '')):
+            duplicate['character'] = candidate['character']
+    return kept
+
+
+def merge_analyses(analyses, characters):
+    """
+    Merge the analysis dicts of several parts of a request into one analysis.
+
+    Translations are concatenated in order without repeats, picture_location
+    and date are the consensus answer, and the longest informative
+    interesting_detail wins.
+
+    Args:
+        analyses: Analysis dict per part, or None for parts that failed
+        characters: The merged characters (see dedupe_characters)
+
+    Returns:
+        Dict with the EgyptianArtAnalysis fields
+    """
+    succeeded = [analysis for analysis in analyses if analysis is not None]
+    translations = []
+    for analysis in succeeded:
+        translation = analysis.get('ancient_text_translation', '')
+        if informative(translation) and translation not in translations:
+            translations.append(translation)
+    details = [analysis.get('interesting_detail', '') for analysis in succeeded]
+    return {
+        'picture_location': consensus_answer([analysis.get('picture_location', '') for analysis in succeeded]),
+        'date': consensus_answer([analysis.get('date', '') for analysis in succeeded]),
+        'characters': characters,
+        'ancient_text_translation': '\n\n'.join(translations),
+        'interesting_detail': max((detail for detail in details if informative(detail)), key=len, default=''),
+    }
+
+
+def merge_tile_analyses(analyses, boxes, size, dedupe_distance=0.5):
+    """
+    Merge per-tile analysis dicts into one analysis of the whole image.
+
+    Args:
+        analyses: Analysis dict per tile, or None for tiles that failed
+        boxes: The tiles' boxes, in reading order
+        size: (width, height) of the whole image
+        dedupe_distance: Same-named characters from different tiles closer than
+            this fraction of a tile's width are counted once
+
+    Returns:
+        Dict with the EgyptianArtAnalysis fields
+    """
+    width, height = size
+    placed = []
+    for index, (analysis, box) in enumerate(zip(analyses, boxes)):
+        if analysis is None:
+            continue
+        left, top, right, bottom = box
+        for character in analysis.get('characters', []):
+            location = character.get('location', '')
+            x = left + _position(location, HORIZONTAL_POSITIONS) * (right - left)
+            y = top + _position(location, VERTICAL_POSITIONS) * (bottom - top)
+            placed.append({'tile': index, 'x': x, 'y': y, 'reach': dedupe_distance * (right - left),
+                           'name': character.get('character_name', '').strip().lower(), 'character': character})
+
+    def same(kept, candidate):
+        return (kept['tile'] != candidate['tile'] and informative(candidate['name'])
+                and kept['name'] == candidate['name']
+                and math.hypot(kept['x'] - candidate['x'], kept['y'] - candidate['y']) < candidate['reach'])
+
+    characters = dedupe_characters(placed, same)
+    characters.sort(key=lambda placed_character: (boxes[placed_character['tile']][1], placed_character['x']))
+    return merge_analyses(analyses, [
+        dict(placed_character['character'],
+             location=f"{_global_label(placed_character['x'] / width, placed_character['y'] / height)} "
+                      f"(tile {placed_character['tile'] + 1}: {placed_character['character'].get('location', '')})")
+        for placed_character in characters
+    ])
@@ -0,0 +1,4 @@
+import os
+
+# The handler module would otherwise start importing the analysis stack on import
+os.environ.setdefault('PRIME_ON_INIT', 'off')
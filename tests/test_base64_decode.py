@@ -0,0 +1,39 @@
+"""Image data that is not base64 is reported as invalid, not as missing."""
+
+import base64
+import binascii
+import json
+
+import pytest
+
+from src import lambda_function
+from src.lambda_function import decode_base64_image, parse_analysis_request
+
+
+def _event(image):
+    return {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'image': image})}
+
+
+@pytest.mark.parametrize('image', ['!!!', '====', '  \n'])
+def test_undecodable_image_is_invalid(image):
+    with pytest.raises(ValueError, match='Invalid image data'):
+        parse_analysis_request(_event(image))
+
+
+def test_empty_image_is_missing():
+    with pytest.raises(ValueError, match='No image data'):
+        parse_analysis_request(_event(''))
+
+
+def test_whitespace_is_ignored():
+    encoded = base64.b64encode(b'image bytes').decode('ascii')
+    assert bytes(decode_base64_image(encoded[:4] + '\n' + encoded[4:])) == b'image bytes'
+
+
+def test_chunked_path_rejects_foreign_characters(monkeypatch):
+    monkeypatch.setattr(lambda_function, 'BASE64_CHUNK_CHARS', 8)
+    encoded = base64.b64encode(b'some longer image bytes').decode('ascii')
+    assert bytes(decode_base64_image(encoded)) == b'some longer image bytes'
+    with pytest.raises(binascii.Error):
+        decode_base64_image(encoded[:12] + '!' + encoded[13:])
@@ -0,0 +1,42 @@
+"""speed='auto' is refused where the cascade cannot run, instead of silently running flash."""
+
+import asyncio
+import base64
+import json
+
+import pytest
+
+from src.lambda_function import parse_analysis_request
+
+
+def _event(**fields):
+    body = dict({'image': base64.b64encode(b'image bytes').decode('ascii')}, **fields)
+    return {'httpMethod': 'POST', 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(body)}
+
+
+def test_streaming_request_rejects_auto():
+    with pytest.raises(ValueError, match='auto'):
+        parse_analysis_request(_event(speed='auto', stream=True))
+
+
+def test_job_request_accepts_auto_with_stream_flag():
+    params, _ = parse_analysis_request(_event(speed='auto', stream=True, job=True))
+    assert params['speed'] == 'auto'
+
+
+def test_streaming_analysis_rejects_auto():
+    gemini_strategy = pytest.importorskip('src.gemini_strategy')
+
+    async def consume():
+        async for _ in gemini_strategy.analyze_egyptian_art_streaming_async(b'image bytes', speed='auto'):
+            pass
+
+    with pytest.raises(ValueError, match='auto'):
+        asyncio.run(consume())
+
+
+def test_packed_analysis_rejects_auto():
+    gemini_strategy = pytest.importorskip('src.gemini_strategy')
+
+    with pytest.raises(ValueError, match='auto'):
+        asyncio.run(gemini_strategy.analyze_egyptian_art_packed_async([(b'image bytes', 'unknown')], speed='auto'))